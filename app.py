@@ -1,13 +1,20 @@
 import streamlit as st
 import json
 import pandas as pd
+import numpy as np
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import uuid
+import sqlite3
+import hashlib
 from datetime import datetime, date, timedelta
 import random
+import os
 import time
-import altair as alt
+import threading
+import bisect
+import functools
+from collections import Counter
 
 # --- 設定: ページ設定（モバイルでサイドバーは初期非表示） ---
 st.set_page_config(page_title="Life Quest: Recovery", page_icon="⚔️", layout="wide", initial_sidebar_state="collapsed")
@@ -116,27 +123,131 @@ MONSTERS = {
     "魔王の影": {"rarity": "UR", "skill": "gold_up", "val": 2.0, "seed": "demon", "skill_name": "金運大アップ", "skill_desc": "報酬ゴールド+100%"},
 }
 
+class GachaSampler:
+    """レアリティの重み → モンスターを引く表（エイリアス法。1回あたり O(1)）。MONSTERS と重みから1回だけ作る。
+    レアリティのモンスターがいないときは、その重みを fallback（省略時は全モンスター）に均等に割り振る"""
+
+    def __init__(self, weights, fallback=None):
+        self.names = np.array(list(MONSTERS), dtype=object)
+        fallback = list(fallback) if fallback is not None else list(MONSTERS)
+        total = sum(weights.values())
+        p = np.zeros(len(self.names))
+        for rarity, w in weights.items():
+            pool = [i for i, m in enumerate(self.names) if MONSTERS[m]["rarity"] == rarity]
+            pool = pool or [i for i, m in enumerate(self.names) if m in fallback]
+            p[pool] += w / total / len(pool)
+        self.p = p
+        # Vose のエイリアス法：各枠 i を確率 prob[i] で i、残りで alias[i] にする
+        n = len(p)
+        scaled = p * n
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def draw_indices(self, k, rng=None):
+        """k 回分のモンスター番号（names の位置）の配列"""
+        rng = rng if rng is not None else np.random.default_rng()
+        slot = rng.integers(0, len(self.prob), k)
+        return np.where(rng.random(k) < self.prob[slot], slot, self.alias[slot])
+
+    def draw(self, k, rng=None):
+        """k 回分のモンスター名の配列"""
+        return self.names[self.draw_indices(k, rng)]
+
 # ガチャ確率（N 68% / R 25.8% / SR 5% / SSR 1% / UR 0.2%）※1000分率
 GACHA_WEIGHTS = {"N": 680, "R": 258, "SR": 50, "SSR": 10, "UR": 2}
-def gacha_draw():
-    pool_by_rarity = {"N": [], "R": [], "SR": [], "SSR": [], "UR": []}
-    for k, v in MONSTERS.items():
-        r = v["rarity"]
-        if r in pool_by_rarity:
-            pool_by_rarity[r].append(k)
-    r = random.choices(list(GACHA_WEIGHTS.keys()), weights=list(GACHA_WEIGHTS.values()), k=1)[0]
-    return random.choice(pool_by_rarity[r]) if pool_by_rarity[r] else random.choice(list(MONSTERS.keys()))
+GACHA_SAMPLER = GachaSampler(GACHA_WEIGHTS)
 
 # SR以上確定ガチャ（SR 80% / SSR 19% / UR 1%）
 SR_GUARANTEED_WEIGHTS = {"SR": 80, "SSR": 19, "UR": 1}
+SR_GUARANTEED_SAMPLER = GachaSampler(SR_GUARANTEED_WEIGHTS,
+                                     [m for m, d in MONSTERS.items() if d["rarity"] in ("SR", "SSR", "UR")])
+
+def gacha_odds_text(weights, sep=" / "):
+    """ショップに出す確率の表記（例: N 68% / R 25.8% …）。重みの表から作る"""
+    total = sum(weights.values())
+    return sep.join(f"{r} {round(w / total * 100, 2):g}%" for r, w in weights.items())
+
+def gacha_rng():
+    """召喚に使う乱数の系列（セッションごと）。secrets.toml の [app] gacha_seed があれば固定（テスト・再現用）"""
+    if 'gacha_rng' not in st.session_state:
+        seed = st.secrets.get("app", {}).get("gacha_seed")
+        st.session_state.gacha_rng = np.random.default_rng(None if seed in (None, "") else int(seed))
+    return st.session_state.gacha_rng
+
+def gacha_draw(k=None):
+    """通常召喚。k を省略すると1体の名前、k 回分なら名前のリスト"""
+    names = GACHA_SAMPLER.draw(1 if k is None else k, gacha_rng()).tolist()
+    return names[0] if k is None else names
+
 def gacha_draw_sr_guaranteed():
-    pool = {"SR": [], "SSR": [], "UR": []}
-    for k, v in MONSTERS.items():
-        r = v["rarity"]
-        if r in pool:
-            pool[r].append(k)
-    r = random.choices(list(SR_GUARANTEED_WEIGHTS.keys()), weights=list(SR_GUARANTEED_WEIGHTS.values()), k=1)[0]
-    return random.choice(pool[r]) if pool[r] else random.choice([m for m, d in MONSTERS.items() if d["rarity"] in ("SR","SSR","UR")])
+    return str(SR_GUARANTEED_SAMPLER.draw(1, gacha_rng())[0])
+
+# 召喚の価格（single: 1回・無料分以外、ten: 10連、weekly_ten: 週1回の10枚セット、monthly_sr: 月1回のSR以上確定）
+GACHA_PRICES = {"single": 100, "ten": 900, "weekly_ten": 800, "monthly_sr": 600}
+
+# 重複（最大レベル）時のピース変換ゴールド
+PIECE_GOLD = {"N": 10, "R": 30, "SR": 100, "SSR": 300, "UR": 1000}
+MONSTER_MAX_LEVEL = 10
+
+class InventoryIndex:
+    """inventory シートのインメモリ索引（所持モンスター → [シート行番号, レベル]）。
+    ガチャ結果はこの索引に対して解決し、commit() でレベル変更と新規行をまとめて書き込む。
+    （ws_i が BufferedWorksheet なら batch_update 1回 + append_rows 1回になる）
+    送信待ちで行番号がまだ無い行のレベル変更は、user_id と item_name で行を指定して送る（行番号は送信時に引く）"""
+
+    def __init__(self, df_i, user_id):
+        self.user_id = user_id
+        self._owned = {}
+        self._level_changes = {}   # 行番号 -> 新レベル
+        self._pending_levels = {}  # 送信待ちの行のモンスター名 -> 新レベル
+        self._new_rows = []
+        if df_i is not None and not df_i.empty:
+            # df_i の index はシートの行番号（送信待ちで行番号が未確定の行は 2 未満）
+            for row, rec in zip(df_i.index, df_i.to_dict('records')):
+                if str(rec.get('user_id', '')) == user_id and rec.get('item_name') not in self._owned:
+                    self._owned[rec.get('item_name')] = [int(row) if int(row) >= 2 else None, _int(rec.get('quantity', 1), 1)]
+
+    def owns(self, m_key):
+        return m_key in self._owned
+
+    def level(self, m_key):
+        return self._owned[m_key][1] if m_key in self._owned else 0
+
+    def resolve(self, m_key, level_up=True):
+        """1体分の結果を索引に反映。("new" | "level" | "piece", レベル, ピースG) を返す"""
+        rarity = MONSTERS[m_key]['rarity']
+        if m_key not in self._owned:
+            self._owned[m_key] = [None, 1]  # 行番号は append 後に確定
+            self._new_rows.append([self.user_id, m_key, rarity, 1, _timestamp()])
+            return "new", 1, 0
+        entry = self._owned[m_key]
+        if level_up and entry[1] < MONSTER_MAX_LEVEL:
+            entry[1] += 1
+            new_names = [r[1] for r in self._new_rows]
+            if entry[0] is not None:
+                self._level_changes[entry[0]] = entry[1]
+            elif m_key in new_names:
+                self._new_rows[new_names.index(m_key)][3] = entry[1]
+            else:
+                self._pending_levels[m_key] = entry[1]  # 前の操作の行がまだ送信待ち
+            return "level", entry[1], 0
+        return "piece", entry[1], PIECE_GOLD.get(rarity, 10)
+
+    def commit(self, ws_i):
+        for row, new_level in self._level_changes.items():
+            ws_i.update_field(row, "quantity", new_level)  # レベルは quantity 列
+        for values in self._new_rows:
+            ws_i.append_row(values)
+        for m_key, new_level in self._pending_levels.items():
+            ws_i.update_keyed({"user_id": self.user_id, "item_name": m_key}, "quantity", new_level)
+        self._level_changes, self._pending_levels, self._new_rows = {}, {}, []
 
 # --- 階層ミニイベント（宝箱・何もない・トラップ） ---
 FLOOR_EVENTS = [
@@ -165,21 +276,22 @@ def get_rebirth_title(rebirth_count):
     return f"輪廻の{rebirth_count}転生者"
 
 # --- 実績システム ---
+# counter: 判定に使うカウンタ（achievement_counters）、threshold: 達成に必要な値
 ACHIEVEMENTS = {
-    "first_task": {"name": "初めての一歩", "desc": "初めてタスクを完了", "reward": 50, "icon": "🎯"},
-    "task_10": {"name": "継続の力", "desc": "タスクを10回完了", "reward": 200, "icon": "🔥"},
-    "task_50": {"name": "努力家", "desc": "タスクを50回完了", "reward": 500, "icon": "⭐"},
-    "task_100": {"name": "百戦錬磨", "desc": "タスクを100回完了", "reward": 1000, "icon": "💎"},
-    "floor_10": {"name": "10階到達", "desc": "10階層に到達", "reward": 300, "icon": "🏔️"},
-    "floor_50": {"name": "中盤突破", "desc": "50階層に到達", "reward": 800, "icon": "⛰️"},
-    "floor_100": {"name": "最下層到達", "desc": "100階層に到達", "reward": 2000, "icon": "👑"},
-    "rebirth_1": {"name": "転生者", "desc": "1回転生", "reward": 1500, "icon": "🔄"},
-    "rebirth_5": {"name": "輪廻の達人", "desc": "5回転生", "reward": 5000, "icon": "🌟"},
-    "level_10": {"name": "レベル10", "desc": "レベル10に到達", "reward": 400, "icon": "📈"},
-    "level_20": {"name": "レベル20", "desc": "レベル20に到達", "reward": 1000, "icon": "📊"},
-    "gacha_ur": {"name": "UR獲得", "desc": "URモンスターを獲得", "reward": 2000, "icon": "✨"},
-    "streak_7": {"name": "1週間継続", "desc": "7日連続でタスク完了", "reward": 500, "icon": "🔥"},
-    "streak_30": {"name": "1ヶ月継続", "desc": "30日連続でタスク完了", "reward": 3000, "icon": "💪"},
+    "first_task": {"name": "初めての一歩", "desc": "初めてタスクを完了", "reward": 50, "icon": "🎯", "counter": "total_tasks", "threshold": 1},
+    "task_10": {"name": "継続の力", "desc": "タスクを10回完了", "reward": 200, "icon": "🔥", "counter": "total_tasks", "threshold": 10},
+    "task_50": {"name": "努力家", "desc": "タスクを50回完了", "reward": 500, "icon": "⭐", "counter": "total_tasks", "threshold": 50},
+    "task_100": {"name": "百戦錬磨", "desc": "タスクを100回完了", "reward": 1000, "icon": "💎", "counter": "total_tasks", "threshold": 100},
+    "floor_10": {"name": "10階到達", "desc": "10階層に到達", "reward": 300, "icon": "🏔️", "counter": "floor", "threshold": 10},
+    "floor_50": {"name": "中盤突破", "desc": "50階層に到達", "reward": 800, "icon": "⛰️", "counter": "floor", "threshold": 50},
+    "floor_100": {"name": "最下層到達", "desc": "100階層に到達", "reward": 2000, "icon": "👑", "counter": "floor", "threshold": 100},
+    "rebirth_1": {"name": "転生者", "desc": "1回転生", "reward": 1500, "icon": "🔄", "counter": "rebirth", "threshold": 1},
+    "rebirth_5": {"name": "輪廻の達人", "desc": "5回転生", "reward": 5000, "icon": "🌟", "counter": "rebirth", "threshold": 5},
+    "level_10": {"name": "レベル10", "desc": "レベル10に到達", "reward": 400, "icon": "📈", "counter": "level", "threshold": 10},
+    "level_20": {"name": "レベル20", "desc": "レベル20に到達", "reward": 1000, "icon": "📊", "counter": "level", "threshold": 20},
+    "gacha_ur": {"name": "UR獲得", "desc": "URモンスターを獲得", "reward": 2000, "icon": "✨", "counter": "ur_owned", "threshold": 1},
+    "streak_7": {"name": "1週間継続", "desc": "7日連続でタスク完了", "reward": 500, "icon": "🔥", "counter": "streak", "threshold": 7},
+    "streak_30": {"name": "1ヶ月継続", "desc": "30日連続でタスク完了", "reward": 3000, "icon": "💪", "counter": "streak", "threshold": 30},
 }
 
 # --- ログインボーナス（連続ログイン報酬） ---
@@ -222,10 +334,339 @@ RANDOM_BOX_REWARDS = [
     ("gacha", 1, "🎫 ガチャチケット1枚"),
 ]
 
+# --- タスク完了報酬（ゴールド＝経験値）とボスダメージの計算 ---
+# 乱数（遊び人の当たり外れ・天気）は呼び出し側で引いて渡す。同じ入力なら常に同じ結果になる
+WEATHERS = ["sunny", "rainy", "cloudy"]
+BOSS_WEAK_CYCLE = ["physical", "magic", "holy"]  # 曜日 % 3 → 今日のボスの弱点タイプ
+REWARD_TITLE_MULT = [("streak_7", 1.05, "🏅7日連続"), ("streak_30", 1.10, "🏅30日連続"), ("monthly_50", 1.05, "🏅今月50")]
+
+def task_reward_context(user, job_info, df_i, day_count, unlocked_set, event_active, today):
+    """報酬計算に使う状況（task_reward / task_rewards_batch の ctx）。値はすべてスカラー"""
+    buddy = user.get('equipped_pet', '') or ''
+    pet_skill, pet_level = "", 1
+    if buddy in MONSTERS:
+        pet_skill = MONSTERS[buddy]['skill']
+        if not df_i.empty:
+            buddy_items = df_i[df_i['item_name']==buddy]
+            if not buddy_items.empty:
+                pet_level = _int(buddy_items.iloc[0].get('quantity', 1))
+    ctx = {
+        "job_bonus": job_info['bonus'], "pet_skill": pet_skill, "pet_level": pet_level,
+        "day_count": int(day_count), "rebirth": _int(user.get('rebirth_count')),
+        "event_active": bool(event_active), "weekday": today.weekday(),
+    }
+    ctx.update({title: title in unlocked_set for title, _, _ in REWARD_TITLE_MULT})
+    return ctx
+
+def _scaled(val, mult, cond=True):
+    """cond の要素だけ val を mult 倍して切り捨て（最低1）"""
+    return np.where(cond, np.maximum(1, np.floor(val * mult)).astype(np.int64), val)
+
+def _codes(values, table):
+    """文字列（スカラーか配列）→ table 内の位置（無ければ -1）"""
+    values = np.asarray(values)
+    codes = np.full(values.shape, -1, dtype=np.int64)
+    for i, v in enumerate(table):
+        codes[values == v] = i
+    return codes
+
+def task_rewards_batch(task_names, ctx, jackpot=False, weather="cloudy"):
+    """タスク完了の報酬とボスダメージを配列でまとめて計算する（(報酬, ダメージ) の int64 配列）。
+    ctx の各値・jackpot（遊び人の当たり）・weather（WEATHERS）はスカラーか task_names と同じ長さの配列。
+    倍率をかける順番・切り捨ては1件ずつの計算と同じ"""
+    names = list(TASKS)
+    task_idx = _codes(task_names, names).ravel()
+    if (task_idx < 0).any():
+        raise KeyError(f"TASKS にないタスク: {np.asarray(task_names).ravel()[task_idx < 0][0]}")
+    base = np.array([int(TASKS[n]['reward'] * DIFFICULTY_MULT.get(TASKS[n].get('difficulty', 'normal'), 1.0))
+                     for n in names], dtype=np.int64)[task_idx]
+    types = np.array([TASK_TYPES.index(TASKS[n]['type']) for n in names], dtype=np.int64)[task_idx]
+    physical, magic, holy = (TASK_TYPES.index(t) for t in ("physical", "magic", "holy"))
+    get = lambda key, default: np.asarray(ctx.get(key, default))
+
+    # ジョブ → ペット（レベル1で1.1倍、レベルごとに+5%）。文字列は番号にしてから比べる
+    job = _codes(ctx.get("job_bonus", ""), TASK_TYPES + ["ALL_RANDOM"])
+    bonus = np.where(job == len(TASK_TYPES), np.where(np.asarray(jackpot), 2.0, 0.1), np.where(job == types, 1.5, 1.0))
+    pet_level = get("pet_level", 1)
+    pet_mult = 1.1 * (1.0 + (pet_level - 1) * 0.05)
+    bonus = np.where(_codes(ctx.get("pet_skill", ""), ["gold_up", "xp_up"]) >= 0, bonus * pet_mult, bonus)
+    val = np.maximum(1, np.floor(base * bonus)).astype(np.int64)
+
+    # 今日の最初のタスク1.5倍、2つ目+10・3つ目+20
+    day_count = get("day_count", 0)
+    val = _scaled(val, 1.5, day_count == 0)
+    val = val + np.where(day_count == 1, 10, np.where(day_count == 2, 20, 0))
+    # 転生 → 限定称号 → 週末イベント → 曜日 → 天気
+    rebirth = get("rebirth", 0)
+    val = _scaled(val, 1 + 0.1 * rebirth, rebirth > 0)
+    for title, mult, _ in REWARD_TITLE_MULT:
+        val = _scaled(val, mult, get(title, False))
+    val = _scaled(val, 1.2, get("event_active", False))
+    weekday = get("weekday", 2)
+    val = _scaled(val, np.where(weekday == 0, 1.1, np.where(weekday == 4, 1.05, 1.0)))
+    weather = _codes(weather, WEATHERS)
+    val = _scaled(val, 1.05, ((weather == WEATHERS.index("rainy")) & ((types == magic) | (types == holy)))
+                  | ((weather == WEATHERS.index("sunny")) & (types == physical)))
+
+    # ボス（弱点は日替わり）
+    is_weak = types == np.array([TASK_TYPES.index(t) for t in BOSS_WEAK_CYCLE])[weekday % 3]
+    return val, np.where(is_weak, val * 2, val)
+
+def task_reward_logs(task_name, ctx, jackpot=False, weather="cloudy"):
+    """バトルログ・完了画面に出すボーナスの内訳"""
+    t_type = TASKS[task_name]['type']
+    logs = []
+    if ctx["job_bonus"] == "ALL_RANDOM":
+        logs.append("🎰 JACKPOT!" if jackpot else "💀 失敗...")
+    elif ctx["job_bonus"] == t_type:
+        logs.append("⚔️ 職適正!")
+    if ctx["pet_skill"] == 'gold_up':
+        logs.append(f"💰 金運 Lv.{ctx['pet_level']}")
+    if ctx["pet_skill"] == 'xp_up':
+        logs.append(f"✨ 応援 Lv.{ctx['pet_level']}")
+    logs += {0: ["🌟初タスク!"], 1: ["🔥2つ目+10G"], 2: ["🔥3つ目+20G"]}.get(ctx["day_count"], [])
+    if ctx["rebirth"] > 0:
+        logs.append("✨転生")
+    logs += [label for title, _, label in REWARD_TITLE_MULT if ctx[title]]
+    if ctx["event_active"]:
+        logs.append("🎉 週末ボーナス!")
+    logs += {0: ["📅 月曜ボーナス!"], 4: ["📅 金曜ボーナス!"]}.get(ctx["weekday"], [])
+    if weather == "rainy" and t_type in ("magic", "holy"):
+        logs.append("🌧 雨の日室内ボーナス!")
+    elif weather == "sunny" and t_type == "physical":
+        logs.append("☀ 晴れ外出ボーナス!")
+    if t_type == BOSS_WEAK_CYCLE[ctx["weekday"] % 3]:
+        logs.append("🔥 弱点!")
+    return logs
+
+def task_reward(task_name, ctx, jackpot=False, weather="cloudy"):
+    """1件分の (報酬, ボスダメージ, ログ)。task_rewards_batch を1件で呼ぶ（表は作らない）"""
+    vals, dmgs = task_rewards_batch([task_name], ctx, bool(jackpot), weather)
+    return int(vals[0]), int(dmgs[0]), task_reward_logs(task_name, ctx, jackpot, weather)
+
+# --- タスク数の集計（tasks の直近分 + task_rollups の日別ロールアップ） ---
+def _task_counts(df_t, df_r, keys):
+    """(日数 day_no, *keys) ごとのタスク数。tasks とロールアップの両方にある組は多いほう
+    （ロールアップは完了ごとにも加算しているので、tasks に残っている日は同じ数になる）"""
+    parts = []
+    if not df_t.empty and 'created_at' in df_t.columns:
+        if 'day_no' not in df_t.columns:
+            df_t = _with_task_times(df_t)
+        parts.append(df_t[df_t['day_no'] >= 0].groupby(['day_no'] + keys).size())
+    if df_r is not None and not df_r.empty and 'count' in df_r.columns:
+        day = pd.to_datetime(df_r['day'].astype(str), format="%Y-%m-%d", errors="coerce")
+        rolled = df_r.assign(day_no=((day - pd.Timestamp(EPOCH_DATE)) // pd.Timedelta(days=1)).fillna(-1).astype('int64'),
+                             count=pd.to_numeric(df_r['count'], errors='coerce').fillna(0).astype(int))
+        parts.append(rolled[rolled['day_no'] >= 0].groupby(['day_no'] + keys)['count'].sum())
+    if not parts:
+        return pd.Series(dtype=int)
+    return pd.concat(parts, axis=1).max(axis=1).astype(int)
+
+def task_name_day_counts(df_t, df_r=None):
+    """(day_no, task_name) → 件数。タスク別・季節ミッション・タイプ別の集計はすべてこれから引く"""
+    return _task_counts(df_t, df_r, ['task_name'])
+
+def task_day_counts(df_t, df_r=None, name_day_counts=None):
+    """日数（day_no）→ その日のタスク数（日付順。tasks_archive へ移した日も含む）。
+    1回の描画で1回だけ作り、今日・昨日・今週・今月の件数と連続日数はこの索引から引く。
+    name_day_counts（task_name_day_counts の結果）があればそこから作る"""
+    if name_day_counts is not None:
+        if name_day_counts.empty:
+            return pd.Series(dtype='int64')
+        return name_day_counts.groupby(level='day_no').sum().sort_index()
+    return _task_counts(df_t, df_r, []).sort_index()
+
+def count_on(day_counts, d):
+    """d（date）のタスク数（task_day_counts の結果から）"""
+    return int(day_counts.get(_day_no(d), 0))
+
+def count_days_since(day_counts, start):
+    """start（date）以降の日のタスク数の合計（task_day_counts の結果から）"""
+    if day_counts.empty:
+        return 0
+    return int(day_counts[day_counts.index >= _day_no(start)].sum())
+
+# タスク数グラフの期間（表示名 → 日数。None は全期間）と、ブラウザへ送る点の上限
+CHART_RANGES = {"30日": 30, "90日": 90, "1年": 365, "全期間": None}
+CHART_MAX_POINTS = 120
+# まとめる単位（datetime64 の単位, 表示名）。点が上限に収まる最も細かい単位を使う
+CHART_BUCKETS = [("D", "日別"), ("W", "週別"), ("M", "月別"), ("Y", "年別")]
+
+def bucket_day_counts(day_counts, days=None, today=None, max_points=CHART_MAX_POINTS):
+    """task_day_counts の結果を直近 days 日（None は最初の日から）に絞り、点が max_points 以下になる単位
+    （日・週・月・年）で合計する。0件の日も数に入れる。(DataFrame（dt: 区切りの初日, Actions）, 単位の表示名)"""
+    end = _day_no(today or date.today())
+    if not day_counts.empty:
+        end = max(end, int(day_counts.index.max()))
+    start = end - days + 1 if days else (int(day_counts.index.min()) if not day_counts.empty else end)
+    day_nos = np.arange(start, end + 1)
+    counts = day_counts.reindex(day_nos, fill_value=0).to_numpy()
+    dts = day_nos.astype('datetime64[D]')
+    for unit, label in CHART_BUCKETS:
+        if unit == "D":
+            keys = dts
+        elif unit == "W":  # 月曜始まり（1970-01-01 は木曜）
+            keys = dts - ((day_nos + 3) % 7).astype('timedelta64[D]')
+        else:
+            keys = dts.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+        per_bucket = pd.Series(counts).groupby(keys).sum()
+        if len(per_bucket) <= max_points:
+            break
+    return pd.DataFrame({'dt': pd.to_datetime(per_bucket.index), 'Actions': per_bucket.to_numpy()}), label
+
+# タスク名 → 季節ミッションのキー・タイプ（カテゴリ）。判定は名前ごとに覚えておく（件数に上限あり）
+SEASONAL_TASK_KEYS = list(dict.fromkeys(m["task_key"] for m in SEASONAL_MISSIONS.values()))
+TASK_TYPES = ["physical", "magic", "holy", "item", "other"]
+TASK_TYPE_LABELS = {"physical": "肉体系", "magic": "魔法系", "holy": "浄化系", "item": "アイテム", "other": "その他"}
+
+@functools.lru_cache(maxsize=1024)
+def _task_category(name):
+    key = next((k for k in SEASONAL_TASK_KEYS if k in name), "")
+    task_type = TASKS[name]["type"] if name in TASKS else "item" if name == 'スタミナポーション使用' else "other"
+    return key, task_type
+
+def task_categories(names):
+    """タスク名の一覧 → task_key（季節ミッションのキー。無ければ ""）・type の DataFrame（カテゴリ型, index は名前）"""
+    pairs = [_task_category(str(n)) for n in names]
+    return pd.DataFrame({
+        "task_key": pd.Categorical([k for k, _ in pairs], categories=[""] + SEASONAL_TASK_KEYS),
+        "type": pd.Categorical([t for _, t in pairs], categories=TASK_TYPES),
+    }, index=list(names))
+
+def task_counts_by(name_day_counts, by="task_name", since=None):
+    """task_name_day_counts の結果を by（task_name / task_key / type）ごとに合計する。since（date）以降だけにもできる。
+    task_name は多い順。task_key / type はカテゴリ順（0件のカテゴリも含む）"""
+    counts = name_day_counts
+    if since is not None and not counts.empty:
+        counts = counts[counts.index.get_level_values('day_no') >= _day_no(since)]
+    per_name = counts.groupby(level='task_name').sum() if not counts.empty else pd.Series(dtype='int64')
+    if by == "task_name":
+        return per_name.sort_values(ascending=False)
+    column = task_categories(per_name.index)[by]
+    return per_name.groupby(column, observed=False).sum()
+
+def stats_snapshot_key(name_day_counts, df_i):
+    """統計・記録・図鑑セクションの集計の版（入力になる日別×タスク名の件数と inventory のハッシュ）"""
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(name_day_counts).to_numpy().tobytes())
+    if not df_i.empty:
+        cols = [c for c in ('item_name', 'quantity', 'rarity') if c in df_i.columns]
+        h.update(pd.util.hash_pandas_object(df_i[cols].astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+# タスク数の棒グラフ（Vega-Lite。データは bucket_day_counts）
+DAILY_CHART_SPEC = {"encoding": {"x": {"field": "dt", "type": "temporal"}, "y": {"field": "Actions", "type": "quantitative"},
+                                 "tooltip": [{"field": "dt", "type": "temporal"}, {"field": "Actions", "type": "quantitative"}]}}
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def stats_aggregates(key, today, _name_day_counts, _day_counts, _df_i):
+    """統計・記録・図鑑セクションで使う集計とグラフの仕様（history: 期間ごとの bucket_day_counts の結果、*_spec: Vega-Lite の dict）。
+    key（stats_snapshot_key）と today ごとに1回だけ作り、セクションを切り替えても作り直さない（古い版から捨てる）。
+    返した dict は共有されるので書き換えないこと"""
+    owned = set(_df_i['item_name'].unique()) if not _df_i.empty else set()
+    return {
+        "total_tasks": int(_day_counts.sum()),
+        "owned": owned,
+        "task_types": task_counts_by(_name_day_counts),
+        "history": ({r: bucket_day_counts(_day_counts, days, today) for r, days in CHART_RANGES.items()}
+                    if not _day_counts.empty else None),
+        "daily_spec": dict(DAILY_CHART_SPEC, mark={"type": "bar", "color": "#c9a227"}, height=300),
+        "records_spec": dict(DAILY_CHART_SPEC, mark={"type": "bar"}),
+    }
+
+def render_task_history(stats, spec, key):
+    """期間を選ぶラジオと、stats_aggregates で作っておいたタスク数の棒グラフ"""
+    choice = st.radio("期間", list(CHART_RANGES), index=1, horizontal=True, key=key, label_visibility="collapsed")
+    frame, label = stats["history"][choice]
+    encoding = dict(spec["encoding"], x=dict(spec["encoding"]["x"], title=label))
+    st.vega_lite_chart(frame, dict(spec, encoding=encoding), use_container_width=True)
+
+def bump_task_rollup(ws_r, df_r, user_id, task_name, task_type, gold):
+    """今日の task_name のロールアップ行を +1（無ければ追記）。ws_r が None（task_rollups シート無し）なら何もしない"""
+    if ws_r is None:
+        return
+    today = str(date.today())
+    row = None
+    if not df_r.empty and 'day' in df_r.columns:
+        mine = df_r[(df_r['day'].astype(str) == today) & (df_r['task_name'] == task_name)]
+        mine = mine[mine.index >= 2]  # 送信待ちの行（仮の行番号）は更新できない
+        if not mine.empty:
+            row = int(mine.index[0])
+    if row is None:
+        ws_r.append_row([user_id, today, task_name, task_type, 1, gold])
+    else:
+        ws_r.update_field(row, "count", _int(df_r.at[row, 'count']) + 1)
+        ws_r.update_field(row, "gold", _int(df_r.at[row, 'gold']) + gold)
+
+def split_tasks_for_archive(values, cutoff):
+    """tasks の生データ（ヘッダー行＋データ行）のうち created_at が cutoff より前の行。戻り値: (行, そのシートの行番号)"""
+    pos = _unique_headers(values[0]).index("created_at")
+    old, row_numbers = [], []
+    for row_no, r in enumerate(values[1:], 2):
+        created = str(r[pos]) if len(r) > pos else ""
+        if created and created[:10] < cutoff:
+            old.append(r)
+            row_numbers.append(row_no)
+    return old, row_numbers
+
+def backfill_task_rollups(header, old_rows, rollups):
+    """アーカイブする tasks 行のうち、ロールアップに数えられていない分のロールアップ行を返す。
+    rollups は task_rollups の生データ。ロールアップを入れる前の日は丸ごと、途中から入れた日は差分だけ"""
+    headers = _unique_headers(header)
+    pos = {c: headers.index(c) for c in ("user_id", "task_name", "type", "created_at")}
+    archived, types = {}, {}
+    for r in old_rows:
+        r = list(r) + [""] * (len(headers) - len(r))
+        key = (str(r[pos["user_id"]]), str(r[pos["created_at"]])[:10], str(r[pos["task_name"]]))
+        archived[key] = archived.get(key, 0) + 1
+        types[key] = r[pos["type"]]
+    counted = {}
+    if len(rollups) >= 2:
+        r_headers = _unique_headers(rollups[0])
+        r_pos = [r_headers.index(c) for c in ("user_id", "day", "task_name", "count")]
+        for r in rollups[1:]:
+            r = list(r) + [""] * (len(r_headers) - len(r))
+            key = tuple(str(r[i]) for i in r_pos[:3])
+            counted[key] = counted.get(key, 0) + _int(r[r_pos[3]])
+    return [[uid, day, name, types[(uid, day, name)], n - counted.get((uid, day, name), 0), 0]
+            for (uid, day, name), n in sorted(archived.items()) if n > counted.get((uid, day, name), 0)]
+
+def split_events_for_archive(users, events):
+    """events の生データのうち、users の生データの event_seq（スナップショット）以下の seq の行を返す。
+    戻り値: (移す行, そのシートの行番号)"""
+    if len(users) < 2 or len(events) < 2:
+        return [], []
+    u_headers, e_headers = _unique_headers(users[0]), _unique_headers(events[0])
+    if "event_seq" not in u_headers:
+        return [], []
+    u_pos = [u_headers.index(c) for c in ("user_id", "event_seq")]
+    e_pos = [e_headers.index(c) for c in ("user_id", "seq")]
+    covered = {}
+    for r in users[1:]:
+        r = list(r) + [""] * (len(u_headers) - len(r))
+        covered[str(r[u_pos[0]])] = _int(r[u_pos[1]])
+    old, row_numbers = [], []
+    for row_no, r in enumerate(events[1:], 2):
+        padded = list(r) + [""] * (len(e_headers) - len(r))
+        if 0 < _int(padded[e_pos[1]]) <= covered.get(str(padded[e_pos[0]]), 0):
+            old.append(r)
+            row_numbers.append(row_no)
+    return old, row_numbers
+
+def archive_cutoff(days, today=None):
+    """days 日より前を移すときの境目（YYYY-MM-DD）。
+    今月・今週・昨日の集計は tasks だけで行うので、それより新しい日は移さない"""
+    today = today or date.today()
+    keep_from = min(today.replace(day=1), today - timedelta(days=today.weekday() + 1))
+    return str(min(today - timedelta(days=days), keep_from))
+
 # --- ADHD向け・定期的に開きたくなる仕組み ---
-def calc_task_streak(df_t, user=None):
-    """連続でタスクを1回以上やった日数（今日から遡る）"""
-    if df_t.empty or 'dt' not in df_t.columns:
+def calc_task_streak(df_t, user=None, df_r=None, day_counts=None):
+    """連続でタスクを1回以上やった日数（今日から遡る）。df_r があればアーカイブ済みの日も数える。
+    day_counts（task_day_counts の結果）を渡せば作り直さない"""
+    if day_counts is None:
+        day_counts = task_day_counts(df_t, df_r)
+    if day_counts.empty:
         return 0
     today = date.today()
     streak = 0
@@ -239,7 +680,7 @@ def calc_task_streak(df_t, user=None):
             streak_protected = True
     
     while True:
-        cnt = len(df_t[df_t['dt'].dt.date == d])
+        cnt = count_on(day_counts, d)
         if cnt >= 1:
             streak += 1
             d -= timedelta(days=1)
@@ -524,11 +965,204 @@ img { image-rendering: pixelated; image-rendering: -moz-crisp-edges; image-rende
 """, unsafe_allow_html=True)
 
 # --- DB接続 ---
-def connect_to_gsheet():
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["gcp_service_account"]), scope)
-    client = gspread.authorize(creds)
-    return client.open_by_url(st.secrets["sheets"]["url"])
+class SheetsQuota:
+    """Sheets API の呼び出し口。トークンバケットで毎分のリクエスト数を抑え、429 / 5xx は
+    揺らぎ付きの指数バックオフで再試行する。同じ読み取りが重なったら（同じ rerun 内・同時実行）1回にまとめる。
+    throttled = レート制限で待たせた回数、retried = 再試行した回数。"""
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    # 追記・行削除は2回届くと結果が変わるので、送信前に断られたと分かる 429 だけ再試行する
+    # （5xx はサーバー側で反映済みのことがある）
+    UNAPPLIED_STATUS = (429,)
+
+    def __init__(self, rate_per_minute=60, burst=10, max_retries=5, max_backoff=32, read_memo_seconds=2.0):
+        self.rate = rate_per_minute / 60.0  # 1秒あたりの補充数
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.read_memo_seconds = read_memo_seconds
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._reads = {}     # key -> (取得時刻, 結果)
+        self._inflight = {}  # key -> threading.Event（取得中の読み取り）
+        self.calls = 0
+        self.throttled = 0
+        self.retried = 0
+
+    def _acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            if wait:
+                self.throttled += 1
+        if wait:
+            time.sleep(wait)
+
+    @staticmethod
+    def _status(e):
+        response = getattr(e, "response", None)
+        return getattr(e, "code", None) or getattr(response, "status_code", None)
+
+    def call(self, fn, *args, retry_status=RETRY_STATUS, **kwargs):
+        """fn をレート制限付きで呼ぶ。retry_status（既定は 429 / 5xx）は max_retries 回まで再試行"""
+        backoff = 1
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            with self._lock:
+                self.calls += 1
+            try:
+                return fn(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if self._status(e) not in retry_status or attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retried += 1
+                time.sleep(backoff * (0.5 + random.random()))
+                backoff = min(self.max_backoff, backoff * 2)
+
+    def read(self, key, fn, *args, **kwargs):
+        """読み取り用。read_memo_seconds 以内の同じ key は前回の結果を返し、取得中なら終わるのを待って共有する"""
+        while True:
+            with self._lock:
+                memo = self._reads.get(key)
+                if memo is not None and time.monotonic() - memo[0] < self.read_memo_seconds:
+                    return memo[1]
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self._inflight[key] = threading.Event()
+                    break
+            waiter.wait()
+        try:
+            result = self.call(fn, *args, **kwargs)
+            with self._lock:
+                self._reads[key] = (time.monotonic(), result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def invalidate_reads(self):
+        """書き込み後に呼ぶ（まとめた読み取り結果を捨てる）"""
+        with self._lock:
+            self._reads = {}
+
+
+def _row_runs(row_numbers):
+    """行番号の集合 → 連続した範囲 [(先頭, 末尾), ...]（下の範囲から順に）"""
+    runs = []
+    for row in sorted(set(row_numbers), reverse=True):
+        if runs and runs[-1][0] == row + 1:
+            runs[-1] = (row, runs[-1][1])
+        else:
+            runs.append((row, row))
+    return runs
+
+class SheetPool:
+    """プロセス全体で共有する gspread クライアント・スプレッドシート・ワークシートのハンドル。
+    認証と open_by_url / ワークシート一覧の取得は初回（または reset() 後）だけ行い、
+    以降の rerun では同じ HTTP セッション（keep-alive・トークン自動更新）を使い回す。"""
+    SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+    def __init__(self, service_account_info, url, quota=None, fake_latency=0.0):
+        self._service_account_info = dict(service_account_info)
+        self._url = url
+        self.quota = quota or SheetsQuota()
+        self._fake_latency = fake_latency
+        self._lock = threading.Lock()
+        self._creds = None
+        self._sh = None
+        self._worksheets = {}
+
+    def _token_expired(self):
+        # oauth2client は access_token_expired、google-auth は expired
+        return bool(getattr(self._creds, 'access_token_expired', False) or getattr(self._creds, 'expired', False))
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._sh is None and self._url.startswith("fake://"):
+                # ローカルのフェイク（fake_sheets.py）。認証不要
+                import fake_sheets
+                self._sh = fake_sheets.open_fake(self._url, TABLE_COLUMNS, {"users": [DEFAULT_USER_ROW]},
+                                                 latency=self._fake_latency)
+                self._worksheets = {}
+            elif self._sh is None:
+                self._creds = ServiceAccountCredentials.from_json_keyfile_dict(self._service_account_info, self.SCOPE)
+                client = gspread.authorize(self._creds)
+                self._sh = self.quota.call(client.open_by_url, self._url)
+                self._worksheets = {}
+            elif self._token_expired() and hasattr(self._creds, 'refresh'):
+                try:
+                    import httplib2
+                    self._creds.refresh(httplib2.Http())
+                except Exception:
+                    pass  # gspread 側のセッションが更新できる場合はそちらに任せる
+            return self._sh
+
+    def worksheet(self, name):
+        sh = self.spreadsheet()
+        with self._lock:
+            if name not in self._worksheets:
+                # ワークシート一覧はメタデータ1回でまとめて取得
+                self._worksheets = {ws.title: ws for ws in self.quota.call(sh.worksheets)}
+            if name not in self._worksheets:
+                raise gspread.exceptions.WorksheetNotFound(name)
+            return self._worksheets[name]
+
+    def has_worksheet(self, name):
+        """ワークシート一覧（初回だけ取得）に name があるか"""
+        sh = self.spreadsheet()
+        with self._lock:
+            if not self._worksheets:
+                self._worksheets = {ws.title: ws for ws in self.quota.call(sh.worksheets)}
+            return name in self._worksheets
+
+    def values_batch_get(self, ranges):
+        sh = self.spreadsheet()
+        return self.quota.read(("values_batch_get", tuple(ranges)), sh.values_batch_get, ranges)
+
+    def batch_update(self, name, data):
+        ws = self.worksheet(name)
+        self.quota.invalidate_reads()
+        return self.quota.call(ws.batch_update, data, value_input_option="USER_ENTERED")
+
+    def append_rows(self, name, rows):
+        ws = self.worksheet(name)
+        self.quota.invalidate_reads()
+        return self.quota.call(ws.append_rows, rows, retry_status=SheetsQuota.UNAPPLIED_STATUS)
+
+    def delete_rows(self, name, row_numbers):
+        """シートの行番号（1始まり）の行を削除する。連続した範囲ごとの deleteDimension を下から順に並べて
+        batch_update 1回で送る（上の行番号がずれない。読んだ後に末尾へ追記された行には触れない）"""
+        ws = self.worksheet(name)
+        requests = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS",
+                                                    "startIndex": start - 1, "endIndex": end}}}
+                    for start, end in _row_runs(row_numbers)]
+        if not requests:
+            return None
+        self.quota.invalidate_reads()
+        return self.quota.call(self.spreadsheet().batch_update, {"requests": requests},
+                               retry_status=SheetsQuota.UNAPPLIED_STATUS)
+
+    def reset(self):
+        """認証切れ・接続エラー時に呼ぶ（次回アクセスで再認証）"""
+        with self._lock:
+            self._creds = None
+            self._sh = None
+            self._worksheets = {}
+        self.quota.invalidate_reads()
+
+@st.cache_resource
+def get_sheet_pool():
+    """[sheets] rate_per_minute / burst でリクエストのレートを調整（既定 60回/分・バースト10）。
+    url = "fake://名前" ならメモリ上のフェイク（fake_latency_ms で1リクエストごとの遅延）"""
+    cfg = st.secrets["sheets"]
+    quota = SheetsQuota(rate_per_minute=float(cfg.get("rate_per_minute", 60)), burst=int(cfg.get("burst", 10)),
+                        max_retries=int(cfg.get("max_retries", 5)))
+    return SheetPool(st.secrets.get("gcp_service_account", {}), cfg["url"], quota,
+                     fake_latency=float(cfg.get("fake_latency_ms", 0)) / 1000)
 
 def _unique_headers(raw_headers):
     """重複・空ヘッダーを一意の名前にする（自前でレコード構築する用）。gspread には渡さない。"""
@@ -546,31 +1180,1015 @@ def _unique_headers(raw_headers):
             result.append(name)
     return result
 
-def get_user_data(ws):
-    """users シート: 列G(7)=rebirth_count, 列U(21)=title または titles があると転生が保存されます。
-    空ヘッダー・重複ヘッダーがあっても自前で読み取るためエラーにしない。"""
-    all_values = ws.get_all_values()
-    if not all_values:
-        raise ValueError("users シートが空です")
-    raw_headers = all_values[0]
-    if not raw_headers:
-        raise ValueError("users シートの1行目（ヘッダー）が空です")
-    headers = _unique_headers(raw_headers)
+class UserNotFound(ValueError):
+    """users に該当する user_id の行が無い（初回ログイン時は行を作る）"""
+
+
+class UsersIndex:
+    """users シートのヘッダー（列名→列番号）と user_id→行番号の索引。
+    一度シート全体から作れば、以降はヘッダー行とそのユーザーの1行だけを取得すればよい（users の行数に依存しない）。
+    取得したヘッダーや行の user_id が索引と食い違ったら、呼び出し側で全体を読み直して作り直す。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.raw_header = None
+        self.headers = []
+        self.rows = {}  # user_id -> 行番号
+
+    def _uid_pos(self):
+        # user_id 列を探す（ヘッダーが user_id または先頭列）
+        return self.headers.index("user_id") if "user_id" in self.headers else 0
+
+    def _record(self, row):
+        return dict(zip(self.headers, (list(row) + [""] * len(self.headers))[:len(self.headers)]))
+
+    def load(self, all_values):
+        """シート全体（ヘッダー行＋データ行）から索引を作り直す"""
+        if not all_values:
+            raise ValueError("users シートが空です")
+        if not all_values[0]:
+            raise ValueError("users シートの1行目（ヘッダー）が空です")
+        if len(all_values) < 2:
+            raise ValueError("users シートにデータ行がありません")
+        with self._lock:
+            self.raw_header = _trim_row(all_values[0])
+            self.headers = _unique_headers(all_values[0])
+            pos = self._uid_pos()
+            rows = {}
+            for i, row in enumerate(all_values[1:]):
+                uid = str(row[pos]).strip() if len(row) > pos else ""
+                if uid:
+                    rows.setdefault(uid, i + 2)
+            self.rows = rows
+
+    def find(self, user_id, all_values):
+        """シート全体から索引を作り直して (user, 行番号) を返す"""
+        self.load(all_values)
+        if user_id not in self.rows:
+            raise UserNotFound(f"users シートに user_id='{user_id}' の行がありません")
+        row = self.rows[user_id]
+        return self._record(all_values[row - 1]), row
+
+    def ranges(self, user_id):
+        """values_batch_get に渡す範囲。索引があればヘッダー行とそのユーザーの行だけ"""
+        with self._lock:
+            row = self.rows.get(user_id)
+            if self.raw_header is None or row is None:
+                return ["users"]
+            col = gspread.utils.rowcol_to_a1(1, len(self.headers)).rstrip("0123456789")
+            return [f"users!A1:{col}1", f"users!A{row}:{col}{row}"]
+
+    def record(self, user_id, head, row_values):
+        """ranges() で取った2範囲から (user, 行番号)。索引と食い違えば None（全体を読み直す）"""
+        with self._lock:
+            if not head or _trim_row(head[0]) != self.raw_header or not row_values or user_id not in self.rows:
+                return None
+            user = self._record(row_values[0])
+            if str(user[self.headers[self._uid_pos()]]).strip() != user_id:
+                return None
+            return user, self.rows[user_id]
+
+    def state(self):
+        """ディスクキャッシュ用（ヘッダーと user_id→行番号）"""
+        with self._lock:
+            return {"raw_header": self.raw_header, "rows": dict(self.rows)}
+
+    def restore(self, state):
+        with self._lock:
+            self.raw_header = state["raw_header"]
+            self.headers = _unique_headers(self.raw_header or [])
+            self.rows = dict(state["rows"])
+
+    def user_at(self, row):
+        """行番号 → user_id（索引に無ければ None）"""
+        with self._lock:
+            return next((uid for uid, r in self.rows.items() if r == row), None)
+
+    def col(self, name):
+        """列名 → 1始まりの列番号。シートに無い列名は SPREADSHEET.md の並び（USERS_COLUMNS）の位置"""
+        with self._lock:
+            if name in self.headers:
+                return self.headers.index(name) + 1
+        if name in USERS_COLUMNS:
+            return USERS_COLUMNS.index(name) + 1
+        raise KeyError(f"users に列 {name} がありません")
+
+# created_at などの書き込み形式（ISO 8601。読み込みは format="ISO8601" で1回だけ解析する）
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+EPOCH_DATE = date(1970, 1, 1)
+
+def _timestamp():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+def _day_no(d):
+    """date → 1970-01-01 からの日数（日付の比較を整数の比較にする用）"""
+    return (d - EPOCH_DATE).days
+
+def _with_task_times(df):
+    """created_at を解析した dt（datetime64）と day_no（日数, int64。解析できない行は -1）を足す。
+    取り込み時（全件・差分の読み込み、送信待ちの行）に1回だけ行い、以降の日付の絞り込みは day_no の比較で行う"""
+    if 'created_at' not in df.columns:
+        return df
+    raw = df['created_at'].astype(str)
+    dt = pd.to_datetime(raw, format="ISO8601", errors="coerce")
+    odd = dt.isna() & (raw != "")
+    if odd.any():  # 手で入力された別形式の日付（2025/1/2 など）だけ形式を推測する
+        dt[odd] = pd.to_datetime(raw[odd], format="mixed", errors="coerce")
+    day_no = ((dt - pd.Timestamp(EPOCH_DATE)) // pd.Timedelta(days=1)).fillna(-1).astype('int64')
+    return df.assign(dt=dt, day_no=day_no)
+
+def _records_frame(values):
+    """生データ（ヘッダー行＋データ行）から get_all_records() 相当の DataFrame を作る（数値文字列は数値化）"""
+    if len(values) < 2:
+        return pd.DataFrame()
+    headers = _unique_headers(values[0])
     records = []
-    for row in all_values[1:]:
-        row_padded = (row + [""] * len(headers))[:len(headers)]
-        records.append(dict(zip(headers, row_padded)))
-    df = pd.DataFrame(records)
-    if df.empty:
-        raise ValueError("users シートにデータ行がありません")
-    # user_id 列を探す（ヘッダーが user_id または先頭列）
-    uid_col = "user_id" if "user_id" in df.columns else df.columns[0]
-    matches = df[df[uid_col].astype(str).str.strip() == "u001"]
-    if matches.empty:
-        raise ValueError("users シートに user_id='u001' の行がありません")
-    idx = int(matches.index[0]) + 2
-    user_row = matches.iloc[0]
-    return user_row.to_dict(), idx
+    for row in values[1:]:
+        row_padded = (list(row) + [""] * len(headers))[:len(headers)]
+        records.append(dict(zip(headers, gspread.utils.numericise_all(row_padded))))
+    return pd.DataFrame(records)
+
+def _trim_row(row):
+    """比較用：文字列化して末尾の空セルを落とす（API は末尾の空セルを返さない）"""
+    row = [str(v) for v in row]
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+class AppendLogSync:
+    """追記のみのシート（tasks / events）の差分同期状態。前回の最終行から末尾だけを取得して
+    キャッシュ済みの DataFrame に追加する。重ねて取得した最終行・先頭行・ヘッダーが前回と
+    一致しなければ（編集・削除があった）全件再取得にフォールバックする。
+    mutable の列（行の中で書き換わる列）は先頭行・最終行の突き合わせで見ない。"""
+
+    def __init__(self, sheet="tasks", key="user_id", mutable=()):
+        self.sheet = sheet
+        self.key = key
+        self.mutable = tuple(mutable)
+        self.header = None
+        self.first = None   # 先頭データ行（削除検知用）
+        self.last = None    # 最終行（データが無ければヘッダー）
+        self.rows = 0       # 同期済みデータ行数
+        self.df = pd.DataFrame()
+        self.groups = {}    # key 列の値 -> df 上の位置（ユーザーごとの索引）
+        self.reloads = 0    # 同期済みの状態から全件再取得した回数（行の削除・編集を見つけた回数）
+
+    def _identity(self, row):
+        """先頭行・最終行の突き合わせ用（mutable の列は空にする）"""
+        row = _trim_row(row)
+        if self.mutable and self.header is not None:
+            headers = _unique_headers(self.header)
+            row = [v if i >= len(headers) or headers[i] not in self.mutable else "" for i, v in enumerate(row)]
+        return _trim_row(row)
+
+    def _index_from(self, start):
+        if self.key not in self.df.columns:
+            return
+        for pos, value in enumerate(self.df[self.key].iloc[start:].astype(str), start):
+            self.groups.setdefault(value, []).append(pos)
+
+    def frame(self, value):
+        """key 列が value の行だけの DataFrame（索引を引くだけで全体は走査しない）"""
+        positions = self.groups.get(str(value))
+        if not positions:
+            return self.df.iloc[0:0]
+        return self.df.iloc[positions].reset_index(drop=True)
+
+    def ranges(self):
+        """values_batch_get に渡す範囲。未同期なら全体、同期済みなら先頭2行＋末尾"""
+        if self.header is None:
+            return [self.sheet]
+        col = gspread.utils.rowcol_to_a1(1, max(1, len(self.header))).rstrip("0123456789")
+        return [f"{self.sheet}!A1:{col}2", f"{self.sheet}!A{self.rows + 1}:{col}"]
+
+    def state(self):
+        """ディスクキャッシュ用の (同期状態, DataFrame)"""
+        return {"header": self.header, "first": self.first, "last": self.last, "rows": self.rows}, self.df
+
+    def restore(self, meta, df):
+        """state() で保存した内容に戻す（次の同期は差分だけ。食い違えば apply_tail が全件再取得にする）"""
+        self.header, self.first, self.last, self.rows = meta["header"], meta["first"], meta["last"], meta["rows"]
+        self.df = df if 'day_no' in df.columns else _with_task_times(df)
+        self.groups = {}
+        self._index_from(0)
+
+    def load_full(self, values):
+        if self.header is not None:
+            self.reloads += 1
+        self.header = _trim_row(values[0]) if values else None
+        self.rows = max(0, len(values) - 1)
+        self.first = self._identity(values[1]) if self.rows else None
+        self.last = self._identity(values[-1]) if values else None
+        self.df = _with_task_times(_records_frame(values))
+        self.groups = {}
+        self._index_from(0)
+
+    def apply_tail(self, head, tail, base=None):
+        """差分を反映。整合しなければ False（呼び出し側で全件再取得）。
+        base は ranges() を作ったときの rows（取得している間に他のスレッドが反映した行は飛ばす）"""
+        if not head or _trim_row(head[0]) != self.header:
+            return False
+        if self.rows and (len(head) < 2 or self._identity(head[1]) != self.first):
+            return False
+        skip = 0 if base is None else self.rows - base
+        if skip < 0 or not tail:
+            return False
+        if skip >= len(tail):
+            return True  # 他のスレッドがこの取得より新しい分まで反映済み
+        if self._identity(tail[skip]) != self.last:
+            return False
+        self.append(tail[skip + 1:])
+        return True
+
+    def append(self, new_rows):
+        """新しく増えた行（ヘッダー無し）をキャッシュ済みの DataFrame に追加"""
+        if not new_rows:
+            return
+        new_df = _with_task_times(_records_frame([self.header] + new_rows))
+        start = len(self.df)
+        self.df = new_df if self.df.empty else pd.concat([self.df, new_df], ignore_index=True)
+        self._index_from(start)
+        if not self.rows:
+            self.first = self._identity(new_rows[0])
+        self.rows += len(new_rows)
+        self.last = self._identity(new_rows[-1])
+
+
+class UserRowsSync(AppendLogSync):
+    """追記に加えて行の中も書き換わるシート（inventory / task_rollups）の差分同期。
+    末尾の差分は AppendLogSync と同じ。書き換わるのはそのユーザーの行なので、refresh で選んだ行だけを
+    行番号で取り直して上書きする（1回の読み込みはシート全体ではなく、末尾の差分とそのユーザーの行だけ）。"""
+
+    def __init__(self, sheet, mutable, refresh=None):
+        super().__init__(sheet, mutable=mutable)
+        self.refresh = refresh  # そのユーザーの行の DataFrame → 取り直す行（bool）。None なら全部
+
+    def frame(self, value):
+        """key 列が value の行だけの DataFrame（index はシートの行番号）"""
+        positions = self.groups.get(str(value))
+        if not positions:
+            return pd.DataFrame(columns=self.df.columns)
+        df = self.df.iloc[positions].copy()
+        df.index = [p + 2 for p in positions]
+        return df
+
+    def user_runs(self, value):
+        """value の行のうち取り直す行（連続した行番号の範囲 [(先頭, 末尾), ...]）"""
+        df = self.frame(value)
+        if self.header is None or df.empty:
+            return []
+        if self.refresh is not None:
+            df = df[self.refresh(df)]
+        return sorted(_row_runs(df.index))
+
+    def run_ranges(self, runs):
+        col = gspread.utils.rowcol_to_a1(1, max(1, len(self.header))).rstrip("0123456789")
+        return [f"{self.sheet}!A{start}:{col}{end}" for start, end in runs]
+
+    def apply_rows(self, value, runs, values):
+        """user_runs() の範囲を取り直した値で上書きする。行の key が value でなければ（行が消えた・並びが変わった）False"""
+        positions, rows = [], []
+        for (start, end), got in zip(runs, values):
+            if len(got) != end - start + 1:
+                return False
+            positions += range(start - 2, end - 1)
+            rows += got
+        if not rows:
+            return True
+        if max(positions) >= len(self.df):
+            return False
+        new = _records_frame([self.header] + rows)
+        if self.key not in new.columns or (new[self.key].astype(str).str.strip() != str(value)).any():
+            return False
+        for c in new.columns:
+            if c not in self.df.columns:
+                return False
+            col = self.df.columns.get_loc(c)
+            try:
+                self.df.iloc[positions, col] = new[c].to_numpy()
+            except (TypeError, ValueError):  # 数値の列に文字列が入った（手で編集された）など
+                self.df[c] = self.df[c].astype(object)
+                self.df.iloc[positions, col] = new[c].to_numpy()
+        return True
+
+def _first_match(frame, key):
+    """key（{列名: 値}）にすべて一致する最初の行の index（シートの行番号）。無ければ None"""
+    if frame.empty or not all(c in frame.columns for c in key):
+        return None
+    mask = pd.Series(True, index=frame.index)
+    for c, v in key.items():
+        mask &= frame[c].astype(str) == str(v)
+    return int(frame.index[mask][0]) if mask.any() else None
+
+def _recent_rollup_rows(df):
+    """task_rollups のうち書き換わりうる行（完了ごとの +1 は今日の行だけ。日付の境目のずれを見て昨日から）"""
+    if 'day' not in df.columns:
+        return pd.Series(True, index=df.index)
+    return df['day'].astype(str) >= str(date.today() - timedelta(days=1))
+
+def load_snapshot(sh, user_id, task_sync, event_sync=None, users_index=None, inventory_sync=None, rollup_sync=None,
+                  lock=None):
+    """users（索引があれば1行だけ）と tasks・events・inventory（・task_rollups）の差分を values_batch_get 1回で取得する
+    （sh は Spreadsheet か SheetPool）。どのシートも全体を差分同期し、user_id の分は索引で取り出す。
+    inventory・task_rollups は末尾の差分に加えて、そのユーザーの書き換わりうる行だけを行番号で取り直す（UserRowsSync）。
+    lock を渡すと同期状態の読み書きだけをその中で行う（取得はロックの外なので他のユーザーを待たせない）。
+    戻り値: (user, u_idx, df_t, df_i, df_r, df_e, API呼び出し回数)。df_i / df_r の index はシートの行番号。"""
+    users_index = users_index if users_index is not None else UsersIndex()
+    inventory_sync = inventory_sync if inventory_sync is not None else UserRowsSync("inventory", ("quantity",))
+    lock = lock if lock is not None else threading.Lock()
+    logs = [task_sync, inventory_sync] + [log for log in (event_sync, rollup_sync) if log is not None]
+    user_ranges = users_index.ranges(user_id)
+    ranges, spans = list(user_ranges), []
+    with lock:
+        for log in logs:
+            log_ranges = log.ranges()
+            runs = log.user_runs(user_id) if isinstance(log, UserRowsSync) else []
+            spans.append((len(ranges), len(log_ranges), log.rows, runs))
+            ranges += log_ranges + (log.run_ranges(runs) if runs else [])
+    resp = sh.values_batch_get(ranges)
+    values = [vr.get('values', []) for vr in resp.get('valueRanges', [])]
+    values += [[]] * (len(ranges) - len(values))
+    api_calls = 1
+    for log, (start, n, base, runs) in zip(logs, spans):
+        with lock:
+            if n == 1:
+                if log.header is None or log.rows <= len(values[start]) - 1:  # 他のスレッドの方が新しければそのまま
+                    log.load_full(values[start])
+                synced = True
+            else:
+                synced = log.apply_tail(values[start], values[start + 1], base)
+                if synced and runs:
+                    synced = log.apply_rows(user_id, runs, values[start + n:start + n + len(runs)])
+        if not synced:
+            full = sh.values_batch_get([log.sheet]).get('valueRanges', [{}])[0].get('values', [])
+            api_calls += 1
+            with lock:
+                log.load_full(full)
+    found = users_index.record(user_id, values[0], values[1]) if len(user_ranges) == 2 else None
+    if found is None:
+        all_users = values[0]
+        if len(user_ranges) == 2:
+            all_users = sh.values_batch_get(["users"]).get('valueRanges', [{}])[0].get('values', [])
+            api_calls += 1
+        found = users_index.find(user_id, all_users)
+    user, u_idx = found
+    with lock:
+        df_e = event_sync.frame(user_id) if event_sync is not None else pd.DataFrame()
+        df_t = task_sync.frame(user_id)
+        df_i = inventory_sync.frame(user_id)
+        df_r = rollup_sync.frame(user_id) if rollup_sync is not None else pd.DataFrame()
+    return user, u_idx, df_t, df_i, df_r, df_e, api_calls
+
+# --- ストレージ（Google Sheets / ローカル SQLite） ---
+# 各テーブルの列（1始まりの列番号 = インデックス+1。SPREADSHEET.md と同じ並び）
+USERS_COLUMNS = [
+    "user_id", "name", "level", "current_xp", "next_level_xp", "gold", "rebirth_count", "dungeon_floor",
+    "login_streak", "last_login", "job_class", "pity_counter", "last_free_gacha", "daily_claimed",
+    "weekly_claimed", "boss_damage", "equipped_pet", "stamp_card", "weekly_boss_damage", "titles", "title",
+    "last_weekly_ticket", "last_monthly_sr_ticket", "buff_data", "achievements", "mission_claimed",
+    "boss_claimed", "streak_protect_date", "last_rest_week", "unlocked_titles", "zone_start", "zone_log",
+    "task_custom", "seasonal_claimed", "outing_start", "event_seq",
+]
+TASKS_COLUMNS = ["id", "user_id", "task_name", "type", "quantity", "status", "created_at"]
+INVENTORY_COLUMNS = ["user_id", "item_name", "rarity", "quantity", "acquired_at"]
+EVENTS_COLUMNS = ["user_id", "seq", "type", "payload", "created_at"]
+TASK_ROLLUP_COLUMNS = ["user_id", "day", "task_name", "type", "count", "gold"]
+TABLE_COLUMNS = {"users": USERS_COLUMNS, "tasks": TASKS_COLUMNS, "inventory": INVENTORY_COLUMNS,
+                 "events": EVENTS_COLUMNS, "tasks_archive": TASKS_COLUMNS, "task_rollups": TASK_ROLLUP_COLUMNS,
+                 "events_archive": EVENTS_COLUMNS}
+# 新規作成するストレージ（SQLite・フェイク）の u001 の初期値
+DEFAULT_USER = {"user_id": "u001", "name": "冒険者", "level": "1", "current_xp": "0", "next_level_xp": "100",
+                "gold": "0", "rebirth_count": "0", "dungeon_floor": "1", "job_class": "Novice"}
+DEFAULT_USER_ROW = [DEFAULT_USER.get(c, "") for c in USERS_COLUMNS]
+
+class StorageBackend:
+    """users 行・tasks ログ・inventory の読み書きインターフェース。
+    行番号・列番号はシートと同じ（1行目がヘッダー、データは2行目から）。各メソッドは発行したリクエスト数を返す。"""
+
+    def read_snapshot(self, user_id, with_events=False):
+        """user_id の (user, u_idx, df_t, df_i, df_r, df_e, リクエスト数) を返す。
+        df_t / df_i / df_r / df_e はそのユーザーの行だけ（df_i / df_r の index は行番号）。df_e は with_events のときだけ。
+        df_r は日別ロールアップ（task_rollups。テーブルが無ければ空）"""
+        raise NotImplementedError
+
+    # 行が消えたり並びが変わったりしたら変わる値（セッションのキャッシュ無効化に使う）
+    generation = 0
+
+    def has_table(self, table):
+        return table in TABLE_COLUMNS
+
+    def archive_tasks(self, cutoff):
+        """created_at が cutoff（YYYY-MM-DD）より前の tasks を tasks_archive へ移す。
+        ロールアップに無い日の分は先に task_rollups へ集計してから移す。戻り値: (移した行数, リクエスト数)"""
+        raise NotImplementedError
+
+    def archive_events(self):
+        """events のうち、各ユーザーの users 行（event_seq）に畳み込み済みの行を events_archive へ移す。
+        戻り値: (移した行数, リクエスト数)"""
+        raise NotImplementedError
+
+    def user_at(self, row):
+        """users の行番号 → user_id"""
+        raise NotImplementedError
+
+    def create_user(self, user_id, name):
+        """users に新しい行を追加する（初回ログイン時）"""
+        record = dict(DEFAULT_USER, user_id=user_id, name=name)
+        cols = {k: self.column("users", k) for k in record}
+        row = [""] * max(cols.values())
+        for k, col in cols.items():
+            row[col - 1] = record[k]
+        return self.append_events("users", [row])
+
+    def load_user(self, user_id, name):
+        """read_snapshot と同じ。行が無ければ作ってから読み直す（リクエスト数は作成分も含む）。
+        UserNotFound はここで捕まえる（rerun ごとに app.py が再実行されクラスが作り直されるため、
+        キャッシュ済みのストレージが投げた例外は main() 側の except では捕まらない）"""
+        try:
+            return self.read_snapshot(user_id)
+        except UserNotFound:
+            created = self.create_user(user_id, name)
+        *snapshot, calls = self.read_snapshot(user_id)
+        return (*snapshot, calls + created)
+
+    def apply_mutations(self, table, cells):
+        """cells: {(row, col): value} をまとめて更新"""
+        raise NotImplementedError
+
+    def find_row(self, table, key):
+        """key（{列名: 値}）にすべて一致する最初の行。戻り値: (行番号 or None, リクエスト数)"""
+        raise NotImplementedError
+
+    def append_events(self, table, rows):
+        """rows を末尾に追記"""
+        raise NotImplementedError
+
+    def column(self, table, name):
+        """列名 → 1始まりの列番号"""
+        return TABLE_COLUMNS[table].index(name) + 1
+
+    def reset(self):
+        pass
+
+
+class SheetsBackend(StorageBackend):
+    """Google スプレッドシート（SheetPool 経由）"""
+
+    def __init__(self, pool, disk_cache=None):
+        self.pool = pool
+        self._lock = threading.Lock()
+        # 以下はプロセスで共有：users のヘッダーと user_id→行番号、各シートの差分同期とユーザー別索引
+        self.users = UsersIndex()
+        self.tasks = AppendLogSync("tasks")
+        self.events = AppendLogSync("events")
+        self.inventory = UserRowsSync("inventory", mutable=("quantity",))
+        self.rollups = UserRowsSync("task_rollups", mutable=("count", "gold"), refresh=_recent_rollup_rows)
+        # ディスクキャッシュ（SnapshotDiskCache）があれば前回プロセスの同期状態から始める
+        self.disk_cache = disk_cache
+        self._saved = {}
+        self._archived = 0
+        self._restore()
+
+    @property
+    def generation(self):
+        """行が消えたら変わる値（このプロセスでのアーカイブ、または他プロセスの削除を差分同期が見つけて全件再取得したとき）"""
+        return (self._archived,) + tuple(sync.reloads for sync in self._syncs())
+
+    def _syncs(self):
+        return (self.tasks, self.events, self.inventory, self.rollups)
+
+    def _restore(self):
+        if self.disk_cache is None:
+            return
+        stored = self.disk_cache.read("users_index")
+        if stored is not None:
+            self.users.restore(stored[0])
+            self._saved["users_index"] = stored[0]
+        for sync in self._syncs():
+            stored = self.disk_cache.read(f"log:{sync.sheet}")
+            if stored is not None and len(stored[1]) == 1:
+                sync.restore(stored[0], stored[1][0])
+                self._saved[sync.sheet] = (sync.rows, sync.last)
+
+    def _persist(self):
+        """変わった同期状態だけディスクキャッシュへ（書き込みはバックグラウンド）"""
+        if self.disk_cache is None:
+            return
+        users_state = self.users.state()
+        if users_state["raw_header"] is not None and users_state != self._saved.get("users_index"):
+            self.disk_cache.save("users_index", users_state)
+            self._saved["users_index"] = users_state
+        for sync in self._syncs():
+            if sync.header is not None and (sync.rows, sync.last) != self._saved.get(sync.sheet):
+                meta, df = sync.state()
+                self.disk_cache.save(f"log:{sync.sheet}", meta, [df])
+                self._saved[sync.sheet] = (sync.rows, sync.last)
+
+    def read_snapshot(self, user_id, with_events=False):
+        # self._lock は各シートの同期状態を守るだけ（取得中は持たない）
+        snapshot = load_snapshot(self.pool, user_id, self.tasks, self.events if with_events else None, self.users,
+                                 self.inventory, self.rollups if self.has_table("task_rollups") else None, lock=self._lock)
+        with self._lock:
+            self._persist()
+        return snapshot
+
+    def has_table(self, table):
+        return self.pool.has_worksheet(table)
+
+    def archive_tasks(self, cutoff):
+        # アーカイブ → ロールアップ → 移した行の削除の順（途中で失敗しても集計が欠けないように）。
+        # 削除は読んだ行だけを行番号で消すので、読んだ後に追記された行（他のセッション・書き込みスレッド・他プロセス）は残る
+        resp = self.pool.values_batch_get(["tasks", "task_rollups"])
+        tasks, rollups = ([vr.get('values', []) for vr in resp.get('valueRanges', [])] + [[], []])[:2]
+        if len(tasks) < 2:
+            return 0, 1
+        old, row_numbers = split_tasks_for_archive(tasks, cutoff)
+        if not old:
+            return 0, 1
+        self.pool.append_rows("tasks_archive", old)
+        calls = 2
+        missing = backfill_task_rollups(tasks[0], old, rollups)
+        if missing:
+            self.pool.append_rows("task_rollups", missing)
+            calls += 1
+        self.pool.delete_rows("tasks", row_numbers)
+        with self._lock:
+            self.tasks = AppendLogSync("tasks")
+            self._archived += 1
+        return len(old), calls + 1
+
+    def archive_events(self):
+        # 移してから消す（途中で失敗しても events_archive には残っている）。消すのは読んだ行だけ
+        resp = self.pool.values_batch_get(["users", "events"])
+        users, events = ([vr.get('values', []) for vr in resp.get('valueRanges', [])] + [[], []])[:2]
+        old, row_numbers = split_events_for_archive(users, events)
+        if not old:
+            return 0, 1
+        self.pool.append_rows("events_archive", old)
+        self.pool.delete_rows("events", row_numbers)
+        with self._lock:
+            self.events = AppendLogSync("events")
+            self._archived += 1
+        return len(old), 3
+
+    def user_at(self, row):
+        if self.users.user_at(row) is None:
+            self.users.load(self.pool.values_batch_get(["users"]).get('valueRanges', [{}])[0].get('values', []))
+        return self.users.user_at(row)
+
+    def column(self, table, name):
+        if table == "users":
+            return self.users.col(name)
+        return super().column(table, name)
+
+    def find_row(self, table, key):
+        # 差分同期した内容から探す（末尾の差分を取るだけ。食い違えば全件再取得）
+        sync = {"inventory": self.inventory, "task_rollups": self.rollups}[table]
+        with self._lock:
+            ranges, base = sync.ranges(), sync.rows
+        values = [vr.get('values', []) for vr in self.pool.values_batch_get(ranges).get('valueRanges', [])]
+        values += [[]] * (len(ranges) - len(values))
+        calls = 1
+        with self._lock:
+            if len(ranges) == 1:
+                sync.load_full(values[0])
+                synced = True
+            else:
+                synced = sync.apply_tail(values[0], values[1], base)
+        if not synced:
+            full = self.pool.values_batch_get([sync.sheet]).get('valueRanges', [{}])[0].get('values', [])
+            calls += 1
+            with self._lock:
+                sync.load_full(full)
+        with self._lock:
+            frame = sync.frame(key.get(sync.key, ""))
+        return _first_match(frame, key), calls
+
+    def apply_mutations(self, table, cells):
+        data = [{"range": gspread.utils.rowcol_to_a1(r, c), "values": [[v]]} for (r, c), v in cells.items()]
+        self.pool.batch_update(table, data)
+        return 1
+
+    def append_events(self, table, rows):
+        try:
+            self.pool.append_rows(table, rows)
+            return 1
+        except Exception as e:
+            if not _is_ambiguous_error(e):
+                raise
+            # 5xx・通信エラーは届いているかもしれない。末尾を読んで入っていれば送り直さない（追記が二重にならない）
+            self.pool.quota.invalidate_reads()
+            values = self.pool.values_batch_get([table]).get('valueRanges', [{}])[0].get('values', [])
+            if not _rows_landed(values, rows):
+                raise
+            return 2
+
+    def reset(self):
+        with self._lock:
+            self.users = UsersIndex()
+            self.tasks = AppendLogSync("tasks")
+            self.events = AppendLogSync("events")
+            self.inventory = UserRowsSync("inventory", mutable=("quantity",))
+            self.rollups = UserRowsSync("task_rollups", mutable=("count", "gold"), refresh=_recent_rollup_rows)
+        self.pool.reset()
+
+
+class SQLiteBackend(StorageBackend):
+    """ローカル SQLite。row_no にシートの行番号を持たせ、同じ (行, 列) 指定の更新をそのまま適用する。
+    ネットワーク無しでローカルディスクの速度で動かす・ベンチマーク比較する用。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self.generation = 0  # このプロセスでアーカイブするたびに増える
+        with self._conn:
+            for table, columns in TABLE_COLUMNS.items():
+                cols = ", ".join(f'"{c}" TEXT' for c in columns)
+                self._conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (row_no INTEGER PRIMARY KEY, {cols})')
+                existing = {r[1] for r in self._conn.execute(f'PRAGMA table_info({table})')}
+                for c in columns:
+                    if c not in existing:  # 後から増えた列（event_seq など）
+                        self._conn.execute(f'ALTER TABLE {table} ADD COLUMN "{c}" TEXT')
+            self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_inventory_user_id ON inventory (user_id, item_name)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_events_user_seq ON events (user_id, seq)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_task_rollups_user_day ON task_rollups (user_id, day)')
+            if self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0:
+                self._insert("users", [DEFAULT_USER_ROW])
+
+    def _values(self, table, where="", params=()):
+        columns = TABLE_COLUMNS[table]
+        cols = ", ".join(f'"{c}"' for c in columns)
+        rows = self._conn.execute(f'SELECT {cols} FROM {table} {where} ORDER BY row_no', params).fetchall()
+        return [list(columns)] + [["" if v is None else v for v in row] for row in rows]
+
+    def _insert(self, table, rows):
+        columns = TABLE_COLUMNS[table]
+        next_row = (self._conn.execute(f'SELECT MAX(row_no) FROM {table}').fetchone()[0] or 1) + 1
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        self._conn.executemany(
+            f'INSERT INTO {table} VALUES ({placeholders})',
+            [[next_row + i] + [str(v) for v in (list(r) + [""] * len(columns))[:len(columns)]] for i, r in enumerate(rows)])
+
+    def _frame(self, table, where, params):
+        """条件に合う行の DataFrame（index は row_no）"""
+        columns = TABLE_COLUMNS[table]
+        cols = ", ".join(f'"{c}"' for c in columns)
+        rows = self._conn.execute(f'SELECT row_no, {cols} FROM {table} {where} ORDER BY row_no', params).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=columns)
+        df = _records_frame([list(columns)] + [["" if v is None else v for v in row[1:]] for row in rows])
+        df.index = [row[0] for row in rows]
+        return df
+
+    def read_snapshot(self, user_id, with_events=False):
+        # どのテーブルも user_id のインデックスで、そのユーザーの行だけを引く
+        with self._lock:
+            found = self._conn.execute('SELECT row_no FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            if found is None:
+                raise UserNotFound(f"users テーブルに user_id='{user_id}' の行がありません")
+            users = self._values("users", "WHERE row_no = ?", found)
+            user = dict(zip(_unique_headers(users[0]), users[1]))
+            df_t = _with_task_times(self._frame("tasks", "WHERE user_id = ?", (user_id,)).reset_index(drop=True))
+            df_i = self._frame("inventory", "WHERE user_id = ?", (user_id,))
+            df_r = self._frame("task_rollups", "WHERE user_id = ?", (user_id,))
+            df_e = pd.DataFrame()
+            if with_events:
+                df_e = self._frame("events", "WHERE user_id = ? AND CAST(seq AS INTEGER) > ?",
+                                   (user_id, _int(user.get("event_seq")))).reset_index(drop=True)
+        return user, found[0], df_t, df_i, df_r, df_e, 1
+
+    def archive_tasks(self, cutoff):
+        where = "WHERE created_at != '' AND substr(created_at, 1, 10) < ?"
+        with self._lock, self._conn:
+            old = self._values("tasks", where, (cutoff,))
+            if len(old) < 2:
+                return 0, 1
+            missing = backfill_task_rollups(old[0], old[1:], self._values("task_rollups", "WHERE day < ?", (cutoff,)))
+            self._insert("tasks_archive", old[1:])
+            if missing:
+                self._insert("task_rollups", missing)
+            self._conn.execute(f'DELETE FROM tasks {where}', (cutoff,))
+            self.generation += 1
+        return len(old) - 1, 1
+
+    def archive_events(self):
+        where = ("WHERE CAST(seq AS INTEGER) > 0 AND CAST(seq AS INTEGER) <= "
+                 "(SELECT CAST(event_seq AS INTEGER) FROM users WHERE users.user_id = events.user_id)")
+        with self._lock, self._conn:
+            old = self._values("events", where)
+            if len(old) < 2:
+                return 0, 1
+            self._insert("events_archive", old[1:])
+            self._conn.execute(f'DELETE FROM events {where}')
+            self.generation += 1
+        return len(old) - 1, 1
+
+    def user_at(self, row):
+        with self._lock:
+            found = self._conn.execute('SELECT user_id FROM users WHERE row_no = ?', (row,)).fetchone()
+        return found[0] if found else None
+
+    def apply_mutations(self, table, cells):
+        columns = TABLE_COLUMNS[table]
+        with self._lock, self._conn:
+            for (row, col), value in cells.items():
+                if not 1 <= col <= len(columns):
+                    raise ValueError(f"{table} に列{col}はありません")
+                self._conn.execute(f'UPDATE {table} SET "{columns[col - 1]}" = ? WHERE row_no = ?', (str(value), row))
+        return 1
+
+    def append_events(self, table, rows):
+        with self._lock, self._conn:
+            self._insert(table, rows)
+        return 1
+
+    def find_row(self, table, key):
+        where = " AND ".join(f'"{c}" = ?' for c in key)
+        with self._lock:
+            found = self._conn.execute(f'SELECT row_no FROM {table} WHERE {where} ORDER BY row_no LIMIT 1',
+                                       [str(v) for v in key.values()]).fetchone()
+        return (found[0] if found else None), 1
+
+
+# --- ユーザー状態のイベントソーシング ---
+# 変更された列からイベント種別を決める（上から順に最初に当たったもの）
+USER_EVENT_RULES = [
+    ("rebirth", ("rebirth_count",)),
+    ("claim_made", ("daily_claimed", "weekly_claimed", "mission_claimed", "boss_claimed", "achievements",
+                    "seasonal_claimed", "unlocked_titles", "streak_protect_date", "last_rest_week")),
+    ("gacha_pulled", ("last_free_gacha", "pity_counter")),
+    ("task_completed", ("current_xp",)),
+    ("activity_logged", ("zone_start", "zone_log", "outing_start")),
+]
+
+def classify_user_event(state, changes):
+    """users 行の変更内容からイベント種別（task_completed / gold_spent / gacha_pulled / claim_made …）を返す"""
+    for event_type, columns in USER_EVENT_RULES:
+        if any(c in changes for c in columns):
+            return event_type
+    if "gold" in changes:
+        return "gold_spent" if _int(changes["gold"]) < _int(state.get("gold")) else "gold_earned"
+    return "user_updated"
+
+def reduce_user_event(state, changes):
+    """イベント1件をユーザー状態に畳み込む（payload は変更後の値なので上書きするだけ。何度適用しても同じ結果）"""
+    new_state = dict(state)
+    new_state.update(changes)
+    return new_state
+
+def replay_user_events(user, df_e):
+    """スナップショット（users 行）に、event_seq より後のイベントを seq 順に畳み込む。
+    df_e はそのユーザーのイベント。戻り値: (ユーザー状態, 最新の seq)"""
+    snapshot_seq = _int(user.get("event_seq"))
+    if df_e.empty or "seq" not in df_e.columns:
+        return dict(user), snapshot_seq
+    mine = df_e.assign(_seq=pd.to_numeric(df_e["seq"], errors="coerce").fillna(0).astype(int))
+    state = dict(user)
+    for payload in mine[mine["_seq"] > snapshot_seq].sort_values("_seq")["payload"]:
+        state = reduce_user_event(state, json.loads(payload))
+    return state, max(snapshot_seq, int(mine["_seq"].max()))
+
+
+class EventSourcedStorage(StorageBackend):
+    """users 行を直接書き換えず、変更を events ログへ1行追記する（O(1) の追記 + 監査ログ）。
+    users 行は snapshot_every 件ごとに書き戻すスナップショットで、列 event_seq に畳み込み済みの seq を持つ。
+    読み込み時はスナップショットにそれ以降のイベントだけを畳み込む。users 以外はそのまま inner に渡す。"""
+    SNAPSHOT_EVERY = 20
+
+    def __init__(self, inner, snapshot_every=SNAPSHOT_EVERY):
+        self.inner = inner
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        self._users = {}  # users の行番号 -> {"columns", "state", "seq", "snapshot_seq", "dirty"}
+
+    def read_snapshot(self, user_id, with_events=True):
+        user, u_idx, df_t, df_i, df_r, df_e, calls = self.inner.read_snapshot(user_id, with_events=True)
+        state, seq = replay_user_events(user, df_e)
+        with self._lock:  # 取得はロックの外。メモリ上のユーザー状態の更新だけ
+            known = self._users.get(u_idx)
+            if known is None or known["seq"] <= seq:
+                self._users[u_idx] = {"columns": list(user.keys()), "state": state, "seq": seq,
+                                      "snapshot_seq": _int(user.get("event_seq")), "dirty": set()}
+        return state, u_idx, df_t, df_i, df_r, df_e, calls
+
+    def has_table(self, table):
+        return self.inner.has_table(table)
+
+    def archive_tasks(self, cutoff):
+        return self.inner.archive_tasks(cutoff)
+
+    def archive_events(self):
+        return self.inner.archive_events()
+
+    @property
+    def generation(self):
+        return self.inner.generation
+
+    def user_at(self, row):
+        return self.inner.user_at(row)
+
+    def _user_entry(self, row):
+        if row not in self._users:
+            # 起動直後にジャーナルの再送が先に来た場合など
+            user_id = self.inner.user_at(row)
+            if user_id is not None:
+                self.read_snapshot(user_id)
+        if row not in self._users:
+            raise ValueError(f"users の{row}行目のユーザーが見つかりません")
+        return self._users[row]
+
+    def find_row(self, table, key):
+        return self.inner.find_row(table, key)
+
+    def apply_mutations(self, table, cells):
+        if table != "users":
+            return self.inner.apply_mutations(table, cells)
+        by_row = {}
+        for (row, col), value in cells.items():
+            by_row.setdefault(row, {})[col] = value
+        with self._lock:
+            events, snapshot_cells, updated = [], {}, {}
+            now = _timestamp()
+            for row, row_cells in by_row.items():
+                entry = dict(self._user_entry(row))
+                columns = entry["columns"]
+                changes = {}
+                for col, value in row_cells.items():
+                    name = columns[col - 1] if col <= len(columns) else USERS_COLUMNS[col - 1] if col <= len(USERS_COLUMNS) else f"_col{col - 1}"
+                    changes[name] = str(value)
+                entry["seq"] += 1
+                events.append([entry["state"].get("user_id", ""), entry["seq"], classify_user_event(entry["state"], changes),
+                               json.dumps(changes, ensure_ascii=False), now])
+                entry["state"] = reduce_user_event(entry["state"], changes)
+                entry["dirty"] = entry["dirty"] | set(changes)
+                if entry["seq"] - entry["snapshot_seq"] >= self.snapshot_every:
+                    for name in entry["dirty"]:
+                        if name in columns:
+                            snapshot_cells[(row, columns.index(name) + 1)] = entry["state"][name]
+                    if "event_seq" in columns:
+                        snapshot_cells[(row, columns.index("event_seq") + 1)] = entry["seq"]
+                    entry["snapshot_seq"], entry["dirty"] = entry["seq"], set()
+                updated[row] = entry
+            # 追記（とスナップショット）が成功してからメモリ上の状態を進める（再送で seq が飛ばないように）
+            calls = self.inner.append_events("events", events)
+            if snapshot_cells:
+                calls += self.inner.apply_mutations("users", snapshot_cells)
+            self._users.update(updated)
+        return calls
+
+    def append_events(self, table, rows):
+        return self.inner.append_events(table, rows)
+
+    def column(self, table, name):
+        return self.inner.column(table, name)
+
+    def reset(self):
+        with self._lock:
+            self._users = {}
+        self.inner.reset()
+
+
+def _frame_to_parquet(df, path):
+    """DataFrame を Parquet に保存（index＝行番号も残す）。数値と文字列が混ざった列（空セルのある数値列など）は
+    文字列にして書き、その列名を返す"""
+    mixed = [c for c in df.columns if df[c].dtype == object]
+    df.assign(**{c: df[c].fillna("").astype(str) for c in mixed}).to_parquet(path, index=True)
+    return mixed
+
+def _frame_from_parquet(path, mixed=()):
+    """_frame_to_parquet の逆。mixed の列はシートから読んだときと同じく数値文字列を数値に戻す"""
+    df = pd.read_parquet(path)
+    for c in mixed:
+        df[c] = df[c].astype(object).map(gspread.utils.numericise)
+    return df
+
+
+class SnapshotDiskCache:
+    """スナップショットと差分同期の状態のディスクキャッシュ（再起動後・新しいセッションの初回描画用）。
+    キーごとに JSON（メタ情報）と Parquet（DataFrame）を保存する。JSON が指す Parquet を丸ごと差し替えるので、
+    読み込み中に書き込まれても食い違った組み合わせは読まない。
+    書き込みはバックグラウンドの1スレッドでまとめて行う（同じキーは最新の内容だけ書く）。"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = {}   # key -> (meta, frames)
+        self._worker = None
+        self._refreshing = set()
+
+    def _name(self, key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def read(self, key):
+        """(meta, [DataFrame, ...])。無い・壊れていれば None"""
+        try:
+            with open(os.path.join(self.directory, self._name(key) + ".json"), encoding="utf-8") as f:
+                stored = json.load(f)
+            frames = [_frame_from_parquet(os.path.join(self.directory, n), mixed)
+                      for n, mixed in zip(stored["frames"], stored["mixed"])]
+        except (OSError, ValueError, KeyError):
+            return None
+        return stored["meta"], frames
+
+    def save(self, key, meta, frames=()):
+        with self._lock:
+            self._pending[key] = (meta, list(frames))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._worker = None
+                    return
+                key, (meta, frames) = self._pending.popitem()
+            try:
+                self._write(key, meta, frames)
+            except Exception:
+                pass  # キャッシュなので失敗しても次回は通常どおり読み込むだけ
+
+    def _write(self, key, meta, frames):
+        name = self._name(key)
+        token = uuid.uuid4().hex[:8]
+        files, mixed = [], []
+        for i, df in enumerate(frames):
+            files.append(f"{name}-{token}-{i}.parquet")
+            mixed.append(_frame_to_parquet(df, os.path.join(self.directory, files[-1])))
+        path = os.path.join(self.directory, name + ".json")
+        tmp = f"{path}.{token}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "meta": meta, "frames": files, "mixed": mixed}, f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+        # 差し替えた古い Parquet を消す
+        for old in os.listdir(self.directory):
+            if old.startswith(name + "-") and old.endswith(".parquet") and old not in files:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+
+    def load_snapshot(self, user_id):
+        """前回保存した (user, u_idx, df_t, df_i, df_r)。無ければ None"""
+        stored = self.read(f"snapshot:{user_id}")
+        if stored is None or len(stored[1]) != 3:
+            return None
+        meta, (df_t, df_i, df_r) = stored
+        return meta["user"], meta["u_idx"], df_t.reset_index(drop=True), df_i, df_r
+
+    def save_snapshot(self, user_id, user, u_idx, df_t, df_i, df_r):
+        self.save(f"snapshot:{user_id}", {"user": dict(user), "u_idx": int(u_idx)}, [df_t, df_i, df_r])
+
+    def refresh_async(self, storage, user_id, name):
+        """ストレージから読み直してディスクに保存する（裏で実行。ストレージ側の差分同期もこれで温まる）"""
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+
+        def run():
+            try:
+                user, u_idx, df_t, df_i, df_r, _, _ = storage.load_user(user_id, name)
+                self.save_snapshot(user_id, user, u_idx, df_t, df_i, df_r)
+            except Exception:
+                pass  # 次の rerun の通常の読み込みでエラーを表示する
+            finally:
+                with self._lock:
+                    self._refreshing.discard(user_id)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+@st.cache_resource
+def get_disk_cache():
+    """[storage] cache_dir（既定 lifequest_cache。空にすると無効）。スプレッドシートの URL ごとにフォルダを分ける。
+    SQLite では使わない（None）"""
+    cfg = st.secrets.get("storage", {})
+    cache_dir = cfg.get("cache_dir", "lifequest_cache")
+    if cfg.get("backend", "sheets") != "sheets" or not cache_dir:
+        return None
+    url = st.secrets["sheets"]["url"]
+    return SnapshotDiskCache(os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]))
+
+@st.cache_resource
+def get_storage():
+    """secrets.toml の [storage] backend = "sheets"（既定） | "sqlite" で切り替え。
+    event_log = true で users の更新を events ログへの追記にする（SQLite では既定で有効）"""
+    cfg = st.secrets.get("storage", {})
+    if cfg.get("backend", "sheets") == "sqlite":
+        storage = SQLiteBackend(cfg.get("path", "lifequest.db"))
+    else:
+        storage = SheetsBackend(get_sheet_pool(), get_disk_cache())
+    if cfg.get("event_log", cfg.get("backend", "sheets") == "sqlite"):
+        storage = EventSourcedStorage(storage, int(cfg.get("snapshot_every", EventSourcedStorage.SNAPSHOT_EVERY)))
+    return storage
 
 def get_user_title(user):
     """スプレッドシートの列名が title または titles のどちらでも読めるように"""
@@ -580,17 +2198,488 @@ def _apply_xp_gain(ws_u, u_idx, new_xp, u_nxt_xp, u_lv):
     """経験値獲得をシートに反映（レベルアップ・オーバーフロー対応）"""
     if new_xp >= u_nxt_xp:
         overflow = new_xp - u_nxt_xp
-        ws_u.update_cell(u_idx, 3, u_lv + 1)
-        ws_u.update_cell(u_idx, 5, int(((u_lv + 1) ** 1.5) * 100))
-        ws_u.update_cell(u_idx, 4, overflow)
+        ws_u.update_field(u_idx, "level", u_lv + 1)
+        ws_u.update_field(u_idx, "next_level_xp", int(((u_lv + 1) ** 1.5) * 100))
+        ws_u.update_field(u_idx, "current_xp", overflow)
     else:
-        ws_u.update_cell(u_idx, 4, new_xp)
+        ws_u.update_field(u_idx, "current_xp", new_xp)
+
+FLASH_ICONS = {"success": "✅", "info": "ℹ️", "warning": "⚠️", "error": "❌"}
+
+def flash(message, kind="success", balloons=False):
+    """st.rerun() の直前に出すメッセージ。待たずに再実行し、次の実行の最初に1回だけトーストで出す"""
+    st.session_state.setdefault('flash', []).append((kind, message, balloons))
+
+def show_flash():
+    """flash() で積んだメッセージを出して消す（render_app の最初）"""
+    for kind, message, balloons in st.session_state.pop('flash', []):
+        if balloons:
+            st.balloons()
+        st.toast(message, icon=FLASH_ICONS.get(kind))
 
 def _invalidate_sheet_cache():
     """シート更新後に呼ぶ（次回読みで再取得）"""
     if 'sheet_dirty' in st.session_state:
         st.session_state.sheet_dirty = True
 
+# --- 書き込みバッファ（1インタラクション分の更新をまとめて送る） ---
+class SheetWriteBuffer:
+    """update_cell / append_row を溜めておき、flush() でテーブル（シート）ごとに
+    ストレージの apply_mutations 1回 + append_events 1回にまとめて送る（Unit of Work）。
+    Sheets なら batch_update 1回 + append_rows 1回。api_calls は実際に発行したリクエスト数（読み取りも含む）。
+    update_keyed は行番号の代わりに列の値で行を指定する更新（送信待ちでまだ行番号の無い行用。行番号は送信時に引く）。"""
+
+    def __init__(self, storage, writer=None):
+        self.storage = storage
+        self.writer = writer  # WriteBehindWriter があればジャーナルに積んで即座に戻る
+        self._cells = {}   # table -> {(row, col): value}
+        self._rows = {}    # table -> [row_values, ...]
+        self._keyed = {}   # table -> {(key の組, 列名): [key, 列名, value]}
+        self.api_calls = 0
+        self.wrote = False   # 1回でも送信したか（次の rerun でキャッシュを無効化する）
+        self.error = None    # flush 失敗時の例外（次の rerun で表示する）
+        self.submitted = None  # writer に積んだエントリの id（送れずに .dead へ移ったら後の rerun で表示する）
+        # True の間は書き込みを捨てる（ディスクキャッシュの古いスナップショットで描画している間。
+        # 描画時の自動書き込みが古い値でシートを上書きしないように）
+        self.read_only = False
+
+    def table(self, name):
+        return BufferedTable(name, self)
+
+    def update_cell(self, table, row, col, value):
+        if self.read_only:
+            return
+        self._cells.setdefault(table, {})[(row, col)] = value  # 同じセルへの複数回更新は最後の値だけ送る
+
+    def update_field(self, table, row, name, value):
+        """列名で更新（列番号はストレージのヘッダーから引く）"""
+        self.update_cell(table, row, self.storage.column(table, name), value)
+
+    def append_row(self, table, values):
+        if self.read_only:
+            return
+        self._rows.setdefault(table, []).append(list(values))
+
+    def update_keyed(self, table, key, name, value):
+        """key（{列名: 値}）に一致する行の name 列を更新"""
+        if self.read_only:
+            return
+        self._keyed.setdefault(table, {})[(tuple(sorted(key.items())), name)] = [dict(key), name, value]
+
+    def pending(self):
+        """未送信の更新セル数・追加行数"""
+        n_cells = sum(len(c) for c in self._cells.values()) + sum(len(k) for k in self._keyed.values())
+        n_rows = sum(len(r) for r in self._rows.values())
+        return n_cells, n_rows
+
+    def flush(self):
+        """溜めた更新を送信する。送信した場合 True。"""
+        names = set(self._cells) | set(self._rows) | set(self._keyed)
+        if self.writer is not None:
+            tables = {t: (self._cells.get(t, {}), self._rows.get(t, []), list(self._keyed.get(t, {}).values()))
+                      for t in names}
+            if tables:
+                self.submitted = self.writer.submit(tables)  # ジャーナルに書けなければ例外（バッファは消さずに残す）
+                self.wrote = True
+            self._cells, self._rows, self._keyed = {}, {}, {}
+            return bool(tables)
+        sent = False
+        for table in names:
+            cells = self._cells.pop(table, {})
+            if cells:
+                self.api_calls += self.storage.apply_mutations(table, cells)
+                sent = True
+            rows = self._rows.pop(table, [])
+            if rows:
+                self.api_calls += self.storage.append_events(table, rows)
+                sent = True
+            keyed = list(self._keyed.pop(table, {}).values())
+            if keyed:
+                cells, calls = _resolve_keyed(self.storage, table, keyed)
+                self.api_calls += calls + self.storage.apply_mutations(table, cells)
+                sent = True
+        self.wrote = self.wrote or sent
+        return sent
+
+
+class BufferedTable:
+    """ハンドラから見た書き込み先（users / tasks / inventory）。
+    gspread.Worksheet と同じ update_cell / append_row でバッファに積む。"""
+
+    def __init__(self, name, buffer):
+        self.title = name
+        self._buffer = buffer
+
+    def update_cell(self, row, col, value):
+        self._buffer.update_cell(self.title, row, col, value)
+
+    def update_field(self, row, name, value):
+        self._buffer.update_field(self.title, row, name, value)
+
+    def append_row(self, values, **kwargs):
+        self._buffer.append_row(self.title, values)
+
+    def update_keyed(self, key, name, value):
+        self._buffer.update_keyed(self.title, key, name, value)
+
+def _resolve_keyed(storage, table, keyed):
+    """update_keyed の [[key, 列名, value], ...] → ({(row, col): value}, リクエスト数)。行が無ければ LookupError"""
+    cells, calls = {}, 0
+    for key, name, value in keyed:
+        row, n = storage.find_row(table, key)
+        calls += n
+        if row is None:
+            raise LookupError(f"{table} に {key} の行がありません")
+        cells[(row, storage.column(table, name))] = value
+    return cells, calls
+
+
+# --- 書き込みの非同期化（ローカルジャーナル + バックグラウンド送信） ---
+class WriteJournal:
+    """書き込み予定を fsync 付きで追記するローカルジャーナル（JSON Lines）。
+    {"op": "write", "id", "tables"} を書き、テーブルごとの更新・追記を送るたびに {"op": "parts", "parts": [[id, "table:kind"], ...]}、
+    エントリ全体が送信済みになったら {"op": "done", "ids"} を追記する。送れなかった分は path + ".dead" に残す。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self.compact()  # 書き込み途中で落ちた最終行を取り除いてから追記を始める
+
+    @staticmethod
+    def _json_default(value):
+        if isinstance(value, np.generic):  # 報酬計算などから来る NumPy の数値
+            return value.item()
+        raise TypeError(f"ジャーナルに書けない値: {value!r}")
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=self._json_default)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return line
+
+    def _read_unflushed(self):
+        if not os.path.exists(self.path):
+            return []
+        writes, done = {}, set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # 書き込み途中で落ちた最終行
+                if rec.get("op") == "write":
+                    writes[rec["id"]] = rec
+                elif rec.get("op") == "parts":
+                    for rec_id, part in rec.get("parts", []):
+                        if rec_id in writes:
+                            writes[rec_id].setdefault("done", []).append(part)
+                elif rec.get("op") == "done":
+                    done.update(rec.get("ids", []))
+        return [rec for rec_id, rec in writes.items() if rec_id not in done]
+
+    def dead_letter(self, record):
+        """再送しても通らない書き込みを path + ".dead"（JSON Lines）に残す"""
+        line = json.dumps(record, ensure_ascii=False, default=self._json_default)
+        with self._lock, open(self.path + ".dead", "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def unflushed(self):
+        """未送信のエントリ（書いた順）"""
+        with self._lock:
+            return self._read_unflushed()
+
+    def compact(self):
+        """送信済みエントリを捨てて書き直す"""
+        with self._lock:
+            pending = self._read_unflushed()
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for rec in pending:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+
+def _is_ambiguous_error(e):
+    """送信後に起きたかもしれないエラー（5xx・通信エラー）。サーバー側で反映済みのことがある"""
+    if isinstance(e, gspread.exceptions.APIError):
+        return SheetsQuota._status(e) in SheetsQuota.RETRY_STATUS and SheetsQuota._status(e) not in SheetsQuota.UNAPPLIED_STATUS
+    return isinstance(e, OSError)
+
+def _rows_landed(values, rows):
+    """シートの生データ（ヘッダー行＋データ行）に rows が続けて入っているか（追記が届いたかの確認。末尾から探す）"""
+    want = [_trim_row(r) for r in rows]
+    have = [_trim_row(r) for r in values[1:]]
+    for start in range(len(have) - len(want), -1, -1):
+        if have[start:start + len(want)] == want:
+            return True
+    return False
+
+def _is_transient_error(e):
+    """再送すれば通る見込みのあるエラーか（429 / 5xx・通信エラー・SQLite のロック）。
+    それ以外（4xx・列が無い・行番号が不正など）は何度送っても同じなので再送しない"""
+    if isinstance(e, gspread.exceptions.APIError):
+        return SheetsQuota._status(e) in SheetsQuota.RETRY_STATUS
+    return isinstance(e, (OSError, sqlite3.OperationalError))
+
+
+class WriteBehindWriter:
+    """ジャーナルに記録した書き込みをバックグラウンドスレッドでストレージへまとめて送る。
+    送れたテーブルごとの更新・追記はその都度ジャーナルに記録し、一時的な失敗では残りだけを指数バックオフで再送する
+    （追記が二重にならない）。再送しても通らないエラーは dead_letters とジャーナルの .dead に移して先へ進む。
+    起動時にはジャーナルの未送信分を再送する。"""
+    MAX_BATCH = 50
+    MAX_BACKOFF = 60
+    KINDS = ("cells", "rows", "keyed")  # 送る順（keyed は追記した行を指すことがあるので最後）
+
+    def __init__(self, storage, journal):
+        self.storage = storage
+        self.journal = journal
+        self._cond = threading.Condition()
+        self._queue = journal.unflushed()  # 前回プロセスの未送信分
+        self.generation = 0   # 送信完了ごとに増える（セッション側のキャッシュ無効化に使う）
+        self.api_calls = 0
+        self.retries = 0
+        self.last_error = None
+        self.dead_letters = []  # [(エントリの id, "table:kind", エラー)]
+        self._thread = threading.Thread(target=self._run, name="lifequest-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, tables):
+        """tables: {table: ({(row, col): value}, [row_values, ...], [[key, 列名, value], ...])}。ジャーナルに fsync してから積む。
+        戻り値はエントリの id（dead_letters と突き合わせる用）"""
+        entry = {"op": "write", "id": uuid.uuid4().hex, "tables": [
+            {"table": t, "cells": [[r, c, v] for (r, c), v in cells.items()], "rows": rows, "keyed": keyed}
+            for t, (cells, rows, keyed) in tables.items()]}
+        entry = json.loads(self.journal.append(entry))  # 再起動後に再送するときと同じ値（NumPy の数値は int などに）を送る
+        with self._cond:
+            self._queue.append(entry)
+            self._cond.notify()
+        return entry["id"]
+
+    def pending(self):
+        """未送信の書き込み（送信済みのテーブル分は空にしたコピー）"""
+        with self._cond:
+            entries = []
+            for entry in self._queue:
+                done = set(entry.get("done", []))
+                entries.append(dict(entry, tables=[
+                    dict(part, **{kind: [] for kind in self.KINDS if f"{part['table']}:{kind}" in done})
+                    for part in entry["tables"]]))
+            return entries
+
+    def wait_idle(self, timeout=None):
+        """未送信が無くなるまで待つ（ベンチマーク・終了処理用）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    @classmethod
+    def _parts(cls, entry):
+        """エントリのうち未送信の (table, kind, 内容)。kind は cells（更新）/ rows（追記）/ keyed（列の値で行を指定した更新）"""
+        done = set(entry.get("done", []))
+        for part in entry["tables"]:
+            for kind in cls.KINDS:
+                if part.get(kind) and f"{part['table']}:{kind}" not in done:
+                    yield part["table"], kind, part[kind]
+
+    def _mark_done(self, entries, table, kind):
+        key = f"{table}:{kind}"
+        with self._cond:
+            for entry in entries:
+                entry.setdefault("done", []).append(key)
+        self.journal.append({"op": "parts", "parts": [[entry["id"], key] for entry in entries]})
+
+    def _send(self, table, kind, entries):
+        """entries の table の更新（または追記）を1回にまとめて送り、送れたらジャーナルに記録する"""
+        if kind == "cells":
+            cells = {}
+            for entry in entries:
+                for part in entry["tables"]:
+                    if part["table"] == table:
+                        cells.update({(r, c): v for r, c, v in part["cells"]})  # 同じセルは後の値
+            self.api_calls += self.storage.apply_mutations(table, cells)
+        elif kind == "rows":
+            rows = [row for entry in entries for part in entry["tables"] if part["table"] == table for row in part["rows"]]
+            self.api_calls += self.storage.append_events(table, rows)
+        else:
+            keyed = [k for entry in entries for part in entry["tables"] if part["table"] == table for k in part["keyed"]]
+            cells, calls = _resolve_keyed(self.storage, table, keyed)
+            self.api_calls += calls + self.storage.apply_mutations(table, cells)
+        self._mark_done(entries, table, kind)
+
+    def _apply(self, batch):
+        """batch の未送信分をテーブル・種類ごと（KINDS の順）にまとめて送る。一時的なエラーはそのまま投げる"""
+        steps = {}
+        for entry in batch:
+            for table, kind, _ in self._parts(entry):
+                steps.setdefault((self.KINDS.index(kind), table, kind), []).append(entry)
+        for (_, table, kind), entries in sorted(steps.items(), key=lambda item: item[0][0]):
+            try:
+                self._send(table, kind, entries)
+            except Exception as e:
+                if _is_transient_error(e):
+                    raise
+                for entry in entries:  # どのエントリが原因か分からないので1件ずつ送り直す
+                    try:
+                        self._send(table, kind, [entry])
+                    except Exception as e1:
+                        if _is_transient_error(e1):
+                            raise
+                        self._dead_letter(entry, table, kind, e1)
+
+    def _dead_letter(self, entry, table, kind, error):
+        data = [part.get(kind, []) for part in entry["tables"] if part["table"] == table]
+        self.journal.dead_letter({"id": entry["id"], "table": table, "kind": kind, "data": data,
+                                  "error": repr(error), "at": _timestamp()})
+        self.dead_letters.append((entry["id"], f"{table}:{kind}", error))
+        self._mark_done([entry], table, kind)  # 再送しない
+
+    def _run(self):
+        backoff = 1
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch = self._queue[:self.MAX_BATCH]
+            try:
+                self._apply(batch)
+            except Exception as e:
+                self.last_error = e
+                self.retries += 1
+                time.sleep(backoff * (0.5 + random.random()))
+                backoff = min(self.MAX_BACKOFF, backoff * 2)
+                continue
+            backoff = 1
+            self.last_error = None
+            self.journal.append({"op": "done", "ids": [e["id"] for e in batch]})
+            with self._cond:
+                del self._queue[:len(batch)]
+                self.generation += 1
+                idle = not self._queue
+                self._cond.notify_all()
+            if idle:
+                self.journal.compact()
+
+
+@st.cache_resource
+def get_write_behind():
+    """[storage] write_behind（Sheets では既定で有効）。無効なら None"""
+    cfg = st.secrets.get("storage", {})
+    if not cfg.get("write_behind", cfg.get("backend", "sheets") == "sheets"):
+        return None
+    return WriteBehindWriter(get_storage(), WriteJournal(cfg.get("journal_path", "lifequest_journal.jsonl")))
+
+# 追記行を見分ける列（tasks は id、inventory はモンスターごとに1行、task_rollups は行全体）
+PENDING_ROW_KEYS = {"tasks": ["id"], "inventory": ["item_name"], "task_rollups": TASK_ROLLUP_COLUMNS}
+
+def _landed_rows(frame, table):
+    """スナップショットにある行の PENDING_ROW_KEYS の値 → 行数"""
+    keys = PENDING_ROW_KEYS.get(table, [])
+    if frame is None or frame.empty or not all(c in frame.columns for c in keys):
+        return Counter()
+    return Counter(zip(*(frame[c].astype(str) for c in keys)))
+
+def _drop_landed_rows(rows, table, landed):
+    """送信中に届いてスナップショットに既に入っている追記行を除く（同じ行が2回数えられないように）。landed は使った分だけ減らす"""
+    columns = TABLE_COLUMNS[table]
+    kept = []
+    for r in rows:
+        key = tuple(str(r[columns.index(c)]) if columns.index(c) < len(r) else "" for c in PENDING_ROW_KEYS.get(table, []))
+        if landed[key] > 0:
+            landed[key] -= 1
+        else:
+            kept.append(r)
+    return kept
+
+def _overlay_pending(user, u_idx, df_t, df_i, df_r, entries):
+    """まだストレージに届いていない書き込みをスナップショットに重ねる（自分の書き込みがすぐ見えるように）。
+    他のユーザーの分は無視する。送信と読み込みが重なって既に入っている追記行は重ねない。"""
+    user_keys = list(user.keys())
+    uid = str(user.get('user_id'))
+    frames = {"tasks": df_t, "inventory": df_i, "task_rollups": df_r}
+    landed = {table: _landed_rows(frame, table) for table, frame in frames.items()}
+    for entry in entries:
+        for part in entry["tables"]:
+            table = part["table"]
+            frame = frames.get(table)
+            for r, c, v in part["cells"]:
+                if table == "users" and r == u_idx and c <= len(user_keys):
+                    user[user_keys[c - 1]] = str(v)
+                elif table in ("inventory", "task_rollups") and r in frame.index and c <= len(frame.columns):
+                    frame.at[r, frame.columns[c - 1]] = v
+            if frame is None:
+                continue
+            columns = TABLE_COLUMNS[table]
+            rows = [r for r in part["rows"] if str(r[columns.index("user_id")]) == uid]
+            rows = _drop_landed_rows(rows, table, landed[table])
+            if rows:
+                headers = list(frame.columns) if len(frame.columns) else columns
+                added = _records_frame([headers] + [(list(r) + [""] * len(headers))[:len(headers)] for r in rows])
+                if table == "tasks":
+                    added = _with_task_times(added)
+                    frames[table] = added if frame.empty else pd.concat([frame, added], ignore_index=True)
+                else:
+                    added.index = range(-len(added), 0)  # 行番号は送信後に決まる（仮の番号）
+                    frames[table] = added if frame.empty else pd.concat([frame, added])
+            for key, name, v in part.get("keyed", []):
+                frame = frames[table]
+                if str(key.get("user_id")) != uid or name not in frame.columns or not all(c in frame.columns for c in key):
+                    continue
+                mask = pd.Series(True, index=frame.index)
+                for c, kv in key.items():
+                    mask &= frame[c].astype(str) == str(kv)
+                frame.loc[mask.to_numpy(), name] = v
+    return user, frames["tasks"], frames["inventory"], frames["task_rollups"]
+
+def _flush_interaction(write_buf):
+    """main() の最後（st.rerun / st.stop を含む）で呼ぶ。
+    st.stop / st.rerun 後は st.* に触れられないため、結果は write_buf に残して次の rerun で処理する。"""
+    try:
+        write_buf.flush()
+    except Exception as e:
+        write_buf.error = e
+
+def _settle_previous_interaction():
+    """前回のインタラクションの書き込み結果を反映（キャッシュ無効化・保存エラー表示）"""
+    prev_buf = st.session_state.get('write_buffer')
+    if prev_buf is None:
+        return
+    if prev_buf.wrote or prev_buf.error is not None:
+        _invalidate_sheet_cache()
+    if prev_buf.error is not None:
+        st.error("スプレッドシートへの保存に失敗しました。users シートの列構成（SPREADSHEET.md）を確認してください。")
+        with st.expander("詳細を表示"):
+            st.exception(prev_buf.error)
+    if prev_buf.writer is not None:
+        # バックグラウンド送信で再送しても通らなかったこのセッションの書き込み（ジャーナルの .dead に残っている）
+        mine = st.session_state.setdefault('submitted_writes', [])
+        if prev_buf.submitted is not None:
+            mine.append(prev_buf.submitted)
+            del mine[:-100]
+        failed = [(part, error) for entry_id, part, error in list(prev_buf.writer.dead_letters) if entry_id in mine]
+        if failed:
+            dead_ids = {entry_id for entry_id, _, _ in prev_buf.writer.dead_letters}
+            mine[:] = [i for i in mine if i not in dead_ids]
+            _invalidate_sheet_cache()
+            st.error(f"スプレッドシートへの保存に失敗した書き込みがあります（{prev_buf.writer.journal.path}.dead に残しています）。"
+                     "シートの列構成（SPREADSHEET.md）を確認してください。")
+            with st.expander("詳細を表示"):
+                for part, error in failed:
+                    st.caption(part)
+                    st.exception(error)
+
 def _int(val, default=0):
     """スプレッドシートから読み取った値を int に変換（文字列で来ても安全）"""
     if val is None or (isinstance(val, str) and str(val).strip() == ''):
@@ -600,14 +2689,6 @@ def _int(val, default=0):
     except (ValueError, TypeError):
         return default
 
-def _save_monthly_sr_claimed(ws_u, u_idx, month_id):
-    """月1回SR確定チケット購入済みを記録（列W(23)）。失敗時はエラー表示。"""
-    try:
-        ws_u.update_cell(u_idx, 23, month_id)
-    except Exception:
-        st.error("SR確定チケットの購入記録に失敗しました。users の列W(23)に「last_monthly_sr_ticket」を追加してください。")
-        st.stop()
-
 def get_weekly_boss():
     week_num = datetime.now().isocalendar()[1]
     return WEEKLY_BOSSES[week_num % len(WEEKLY_BOSSES)]
@@ -664,59 +2745,90 @@ def get_flavor_text(floor, rebirth_count, total_tasks):
         lines.append("百のクエストを超えた。君はもう、立派な冒険者だ。")
     return " ".join(lines) if lines else None
 
-def check_achievements(user, df_t, df_i, ws_u, u_idx):
-    """実績をチェックして未達成のものを返す（既に受取済みのものは除外）"""
-    total_tasks = len(df_t[df_t['user_id']=='u001']) if not df_t.empty else 0
-    floor = _int(user.get('dungeon_floor'))
-    rebirth = _int(user.get('rebirth_count'))
-    level = _int(user.get('level'), 1)
-    streak = calc_task_streak(df_t, user)
-    has_ur = False
-    if not df_i.empty:
-        user_items = df_i[df_i['user_id']=='u001']
-        if not user_items.empty:
-            has_ur = len(user_items[user_items['rarity']=='UR']) > 0
-    
-    # 既に受取済みの実績を取得
+def achievement_counters(user, day_counts, df_i, streak):
+    """実績ルールが参照するカウンタの現在値（どれも索引・users 行から引くだけ）。
+    カウンタはイベントごとに足し込まず、rerun のたびにスナップショットから作り直す。day_counts と streak は
+    画面表示のためにどのみち計算済みのものを受け取るので、ここで増える処理は df_i の rarity 列を見る 1 回だけ。
+    ハンドラで足し込んで別の列に保存すると、シートを直接直したときや書き込み失敗時にずれるため、
+    再計算の安いカウンタは値だけ作り、評価を AchievementTracker で変化分に絞っている"""
+    has_ur = not df_i.empty and 'rarity' in df_i.columns and bool((df_i['rarity'] == 'UR').any())
+    return {
+        "total_tasks": int(day_counts.sum()),
+        "floor": _int(user.get('dungeon_floor')),
+        "rebirth": _int(user.get('rebirth_count')),
+        "level": _int(user.get('level'), 1),
+        "ur_owned": int(has_ur),
+        "streak": streak,
+    }
+
+
+class AchievementTracker:
+    """実績の達成判定をカウンタの変化分だけで行う（ユーザーごとに st.session_state に置き、rerun をまたいで使う）。
+    カウンタごとにルールをしきい値順に持ち、前回から値が変わったカウンタについて、前回と今回の値の間にある
+    しきい値のルールだけを評価する（タスク完了なら total_tasks、階層移動なら floor、召喚なら ur_owned …）。
+    条件を満たしている実績の集合は前回の結果を引き継ぐ。"""
+
+    def __init__(self):
+        self.rules = {}   # カウンタ名 -> [(しきい値, 実績ID)]（しきい値順）
+        for ach_id, ach in ACHIEVEMENTS.items():
+            self.rules.setdefault(ach["counter"], []).append((ach["threshold"], ach_id))
+        for rules in self.rules.values():
+            rules.sort()
+        self.counters = {}
+        self.reached = set()
+        self.evaluated = 0   # これまでに評価したルール数（確認用）
+
+    def update(self, counters):
+        """カウンタの新しい値を反映して、条件を満たしている実績IDの集合を返す"""
+        for name, value in counters.items():
+            old = self.counters.get(name)
+            if old == value:
+                continue
+            rules = self.rules.get(name, [])
+            if old is None:
+                changed = rules
+            else:
+                # old と value の間（しきい値をまたいだ）のルールだけ。減った場合（転生・連続が途切れた）も同じ
+                thresholds = [t for t, _ in rules]
+                lo, hi = min(old, value), max(old, value)
+                changed = rules[bisect.bisect_right(thresholds, lo):bisect.bisect_right(thresholds, hi)]
+            for threshold, ach_id in changed:
+                self.evaluated += 1
+                if value >= threshold:
+                    self.reached.add(ach_id)
+                else:
+                    self.reached.discard(ach_id)
+            self.counters[name] = value
+        return set(self.reached)
+
+
+def check_achievements(user, df_t, df_i, ws_u, u_idx, df_r=None, day_counts=None, streak=None, tracker=None):
+    """実績をチェックして未達成のものを返す（既に受取済みのものは除外）。
+    tracker（AchievementTracker）を渡すと前回からカウンタが変わった分のルールだけを評価する"""
+    if day_counts is None:
+        day_counts = task_day_counts(df_t, df_r)
+    if streak is None:
+        streak = calc_task_streak(df_t, user, day_counts=day_counts)
+    tracker = tracker if tracker is not None else AchievementTracker()
+    reached = tracker.update(achievement_counters(user, day_counts, df_i, streak))
+
+    # 既に受取済みの実績を除く（並びは ACHIEVEMENTS の順）
     achieved_str = user.get('achievements', '') or ''
     achieved_set = set([a.strip() for a in achieved_str.split(',') if a.strip()])
-    new_achievements = []
-    rewards = 0
-    
-    checks = [
-        ("first_task", total_tasks >= 1),
-        ("task_10", total_tasks >= 10),
-        ("task_50", total_tasks >= 50),
-        ("task_100", total_tasks >= 100),
-        ("floor_10", floor >= 10),
-        ("floor_50", floor >= 50),
-        ("floor_100", floor >= 100),
-        ("rebirth_1", rebirth >= 1),
-        ("rebirth_5", rebirth >= 5),
-        ("level_10", level >= 10),
-        ("level_20", level >= 20),
-        ("gacha_ur", has_ur),
-        ("streak_7", streak >= 7),
-        ("streak_30", streak >= 30),
-    ]
-    
-    for ach_id, condition in checks:
-        # 条件を満たしていて、かつまだ受取っていない場合のみ追加
-        if condition and ach_id not in achieved_set:
-            new_achievements.append(ach_id)
-            if ach_id in ACHIEVEMENTS:
-                rewards += ACHIEVEMENTS[ach_id]['reward']
-    
+    new_achievements = [a for a in ACHIEVEMENTS if a in reached and a not in achieved_set]
+    rewards = sum(ACHIEVEMENTS[a]['reward'] for a in new_achievements)
     return new_achievements, rewards
 
-def get_next_rewards(user, df_t, today_date):
+def get_next_rewards(user, df_t, today_date, df_r=None, day_counts=None):
     """次に獲得できる報酬を予告"""
-    total_tasks = len(df_t[df_t['user_id']=='u001']) if not df_t.empty else 0
+    if day_counts is None:
+        day_counts = task_day_counts(df_t, df_r)
+    total_tasks = int(day_counts.sum())
     floor = _int(user.get('dungeon_floor'))
     cur_xp = _int(user.get('current_xp'))
     nxt_xp = _int(user.get('next_level_xp'), 100)
     level = _int(user.get('level'), 1)
-    d_cnt = len(df_t[df_t['dt'].dt.date == today_date]) if not df_t.empty else 0
+    d_cnt = count_on(day_counts, today_date)
     
     hints = []
     if cur_xp > 0 and nxt_xp > cur_xp:
@@ -731,47 +2843,108 @@ def get_next_rewards(user, df_t, today_date):
     return hints
 
 # --- メインロジック ---
+def get_current_user():
+    """ログイン中のユーザー (user_id, 表示名)。
+    secrets.toml に [auth] があれば st.login（OIDC）のメールアドレス、無ければ [app] user_id（既定 u001）"""
+    if st.secrets.get("auth") and hasattr(st, "user"):
+        if not st.user.is_logged_in:
+            st.title("⚔️ Life Quest")
+            st.button("ログイン", on_click=st.login)
+            st.stop()
+        return str(st.user.get("email") or st.user.get("sub")), str(st.user.get("name") or "冒険者")
+    return str(st.secrets.get("app", {}).get("user_id", "u001")), "冒険者"
+
 def main():
+    # 書き込みはすべてバッファ経由（ハンドラ終了時の st.rerun / st.stop でまとめて送信）
+    _settle_previous_interaction()
+    uid, user_name = get_current_user()
+    storage = None
     try:
-        sh = connect_to_gsheet()
-        ws_u = sh.worksheet("users")
-        ws_t = sh.worksheet("tasks")
-        ws_i = sh.worksheet("inventory")
-        user, u_idx = get_user_data(ws_u)
+        storage = get_storage()
+        writer = get_write_behind()
+        write_buf = SheetWriteBuffer(storage, writer)
+        st.session_state.write_buffer = write_buf  # api_calls は実行後もここから参照できる
+        ws_u = write_buf.table("users")
+        ws_t = write_buf.table("tasks")
+        ws_i = write_buf.table("inventory")
+        ws_r = write_buf.table("task_rollups") if storage.has_table("task_rollups") else None
+        # 未更新ならキャッシュから（API呼び出しゼロ）、更新後は3シートを1リクエストで再取得
+        # 非同期送信が進んだら（generation が変わったら）キャッシュは古い
+        # アーカイブなどで行が消えても（storage.generation）古い
+        writer_gen = (writer.generation if writer is not None else 0, storage.generation)
+        if st.session_state.get('writer_generation', writer_gen) != writer_gen:
+            _invalidate_sheet_cache()
+        if st.session_state.get('snapshot_user') != uid:
+            _invalidate_sheet_cache()
+        disk_cache = get_disk_cache()
+        warm = None
+        if 'cached_snapshot' not in st.session_state and disk_cache is not None:
+            warm = disk_cache.load_snapshot(uid)
+        if not st.session_state.get('sheet_dirty', True) and 'cached_snapshot' in st.session_state:
+            user, u_idx, df_t, df_i, df_r = st.session_state.cached_snapshot
+        elif warm is not None:
+            # 新しいセッション：前回保存したスナップショットですぐ描画し、最新との突き合わせは裏で行う。
+            # sheet_dirty のままにしておくので、次の rerun（ボタンの処理を含む）は最新を読んでから実行される
+            user, u_idx, df_t, df_i, df_r = warm
+            # 新しいセッションの最初の実行なのでボタンの処理は無い。描画時の自動書き込み（称号の解放など）は
+            # 古い内容から作った値なので、最新を読むまで送らない
+            write_buf.read_only = True
+            disk_cache.refresh_async(storage, uid, user_name)
+            st.session_state.cached_snapshot = warm
+            st.session_state.snapshot_user = uid
+            st.session_state.sheet_dirty = True
+        else:
+            # 初回ログインなら users に行を作ってから読む
+            user, u_idx, df_t, df_i, df_r, _, calls = storage.load_user(uid, user_name)
+            write_buf.api_calls += calls
+            st.session_state.cached_snapshot = (user, u_idx, df_t, df_i, df_r)
+            st.session_state.snapshot_user = uid
+            st.session_state.writer_generation = writer_gen
+            st.session_state.sheet_dirty = False
+            if disk_cache is not None:
+                disk_cache.save_snapshot(uid, user, u_idx, df_t, df_i, df_r)
+        user, df_t, df_i, df_r = dict(user), df_t.copy(), df_i.copy(), df_r.copy()
+        if writer is not None:
+            user, df_t, df_i, df_r = _overlay_pending(user, u_idx, df_t, df_i, df_r, writer.pending())
     except Exception as e:
+        if storage is not None:
+            storage.reset()  # 次の rerun で再認証
         st.error("DB接続エラー")
         with st.expander("詳細を表示"):
             st.exception(e)
             st.caption("確認: .streamlit/secrets.toml に gcp_service_account と sheets.url が正しく設定されているか、スプレッドシートの共有でサービスアカウントのメールに編集権限を付与しているか")
         st.stop()
+    try:
+        render_app(ws_u, ws_t, ws_i, ws_r, user, u_idx, df_t, df_i, df_r)
+    finally:
+        _flush_interaction(write_buf)
 
+# 画面下部のセクション（選んだものだけ描画する）と、stats_aggregates を使うセクション
+SECTIONS = ["📋 ギルド", "💎 ショップ", "🏆 実績", "📚 図鑑", "📊 統計", "📊 記録", "🎒 倉庫", "📜 思い出"]
+STATS_SECTIONS = {"📚 図鑑", "📊 統計", "📊 記録"}
+
+def render_app(ws_u, ws_t, ws_i, ws_r, user, u_idx, df_t, df_i, df_r):
+    uid = str(user.get('user_id'))  # df_t / df_i / df_r はこのユーザーの分だけ
+    show_flash()
     if 'battle_log' not in st.session_state:
         st.session_state.battle_log = ["システム起動..."]
 
     today = date.today()
     yesterday = today - timedelta(days=1)
-    if not st.session_state.get('sheet_dirty', True) and 'cached_df_t' in st.session_state and 'cached_df_i' in st.session_state:
-        df_t = st.session_state.cached_df_t.copy()
-        df_i = st.session_state.cached_df_i.copy()
-    else:
-        df_t = pd.DataFrame(ws_t.get_all_records())
-        df_i = pd.DataFrame(ws_i.get_all_records())
-        st.session_state.cached_df_t = df_t
-        st.session_state.cached_df_i = df_i
-        st.session_state.sheet_dirty = False
-    d_cnt, w_cnt, yesterday_cnt = 0, 0, 0
-    if not df_t.empty:
-        df_t['dt'] = pd.to_datetime(df_t['created_at'])
-        d_cnt = len(df_t[df_t['dt'].dt.date == today])
-        yesterday_cnt = len(df_t[df_t['dt'].dt.date == yesterday])
-        start_wk = today - timedelta(days=today.weekday())
-        w_cnt = len(df_t[df_t['dt'].dt.date >= start_wk])
+    if 'day_no' not in df_t.columns:
+        df_t = _with_task_times(df_t)  # dt / day_no は取り込み時に付いている（空のときだけここで）
+    # (日付, タスク名) → 件数の集計と日付 → 件数の索引（以下の件数・連続日数・タスク別の集計はすべてここから引く）
+    name_day_counts = task_name_day_counts(df_t, df_r)
+    day_counts = task_day_counts(df_t, df_r, name_day_counts)
+    d_cnt = count_on(day_counts, today)
+    yesterday_cnt = count_on(day_counts, yesterday)
+    w_cnt = count_days_since(day_counts, today - timedelta(days=today.weekday()))
     d_claim = (str(user.get('daily_claimed')) == str(today))
     wk_id = f"{today.year}-W{today.isocalendar()[1]}"
     w_claim = (str(user.get('weekly_claimed')) == wk_id)
-    task_streak = calc_task_streak(df_t, user)
+    task_streak = calc_task_streak(df_t, user, day_counts=day_counts)
     month_start = today.replace(day=1)
-    month_tasks_count = len(df_t[(df_t['user_id']=='u001') & (df_t['dt'].dt.date >= month_start)]) if not df_t.empty and 'dt' in df_t.columns else 0
+    month_tasks_count = count_days_since(day_counts, month_start)
     unlocked_str = (user.get('unlocked_titles') or '').strip()
     unlocked_set = set(x.strip() for x in unlocked_str.split(',') if x.strip())
     if task_streak >= 7 and 'streak_7' not in unlocked_set:
@@ -783,7 +2956,7 @@ def main():
     new_unlocked_str = ','.join(sorted(unlocked_set))
     if new_unlocked_str != unlocked_str:
         try:
-            ws_u.update_cell(u_idx, 30, new_unlocked_str)
+            ws_u.update_field(u_idx, "unlocked_titles", new_unlocked_str)
             _invalidate_sheet_cache()
         except Exception:
             pass
@@ -795,10 +2968,13 @@ def main():
     login_bonus_gold = LOGIN_BONUS.get(login_streak + 1, 0) if is_new_login else 0
     
     # 実績チェック
-    new_achievements, achievement_rewards = check_achievements(user, df_t, df_i, ws_u, u_idx)
+    # 実績の判定状態はユーザーごとにセッションで持ち回る（変わったカウンタのルールだけ評価）
+    achievement_tracker = st.session_state.setdefault('achievement_trackers', {}).setdefault(uid, AchievementTracker())
+    new_achievements, achievement_rewards = check_achievements(user, df_t, df_i, ws_u, u_idx, df_r, day_counts,
+                                                               task_streak, achievement_tracker)
     
     # 報酬予告
-    reward_hints = get_next_rewards(user, df_t, today)
+    reward_hints = get_next_rewards(user, df_t, today, df_r, day_counts)
     
     # 期間限定イベント（例：週末ボーナス）
     is_weekend = today.weekday() >= 5  # 土日
@@ -812,8 +2988,8 @@ def main():
     
     # 今日のタスク履歴（ハイライト用）
     today_tasks = []
-    if not df_t.empty:
-        today_tasks = df_t[df_t['dt'].dt.date == today]['task_name'].tolist()
+    if d_cnt and not df_t.empty:
+        today_tasks = df_t.loc[df_t['day_no'] == _day_no(today), 'task_name'].tolist()
     
     # 保留中のガチャチケット（ランダムボックスで獲得）
     pending_ticket = st.session_state.get('pending_gacha_ticket', False)
@@ -827,19 +3003,18 @@ def main():
         if st.button("🎫 今すぐ使用する", key="use_pending_ticket"):
             m_key = gacha_draw()
             m_data = MONSTERS[m_key]
-            df_i_check = pd.DataFrame(ws_i.get_all_records())
-            already_has = not df_i_check.empty and len(df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]) > 0
-            if already_has:
-                piece_gold = {"N": 10, "R": 30, "SR": 100, "SSR": 300, "UR": 1000}.get(m_data['rarity'], 10)
+            inv_index = InventoryIndex(df_i, uid)
+            outcome, _, piece_gold = inv_index.resolve(m_key, level_up=False)
+            if outcome != "new":
                 new_gold = _int(user.get('gold')) + piece_gold
-                ws_u.update_cell(u_idx, 6, new_gold)
+                ws_u.update_field(u_idx, "gold", new_gold)
                 st.session_state.last_gacha_result = (m_key, m_data['rarity'], True, piece_gold)
-                st.warning(f"重複！{m_key} → ピース変換で {piece_gold}G 獲得"); time.sleep(0.8); st.rerun()
+                flash(f"重複！{m_key} → ピース変換で {piece_gold}G 獲得", "warning"); st.rerun()
             else:
-                ws_i.append_row(['u001', m_key, m_data['rarity'], 1, str(datetime.now())])
+                inv_index.commit(ws_i)
                 st.session_state.last_gacha_result = (m_key, m_data['rarity'], False, 0)
                 st.session_state.pending_gacha_ticket = False
-                st.success(f"{m_key} GET!"); time.sleep(0.8); st.rerun()
+                flash(f"{m_key} GET!"); st.rerun()
 
     # --- 1. ヘッダー (アバター & ステータス) ---
     st.markdown("""
@@ -891,7 +3066,7 @@ def main():
             # モンスターのレベルを取得
             buddy_level = 1
             if not df_i.empty:
-                buddy_items = df_i[(df_i['user_id']=='u001') & (df_i['item_name']==buddy)]
+                buddy_items = df_i[df_i['item_name']==buddy]
                 if not buddy_items.empty:
                     buddy_level = _int(buddy_items.iloc[0].get('quantity', 1))
             
@@ -913,9 +3088,9 @@ def main():
             if outing_start_dt is None:
                 if st.button("🔄 相棒をおでかけに出す", key="outing_start"):
                     try:
-                        ws_u.update_cell(u_idx, 35, datetime.now().isoformat())
+                        ws_u.update_field(u_idx, "outing_start", datetime.now().isoformat())
                         _invalidate_sheet_cache()
-                        st.success("おでかけに出した。しばらくしたら迎えにいこう。"); st.rerun()
+                        flash("おでかけに出した。しばらくしたら迎えにいこう。"); st.rerun()
                     except Exception:
                         st.caption("outing_start列(35)を追加すると使えます")
             else:
@@ -923,10 +3098,10 @@ def main():
                 reward = min(60, int(elapsed * 2))
                 if st.button("🏠 迎えに行く", key="outing_end"):
                     try:
-                        ws_u.update_cell(u_idx, 35, "")
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) + reward)
+                        ws_u.update_field(u_idx, "outing_start", "")
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) + reward)
                         _invalidate_sheet_cache()
-                        st.success(f"おかえり！ {reward}G おみやげ"); time.sleep(1); st.rerun()
+                        flash(f"おかえり！ {reward}G おみやげ"); st.rerun()
                     except Exception:
                         st.caption("列35を空にすると戻ります")
                 st.caption(f"おでかけ中（約{int(elapsed*60)}分経過・最大{reward}G）")
@@ -963,11 +3138,11 @@ def main():
         if st.button(f"🎁 {login_bonus_gold}G を受け取る", key="login_bonus"):
             try:
                 # 先にlast_loginを更新してから報酬を追加（重複防止）
-                ws_u.update_cell(u_idx, 9, login_streak + 1)  # login_streak
-                ws_u.update_cell(u_idx, 10, str(today))  # last_loginを先に更新
+                ws_u.update_field(u_idx, "login_streak", login_streak + 1)  # login_streak
+                ws_u.update_field(u_idx, "last_login", str(today))  # last_loginを先に更新
                 new_gold = _int(user.get('gold')) + login_bonus_gold
-                ws_u.update_cell(u_idx, 6, new_gold)
-                st.success(f"{login_bonus_gold}G 獲得！"); _invalidate_sheet_cache(); time.sleep(0.2); st.rerun()
+                ws_u.update_field(u_idx, "gold", new_gold)
+                flash(f"{login_bonus_gold}G 獲得！"); _invalidate_sheet_cache(); st.rerun()
             except Exception as e:
                 st.error(f"ログインボーナスの保存に失敗しました。スプレッドシートの列I(9)に「login_streak」、列J(10)に「last_login」列があるか確認してください。エラー: {str(e)}")
                 st.stop()
@@ -992,11 +3167,11 @@ def main():
                 # まずスプレッドシートを更新してから報酬を追加（重複防止）
                 new_achieved_str = ','.join(list(achieved_set) + unclaimed_achievements).strip(',')
                 try:
-                    ws_u.update_cell(u_idx, 25, new_achieved_str)  # achievements列を先に更新
+                    ws_u.update_field(u_idx, "achievements", new_achieved_str)  # achievements列を先に更新
                     # 更新が成功したことを確認
                     new_gold = _int(user.get('gold')) + unclaimed_rewards
-                    ws_u.update_cell(u_idx, 6, new_gold)
-                    st.success(f"{unclaimed_rewards}G 獲得！"); _invalidate_sheet_cache(); time.sleep(0.2); st.rerun()
+                    ws_u.update_field(u_idx, "gold", new_gold)
+                    flash(f"{unclaimed_rewards}G 獲得！"); _invalidate_sheet_cache(); st.rerun()
                 except Exception as e:
                     st.error(f"実績報酬の保存に失敗しました。スプレッドシートの列Y(25)に「achievements」列があるか確認してください。エラー: {str(e)}")
                     st.stop()
@@ -1126,99 +3301,13 @@ def main():
         diff_label = DIFFICULTY_LABEL.get(diff, "")
         btn_label = f"{display_name}\n💰 {base_reward}G [{diff_label}]"
         if cols[i%3].button(btn_label, use_container_width=True, key=f"task_btn_{i}", help=f"{t_data['desc']} - {diff_label} 報酬: {base_reward}G"):
-            # 計算ロジック（難易度倍率を先に適用）
-            diff_mult = DIFFICULTY_MULT.get(t_data.get('difficulty', 'normal'), 1.0)
-            base = int(t_data['reward'] * diff_mult)
-            bonus = 1.0
-            logs = []
-            
-            # ジョブ
-            if job_info['bonus'] == "ALL_RANDOM":
-                if random.random() < 0.5: bonus = 2.0; logs.append("🎰 JACKPOT!")
-                else: bonus = 0.1; logs.append("💀 失敗...")
-            elif job_info['bonus'] == t_data['type']:
-                bonus = 1.5; logs.append("⚔️ 職適正!")
-            
-            # ペット（レベルアップ効果を適用）
-            if buddy in MONSTERS:
-                pskill = MONSTERS[buddy]['skill']
-                # モンスターのレベルを取得
-                buddy_level = 1
-                if not df_i.empty:
-                    buddy_items = df_i[(df_i['user_id']=='u001') & (df_i['item_name']==buddy)]
-                    if not buddy_items.empty:
-                        buddy_level = _int(buddy_items.iloc[0].get('quantity', 1))
-                # レベルに応じた効果（レベル1で1.1倍、最大レベル10で1.5倍）
-                level_multiplier = 1.0 + (buddy_level - 1) * 0.05
-                if pskill == 'gold_up': 
-                    bonus *= (1.1 * level_multiplier)
-                    logs.append(f"💰 金運 Lv.{buddy_level}")
-                if pskill == 'xp_up': 
-                    bonus *= (1.1 * level_multiplier)
-                    logs.append(f"✨ 応援 Lv.{buddy_level}")
-            
-            val = int(base * bonus)
-            if val < 1: val = 1
-            
-            # 今日の最初のタスクボーナス（ADHD向け：始めるご褒美）
-            is_first_today = (d_cnt == 0)
-            if is_first_today:
-                val = max(1, int(val * 1.5))
-                logs.append("🌟初タスク!")
-            # 連続クリアボーナス（同日2つ目+10G、3つ目+20G）
-            if d_cnt == 1:
-                val += 10
-                logs.append("🔥2つ目+10G")
-            elif d_cnt == 2:
-                val += 20
-                logs.append("🔥3つ目+20G")
-            
-            # 転生ボーナス（永久）
-            rebirth_count = int(user.get('rebirth_count') or 0)
-            if rebirth_count > 0:
-                rebirth_bonus = 1 + 0.1 * rebirth_count
-                val = max(1, int(val * rebirth_bonus))
-                logs.append("✨転生")
-            # 限定称号ボーナス（5）
-            if 'streak_7' in unlocked_set:
-                val = max(1, int(val * 1.05))
-                logs.append("🏅7日連続")
-            if 'streak_30' in unlocked_set:
-                val = max(1, int(val * 1.10))
-                logs.append("🏅30日連続")
-            if 'monthly_50' in unlocked_set:
-                val = max(1, int(val * 1.05))
-                logs.append("🏅今月50")
-            
-            # 週末イベントボーナス
-            if event_active:
-                val = max(1, int(val * 1.2))
-                logs.append("🎉 週末ボーナス!")
-            
-            # 天気・曜日ボーナス（3）
-            weekday_bonus = 1.0
-            if today.weekday() == 0:  # 月曜
-                weekday_bonus = 1.1
-                logs.append("📅 月曜ボーナス!")
-            elif today.weekday() == 4:  # 金曜
-                weekday_bonus = 1.05
-                logs.append("📅 金曜ボーナス!")
-            val = max(1, int(val * weekday_bonus))
+            # 報酬計算（task_reward）。乱数はここで引く（遊び人の当たり外れ → 擬似天気の順）
+            reward_ctx = task_reward_context(user, job_info, df_i, d_cnt, unlocked_set, event_active, today)
+            jackpot = job_info['bonus'] == "ALL_RANDOM" and random.random() < 0.5
             # 擬似天気（ランダム）：室内=magic/holy 室外=physical
-            weather_today = random.choice(["sunny", "rainy", "cloudy"])
-            if weather_today == "rainy" and t_data['type'] in ("magic", "holy"):
-                val = max(1, int(val * 1.05))
-                logs.append("🌧 雨の日室内ボーナス!")
-            elif weather_today == "sunny" and t_data['type'] == "physical":
-                val = max(1, int(val * 1.05))
-                logs.append("☀ 晴れ外出ボーナス!")
-            
-            # ボス（弱点サイクル：日替わり）（6）
-            w_boss = get_weekly_boss()
-            today_weak = ["physical", "magic", "holy"][today.weekday() % 3]
-            is_weak = (t_data['type'] == today_weak)
-            dmg = val * 2 if is_weak else val
-            if is_weak: logs.append("🔥 弱点!")
+            weather_today = random.choice(WEATHERS)
+            val, dmg, logs = task_reward(t_name, reward_ctx, jackpot, weather_today)
+            is_first_today = (d_cnt == 0)
             
             # 更新（100階でキャップ）
             u_gold = _int(user.get('gold'))
@@ -1233,8 +3322,8 @@ def main():
             
             # レベルアップ
             if new_xp >= u_nxt_xp:
-                ws_u.update_cell(u_idx, 3, u_lv + 1)
-                ws_u.update_cell(u_idx, 5, int(((u_lv + 1) ** 1.5) * 100))
+                ws_u.update_field(u_idx, "level", u_lv + 1)
+                ws_u.update_field(u_idx, "next_level_xp", int(((u_lv + 1) ** 1.5) * 100))
                 new_xp = 0
                 st.balloons()
                 logs.append("🆙 LEVEL UP!!")
@@ -1258,11 +3347,12 @@ def main():
                     # ガチャチケットは後で処理（セッション状態に保存）
                     st.session_state.pending_gacha_ticket = True
             
-            ws_u.update_cell(u_idx, 6, final_gold)
-            ws_u.update_cell(u_idx, 4, new_xp)
-            ws_u.update_cell(u_idx, 8, new_floor)
-            ws_u.update_cell(u_idx, 19, new_boss_dmg)
-            ws_t.append_row([str(uuid.uuid4()), 'u001', t_name, t_data['type'], 1, 'Completed', str(datetime.now())])
+            ws_u.update_field(u_idx, "gold", final_gold)
+            ws_u.update_field(u_idx, "current_xp", new_xp)
+            ws_u.update_field(u_idx, "dungeon_floor", new_floor)
+            ws_u.update_field(u_idx, "weekly_boss_damage", new_boss_dmg)
+            ws_t.append_row([str(uuid.uuid4()), uid, t_name, t_data['type'], 1, 'Completed', _timestamp()])
+            bump_task_rollup(ws_r, df_r, uid, t_name, t_data['type'], final_gold - u_gold)
             _invalidate_sheet_cache()
             ts = datetime.now().strftime('%H:%M')
             st.session_state.battle_log.insert(0, f"[{ts}] {t_name}: {val}G " + " ".join(logs))
@@ -1328,8 +3418,7 @@ def main():
                     st.rerun()
             with c_done:
                 if st.button("今日はここまでにする", key="done_for_today"):
-                    st.success("よく頑張った！ また明日。無理しないでね。")
-                    time.sleep(1.2)
+                    flash("よく頑張った！ また明日。無理しないでね。")
                     _invalidate_sheet_cache()
                     st.rerun()
             st.stop()
@@ -1354,9 +3443,9 @@ def main():
     if can_rest_today and d_cnt == 0:
         if st.button("😌 今日は休息にする（週1回・連続記録キープ）", key="rest_day_btn"):
             try:
-                ws_u.update_cell(u_idx, 29, wk_id)   # last_rest_week
-                ws_u.update_cell(u_idx, 28, str(today))  # streak_protect_date
-                st.success("お疲れさま。今日はゆっくり休んで。また明日、待ってるよ。"); _invalidate_sheet_cache(); time.sleep(1.5); st.rerun()
+                ws_u.update_field(u_idx, "last_rest_week", wk_id)   # last_rest_week
+                ws_u.update_field(u_idx, "streak_protect_date", str(today))  # streak_protect_date
+                flash("お疲れさま。今日はゆっくり休んで。また明日、待ってるよ。"); _invalidate_sheet_cache(); st.rerun()
             except Exception:
                 st.info("休息日は今週すでに使用済みか、保存できませんでした。列AC(29)に last_rest_week を追加してください。")
     # ゾーンタイム（10）：集中開始・終了で記録
@@ -1371,7 +3460,7 @@ def main():
         if zone_start_dt is None:
             if st.button("⏱️ 集中開始", key="zone_start_btn"):
                 try:
-                    ws_u.update_cell(u_idx, 31, datetime.now().isoformat())
+                    ws_u.update_field(u_idx, "zone_start", datetime.now().isoformat())
                     _invalidate_sheet_cache()
                     st.rerun()
                 except Exception:
@@ -1382,10 +3471,10 @@ def main():
                     end = datetime.now()
                     mins = max(0, int((end - zone_start_dt).total_seconds() // 60))
                     new_log = (zone_log_raw + "," if zone_log_raw else "") + f"{end.date()}:{mins}"
-                    ws_u.update_cell(u_idx, 31, "")  # clear start
-                    ws_u.update_cell(u_idx, 32, new_log[:500])  # cap length
+                    ws_u.update_field(u_idx, "zone_start", "")  # clear start
+                    ws_u.update_field(u_idx, "zone_log", new_log[:500])  # cap length
                     _invalidate_sheet_cache()
-                    st.success(f"今回 {mins} 分集中しました"); time.sleep(1); st.rerun()
+                    flash(f"今回 {mins} 分集中しました"); st.rerun()
                 except Exception:
                     st.caption("zone_start(31)/zone_log(32)列を追加すると使えます")
     with zone_col2:
@@ -1399,10 +3488,8 @@ def main():
 
     # 「今日はやめる」逃げ道
     if st.button("🏁 今日はここまでにする（また明日）", key="done_today_no_task"):
-        st.balloons()
-        st.success(f"また明日。ストリーク{task_streak}日キープ中。無理しないでね。")
+        flash(f"また明日。ストリーク{task_streak}日キープ中。無理しないでね。", balloons=True)
         _invalidate_sheet_cache()
-        time.sleep(1.5)
         st.rerun()
     # 25分チャレンジ（やったら押す→小さな報酬・1日1回）
     if st.button("⏱️ 25分集中した！ 報酬を受け取る（10G）", key="pomodoro_claim"):
@@ -1410,8 +3497,8 @@ def main():
             already = st.session_state.get("pomodoro_date") == str(today)
             if not already:
                 st.session_state["pomodoro_date"] = str(today)
-                ws_u.update_cell(u_idx, 6, _int(user.get('gold')) + 10)
-                st.success("25分集中お疲れさま！ +10G"); _invalidate_sheet_cache(); time.sleep(0.8); st.rerun()
+                ws_u.update_field(u_idx, "gold", _int(user.get('gold')) + 10)
+                flash("25分集中お疲れさま！ +10G"); _invalidate_sheet_cache(); st.rerun()
             else:
                 st.info("今日はすでに受け取り済みです。また明日！")
         except Exception:
@@ -1530,7 +3617,7 @@ def main():
     """, unsafe_allow_html=True)
     
     rebirth_count = int(user.get('rebirth_count') or 0)
-    total_tasks = len(df_t[df_t['user_id']=='u001']) if not df_t.empty else 0
+    total_tasks = int(day_counts.sum())
     flavor_line = get_flavor_text(floor, rebirth_count, total_tasks)
     flavor_html = f'<p style="margin: 8px 0 0 0; font-size: 0.85em; color: #c9a227; font-style: italic;">📜 {flavor_line}</p>' if flavor_line else ""
     st.markdown(f"""
@@ -1553,12 +3640,10 @@ def main():
             try:
                 new_rebirth = rebirth_count + 1
                 title_text = get_rebirth_title(new_rebirth)
-                ws_u.update_cell(u_idx, 8, 1)
-                ws_u.update_cell(u_idx, 7, new_rebirth)  # G列: rebirth_count
-                ws_u.update_cell(u_idx, 21, title_text)  # U列: title
-                st.balloons()
-                st.success(f"転生完了！ 「{title_text}」を獲得。報酬がさらにアップ！")
-                time.sleep(1.5)
+                ws_u.update_field(u_idx, "dungeon_floor", 1)
+                ws_u.update_field(u_idx, "rebirth_count", new_rebirth)  # G列: rebirth_count
+                ws_u.update_field(u_idx, "title", title_text)  # U列: title
+                flash(f"転生完了！ 「{title_text}」を獲得。報酬がさらにアップ！", balloons=True)
                 st.rerun()
             except Exception as e:
                 st.error("転生の保存に失敗しました。スプレッドシートに列G(7)=rebirth_count・列U(21)=title があるか確認してください。")
@@ -1596,14 +3681,14 @@ def main():
                     if st.button(f"🎁 討伐報酬を受け取る ({w_boss.get('reward', 1000)}G + {w_boss.get('reward_xp', 500)}XP)", key="boss_reward"):
                         try:
                             # 先にboss_claimedを更新してから報酬を追加（重複防止）
-                            ws_u.update_cell(u_idx, 27, wk_id)  # boss_claimed列を先に更新
+                            ws_u.update_field(u_idx, "boss_claimed", wk_id)  # boss_claimed列を先に更新
                             new_gold = _int(user.get('gold')) + w_boss.get('reward', 1000)
                             new_xp = _int(user.get('current_xp')) + w_boss.get('reward_xp', 500)
                             u_nxt_xp = _int(user.get('next_level_xp'), 100)
                             u_lv = _int(user.get('level'), 1)
-                            ws_u.update_cell(u_idx, 6, new_gold)
+                            ws_u.update_field(u_idx, "gold", new_gold)
                             _apply_xp_gain(ws_u, u_idx, new_xp, u_nxt_xp, u_lv)
-                            st.success(f"{w_boss.get('reward', 1000)}G + {w_boss.get('reward_xp', 500)}XP 獲得！"); _invalidate_sheet_cache(); time.sleep(0.2); st.rerun()
+                            flash(f"{w_boss.get('reward', 1000)}G + {w_boss.get('reward_xp', 500)}XP 獲得！"); _invalidate_sheet_cache(); st.rerun()
                         except Exception as e:
                             st.error(f"ボス討伐報酬の保存に失敗しました。スプレッドシートの列AA(27)に「boss_claimed」列があるか確認してください。エラー: {str(e)}")
                             st.stop()
@@ -1614,10 +3699,18 @@ def main():
 
     st.markdown("---")
 
-    # --- 4. タブ機能 ---
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(["📋 ギルド", "💎 ショップ", "🏆 実績", "📚 図鑑", "📊 統計", "📊 記録", "🎒 倉庫", "📜 思い出"])
+    # --- 4. セクション ---
+    # st.tabs は全タブの中身を毎回実行するので、選んだセクションだけを実行する。
+    # ボタンの処理が途中で st.stop / st.rerun するとラジオの状態は消えるので、選択は active_section にも持つ
+    section = st.radio("セクション", SECTIONS, index=SECTIONS.index(st.session_state.get('active_section', SECTIONS[0])),
+                       horizontal=True, key="section", label_visibility="collapsed")
+    st.session_state.active_section = section
+    # 統計・記録・図鑑の集計はデータの版ごとにキャッシュ（使うセクションのときだけ）
+    stats = None
+    if section in STATS_SECTIONS:
+        stats = stats_aggregates(stats_snapshot_key(name_day_counts, df_i), date.today(), name_day_counts, day_counts, df_i)
 
-    with tab1:
+    if section == "📋 ギルド":
         c_g1, c_g2 = st.columns(2)
         with c_g1:
             st.subheader("📋 デイリー・ウィークリークエスト")
@@ -1657,10 +3750,10 @@ def main():
                         try:
                             # 先にmission_claimedを更新してから報酬を追加（重複防止）
                             new_claimed = ','.join(list(mission_claimed_set) + [mission_id]).strip(',')
-                            ws_u.update_cell(u_idx, 26, new_claimed)  # mission_claimed列を先に更新
+                            ws_u.update_field(u_idx, "mission_claimed", new_claimed)  # mission_claimed列を先に更新
                             new_gold = _int(user.get('gold')) + mission_data['reward']
-                            ws_u.update_cell(u_idx, 6, new_gold)
-                            st.success(f"{mission_data['reward']}G 獲得！"); _invalidate_sheet_cache(); time.sleep(0.2); st.rerun()
+                            ws_u.update_field(u_idx, "gold", new_gold)
+                            flash(f"{mission_data['reward']}G 獲得！"); _invalidate_sheet_cache(); st.rerun()
                         except Exception as e:
                             st.error(f"ミッション報酬の保存に失敗しました。スプレッドシートの列Z(26)に「mission_claimed」列があるか確認してください。エラー: {str(e)}")
                             st.stop()
@@ -1685,10 +3778,10 @@ def main():
                 if st.button("🎁 200G を受け取る", key="daily_claim"):
                     try:
                         # 先にdaily_claimedを更新してから報酬を追加（重複防止）
-                        ws_u.update_cell(u_idx, 14, str(today))  # daily_claimed列を先に更新
+                        ws_u.update_field(u_idx, "daily_claimed", str(today))  # daily_claimed列を先に更新
                         new_gold = _int(user.get('gold')) + 200
-                        ws_u.update_cell(u_idx, 6, new_gold)
-                        st.success("200G 獲得！"); _invalidate_sheet_cache(); time.sleep(0.2); st.rerun()
+                        ws_u.update_field(u_idx, "gold", new_gold)
+                        flash("200G 獲得！"); _invalidate_sheet_cache(); st.rerun()
                     except Exception as e:
                         st.error(f"デイリー報酬の保存に失敗しました。スプレッドシートの列N(14)に「daily_claimed」列があるか確認してください。エラー: {str(e)}")
                         st.stop()
@@ -1713,10 +3806,10 @@ def main():
                 if st.button("🎁 500G を受け取る", key="weekly_claim"):
                     try:
                         # 先にweekly_claimedを更新してから報酬を追加（重複防止）
-                        ws_u.update_cell(u_idx, 15, wk_id)  # weekly_claimed列を先に更新
+                        ws_u.update_field(u_idx, "weekly_claimed", wk_id)  # weekly_claimed列を先に更新
                         new_gold = _int(user.get('gold')) + 500
-                        ws_u.update_cell(u_idx, 6, new_gold)
-                        st.success("500G 獲得！"); _invalidate_sheet_cache(); time.sleep(0.2); st.rerun()
+                        ws_u.update_field(u_idx, "gold", new_gold)
+                        flash("500G 獲得！"); _invalidate_sheet_cache(); st.rerun()
                     except Exception as e:
                         st.error(f"ウィークリー報酬の保存に失敗しました。スプレッドシートの列O(15)に「weekly_claimed」列があるか確認してください。エラー: {str(e)}")
                         st.stop()
@@ -1727,21 +3820,16 @@ def main():
             seasonal = SEASONAL_MISSIONS.get(today.month)
             seasonal_claimed = (str(user.get('seasonal_claimed') or '')).strip() == month_id
             if seasonal:
-                user_tasks_m = df_t[df_t['user_id']=='u001'] if not df_t.empty else pd.DataFrame()
-                if not user_tasks_m.empty and 'created_at' in user_tasks_m.columns:
-                    user_tasks_m = user_tasks_m.copy()
-                    user_tasks_m['dt'] = pd.to_datetime(user_tasks_m['created_at'])
-                month_start = today.replace(day=1)
-                month_tasks = user_tasks_m[(user_tasks_m['dt'].dt.date >= month_start)] if not user_tasks_m.empty and 'dt' in user_tasks_m.columns else pd.DataFrame()
-                count = sum(1 for _, r in month_tasks.iterrows() if seasonal['task_key'] in str(r.get('task_name', ''))) if not month_tasks.empty else 0
+                month_keys = task_counts_by(name_day_counts, "task_key", since=today.replace(day=1))
+                count = int(month_keys.get(seasonal['task_key'], 0))
                 done = count >= seasonal['target']
                 if not seasonal_claimed and done:
                     if st.button(f"🎁 季節報酬 {seasonal['reward']}G", key="seasonal_claim"):
                         try:
-                            ws_u.update_cell(u_idx, 34, month_id)
-                            ws_u.update_cell(u_idx, 6, _int(user.get('gold')) + seasonal['reward'])
+                            ws_u.update_field(u_idx, "seasonal_claimed", month_id)
+                            ws_u.update_field(u_idx, "gold", _int(user.get('gold')) + seasonal['reward'])
                             _invalidate_sheet_cache()
-                            st.success(f"{seasonal['reward']}G 獲得！"); st.rerun()
+                            flash(f"{seasonal['reward']}G 獲得！"); st.rerun()
                         except Exception:
                             st.caption("列AD(34) seasonal_claimed を追加")
                 st.caption(f"{seasonal['name']}: {count}/{seasonal['target']}" + (" 受取済" if seasonal_claimed else ""))
@@ -1749,6 +3837,13 @@ def main():
         with c_g2:
             st.subheader("⚔️ 職業と転職")
             st.caption("職業によって相性の良いタスクで報酬がアップします")
+            type_counts = task_counts_by(name_day_counts, "type")
+            main_types = type_counts[["physical", "magic", "holy"]]
+            if main_types.sum() > 0:
+                best_type = main_types.idxmax()
+                best_jobs = "・".join(v['name'] for v in JOBS.values() if v['bonus'] == best_type)
+                st.caption("これまでの傾向: " + " ｜ ".join(f"{TASK_TYPE_LABELS[t]} {int(n)}回" for t, n in main_types.items())
+                           + f" → 相性が良いのは {best_jobs}")
             for k, v in JOBS.items():
                 is_current = (k == (user.get('job_class') or ''))
                 border = "2px solid #c9a227" if is_current else "1px solid #555"
@@ -1761,19 +3856,19 @@ def main():
                 """, unsafe_allow_html=True)
                 if not is_current and st.button(f"転職する (100G)", key=f"job_{k}"):
                     if _int(user.get('gold')) >= 100:
-                        ws_u.update_cell(u_idx, 11, k)
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 100)
-                        st.success(f"{v['name']}に転職した"); time.sleep(0.5); st.rerun()
+                        ws_u.update_field(u_idx, "job_class", k)
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 100)
+                        flash(f"{v['name']}に転職した"); st.rerun()
                     else:
                         st.error("金貨が足りません")
 
-    with tab2:  # ショップ
+    if section == "💎 ショップ":
         st.subheader("💎 ショップ")
         # ガチャ確率表示（UR 0.2% 等）
-        st.markdown("""
+        st.markdown(f"""
         <div class="rpg-window" style="margin-bottom: 16px;">
             <h4 style="margin: 0 0 8px 0;">📜 通常召喚確率</h4>
-            <p style="margin: 0; color: #c9b896;">N 68% ｜ R 25.8% ｜ SR 5% ｜ SSR 1% ｜ UR 0.2%</p>
+            <p style="margin: 0; color: #c9b896;">{gacha_odds_text(GACHA_WEIGHTS, " ｜ ")}</p>
         </div>
         """, unsafe_allow_html=True)
 
@@ -1798,79 +3893,66 @@ def main():
         st.markdown("#### 🏷️ 週・月限定（お得）")
         lim1, lim2 = st.columns(2)
         with lim1:
-            st.markdown("**🎫 ガチャチケ10枚セット** — 800G")
-            st.caption("週1回のみ！定価1000G相当（20%OFF）")
+            st.markdown(f"**🎫 ガチャチケ10枚セット** — {GACHA_PRICES['weekly_ten']}G")
+            st.caption(f"週1回のみ！定価{GACHA_PRICES['single'] * 10}G相当（{100 - GACHA_PRICES['weekly_ten'] * 10 // GACHA_PRICES['single']}%OFF）")
             if st.button("購入（今週分）", key="weekly_ticket", disabled=not can_weekly_ticket):
-                if can_weekly_ticket and _int(user.get('gold')) >= 800:
+                if can_weekly_ticket and _int(user.get('gold')) >= GACHA_PRICES['weekly_ten']:
                     # ガチャ演出
                     st.markdown("### 🎰 10連召喚中...")
                     st.progress(1.0)
                     
-                    results = [gacha_draw() for _ in range(10)]
-                    df_i_check = pd.DataFrame(ws_i.get_all_records())
+                    results = gacha_draw(10)
+                    # 10体分をインメモリ索引で解決し、最後にまとめて書き込む
+                    inv_index = InventoryIndex(df_i, uid)
                     total_piece_gold = 0
                     new_monsters = []
                     rarity_counts = {"N": 0, "R": 0, "SR": 0, "SSR": 0, "UR": 0}
                     
                     for m_key in results:
-                        m_data = MONSTERS[m_key]
-                        rarity = m_data['rarity']
+                        rarity = MONSTERS[m_key]['rarity']
                         rarity_counts[rarity] = rarity_counts.get(rarity, 0) + 1
-                        already_has = not df_i_check.empty and len(df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]) > 0
-                        if already_has:
-                            # 重複時は自動的にレベルアップに使用
-                            monster_row = df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]
-                            if not monster_row.empty:
-                                current_level = _int(monster_row.iloc[0].get('quantity', 1))
-                                if current_level < 10:
-                                    new_level = current_level + 1
-                                    monster_idx = monster_row.index[0] + 2
-                                    ws_i.update_cell(monster_idx, 4, new_level)
-                                    new_monsters.append(f"{m_key} Lv.{new_level}↑")
-                                else:
-                                    # 最大レベル時はゴールドに変換
-                                    piece_gold = {"N": 10, "R": 30, "SR": 100, "SSR": 300, "UR": 1000}.get(rarity, 10)
-                                    total_piece_gold += piece_gold
-                            df_i_check = pd.DataFrame(ws_i.get_all_records())
-                        else:
-                            ws_i.append_row(['u001', m_key, rarity, 1, str(datetime.now())])
+                        # 重複時は自動的にレベルアップ、最大レベル時はゴールドに変換
+                        outcome, new_level, piece_gold = inv_index.resolve(m_key)
+                        if outcome == "new":
                             new_monsters.append(m_key)
-                            df_i_check = pd.DataFrame(ws_i.get_all_records())
+                        elif outcome == "level":
+                            new_monsters.append(f"{m_key} Lv.{new_level}↑")
+                        total_piece_gold += piece_gold
+                    inv_index.commit(ws_i)
                     
                     # 先に週次購入済みを記録してから報酬（重複防止）
                     try:
-                        ws_u.update_cell(u_idx, 22, wk_id)  # last_weekly_ticket
+                        ws_u.update_field(u_idx, "last_weekly_ticket", wk_id)  # last_weekly_ticket
                     except Exception as e:
                         st.error(f"週1回チケットの保存に失敗しました。users の列V(22)に「last_weekly_ticket」を追加してください。")
                         st.stop()
-                    new_gold = _int(user.get('gold')) - 800 + total_piece_gold
-                    ws_u.update_cell(u_idx, 6, new_gold)
+                    new_gold = _int(user.get('gold')) - GACHA_PRICES['weekly_ten'] + total_piece_gold
+                    ws_u.update_field(u_idx, "gold", new_gold)
                     st.session_state.last_gacha_10 = results
                     st.session_state.last_gacha_10_info = {"new": new_monsters, "pieces": total_piece_gold, "rarity_counts": rarity_counts}
                     
-                    # 演出
-                    st.balloons()
-                    st.success("🎉 10連召喚完了！")
+                    # 演出（次の実行で表示）
+                    flash("🎉 10連召喚完了！", balloons=True)
                     rarity_display = " ".join([f"{r}: {c}" for r, c in rarity_counts.items() if c > 0])
-                    st.info(f"結果: {rarity_display}")
+                    flash(f"結果: {rarity_display}", "info")
                     if new_monsters:
-                        st.success(f"獲得: {', '.join(new_monsters[:5])}{'...' if len(new_monsters) > 5 else ''}")
+                        flash(f"獲得: {', '.join(new_monsters[:5])}{'...' if len(new_monsters) > 5 else ''}")
                     if total_piece_gold > 0:
-                        st.info(f"最大レベル変換: {total_piece_gold}G")
-                    time.sleep(2.0); st.rerun()
+                        flash(f"最大レベル変換: {total_piece_gold}G", "info")
+                    st.rerun()
                 elif not can_weekly_ticket: st.warning("今週は購入済み")
                 else: st.error("金貨不足")
             if not can_weekly_ticket: st.caption("✅ 今週は購入済み")
         with lim2:
-            st.markdown("**✨ SR以上確定チケット** — 600G")
-            st.caption("月1回のみ！SR 80% / SSR 19% / UR 1%")
+            st.markdown(f"**✨ SR以上確定チケット** — {GACHA_PRICES['monthly_sr']}G")
+            st.caption(f"月1回のみ！{gacha_odds_text(SR_GUARANTEED_WEIGHTS)}")
             monthly_sr_key = f"monthly_sr_claimed_{month_id}"
             monthly_sr_claimed = monthly_sr_key in st.session_state
             if st.button("購入（今月分）", key="monthly_sr", disabled=(not can_monthly_sr or monthly_sr_claimed)):
-                if can_monthly_sr and not monthly_sr_claimed and _int(user.get('gold')) >= 600:
+                if can_monthly_sr and not monthly_sr_claimed and _int(user.get('gold')) >= GACHA_PRICES['monthly_sr']:
                     # 重複防止：先にシートに「今月購入済み」と金貨を反映してからガチャ処理
-                    _save_monthly_sr_claimed(ws_u, u_idx, month_id)
-                    ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 600)
+                    ws_u.update_field(u_idx, "last_monthly_sr_ticket", month_id)
+                    ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - GACHA_PRICES['monthly_sr'])
                     st.session_state[monthly_sr_key] = True
                     _invalidate_sheet_cache()
 
@@ -1880,35 +3962,27 @@ def main():
                     rarity = m_data['rarity']
 
                     if rarity == "UR":
-                        st.balloons()
-                        st.success("🌟✨ **URレア獲得！** ✨🌟")
+                        flash("🌟✨ **URレア獲得！** ✨🌟", balloons=True)
                     elif rarity == "SSR":
-                        st.success("💎 **SSRレア獲得！** 💎")
+                        flash("💎 **SSRレア獲得！** 💎")
                     else:
-                        st.info("⭐ **SRレア獲得！** ⭐")
-
-                    df_i_check = pd.DataFrame(ws_i.get_all_records())
-                    already_has = not df_i_check.empty and len(df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]) > 0
-                    if already_has:
-                        monster_row = df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]
-                        if not monster_row.empty:
-                            current_level = _int(monster_row.iloc[0].get('quantity', 1))
-                            if current_level < 10:
-                                new_level = current_level + 1
-                                monster_idx = monster_row.index[0] + 2
-                                ws_i.update_cell(monster_idx, 4, new_level)
-                                st.success(f"重複！{m_key} がレベル{new_level}に上がった！")
-                            else:
-                                piece_gold = {"N": 10, "R": 30, "SR": 100, "SSR": 300, "UR": 1000}.get(rarity, 100)
-                                new_gold = _int(user.get('gold')) - 600 + piece_gold
-                                ws_u.update_cell(u_idx, 6, new_gold)
-                                st.info(f"重複！{m_key}は最大レベルなので {piece_gold}G に変換")
-                        time.sleep(1.0); st.rerun()
+                        flash("⭐ **SRレア獲得！** ⭐", "info")
+
+                    inv_index = InventoryIndex(df_i, uid)
+                    outcome, new_level, piece_gold = inv_index.resolve(m_key)
+                    inv_index.commit(ws_i)
+                    if outcome != "new":
+                        if outcome == "level":
+                            flash(f"重複！{m_key} がレベル{new_level}に上がった！")
+                        else:
+                            new_gold = _int(user.get('gold')) - GACHA_PRICES['monthly_sr'] + piece_gold
+                            ws_u.update_field(u_idx, "gold", new_gold)
+                            flash(f"重複！{m_key}は最大レベルなので {piece_gold}G に変換", "info")
+                        st.rerun()
                     else:
-                        ws_i.append_row(['u001', m_key, rarity, 1, str(datetime.now())])
                         st.session_state.last_gacha_result = (m_key, rarity, False, 0)
-                        st.success(f"🎉 {m_key} GET!")
-                        time.sleep(1.0); st.rerun()
+                        flash(f"🎉 {m_key} GET!")
+                        st.rerun()
                 elif monthly_sr_claimed: st.warning("今月は購入済み")
                 elif not can_monthly_sr: st.warning("今月は購入済み")
                 else: st.error("金貨不足")
@@ -1919,9 +3993,9 @@ def main():
         with col_g1:
             st.markdown("**🌟 1回召喚**")
             is_free = (str(today) != str(user.get('last_free_gacha')))
-            cost = "無料" if is_free else "100G"
+            cost = "無料" if is_free else f"{GACHA_PRICES['single']}G"
             if st.button(f"召喚する ({cost})", key="gacha1", use_container_width=True):
-                if not is_free and _int(user.get('gold')) < 100:
+                if not is_free and _int(user.get('gold')) < GACHA_PRICES['single']:
                     st.error("金貨が足りません")
                 else:
                     # ガチャ演出
@@ -1932,48 +4006,38 @@ def main():
                     m_data = MONSTERS[m_key]
                     rarity = m_data['rarity']
                     
-                    # レアリティに応じた演出
+                    # レアリティに応じた演出（次の実行で表示）
                     if rarity == "UR":
-                        st.balloons()
-                        st.success("🌟✨ **URレア獲得！** ✨🌟")
+                        flash("🌟✨ **URレア獲得！** ✨🌟", balloons=True)
                     elif rarity == "SSR":
-                        st.success("💎 **SSRレア獲得！** 💎")
+                        flash("💎 **SSRレア獲得！** 💎")
                     elif rarity == "SR":
-                        st.info("⭐ **SRレア獲得！** ⭐")
+                        flash("⭐ **SRレア獲得！** ⭐", "info")
                     
-                    # 重複チェック
-                    df_i_check = pd.DataFrame(ws_i.get_all_records())
-                    already_has = not df_i_check.empty and len(df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]) > 0
+                    # 重複チェック（重複時は自動的にレベルアップ、最大レベル時はゴールドに変換）
+                    inv_index = InventoryIndex(df_i, uid)
+                    outcome, new_level, piece_gold = inv_index.resolve(m_key)
+                    inv_index.commit(ws_i)
                     
-                    if already_has:
-                        # 重複時は自動的にレベルアップに使用
-                        monster_row = df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]
-                        if not monster_row.empty:
-                            current_level = _int(monster_row.iloc[0].get('quantity', 1))
-                            if current_level < 10:
-                                new_level = current_level + 1
-                                monster_idx = monster_row.index[0] + 2
-                                ws_i.update_cell(monster_idx, 4, new_level)
-                                if not is_free: ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 100)
-                                if is_free: ws_u.update_cell(u_idx, 13, str(today))
-                                st.success(f"重複！{m_key} がレベル{new_level}に上がった！")
-                            else:
-                                # 最大レベル時はゴールドに変換
-                                piece_gold = {"N": 10, "R": 30, "SR": 100, "SSR": 300, "UR": 1000}.get(rarity, 10)
-                                new_gold = _int(user.get('gold')) + piece_gold
-                                if not is_free: new_gold -= 100
-                                ws_u.update_cell(u_idx, 6, new_gold)
-                                if is_free: ws_u.update_cell(u_idx, 13, str(today))
-                                st.info(f"重複！{m_key}は最大レベルなので {piece_gold}G に変換")
-                        time.sleep(1.0); st.rerun()
+                    if outcome == "level":
+                        if not is_free: ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - GACHA_PRICES['single'])
+                        if is_free: ws_u.update_field(u_idx, "last_free_gacha", str(today))
+                        flash(f"重複！{m_key} がレベル{new_level}に上がった！")
+                        st.rerun()
+                    elif outcome == "piece":
+                        new_gold = _int(user.get('gold')) + piece_gold
+                        if not is_free: new_gold -= GACHA_PRICES['single']
+                        ws_u.update_field(u_idx, "gold", new_gold)
+                        if is_free: ws_u.update_field(u_idx, "last_free_gacha", str(today))
+                        flash(f"重複！{m_key}は最大レベルなので {piece_gold}G に変換", "info")
+                        st.rerun()
                     else:
                         # 新規：通常追加
-                        ws_i.append_row(['u001', m_key, rarity, 1, str(datetime.now())])
-                        if is_free: ws_u.update_cell(u_idx, 13, str(today))
-                        else: ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 100)
+                        if is_free: ws_u.update_field(u_idx, "last_free_gacha", str(today))
+                        else: ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - GACHA_PRICES['single'])
                         st.session_state.last_gacha_result = (m_key, rarity, False, 0)
-                        st.success(f"🎉 {m_key} GET!")
-                        time.sleep(1.0); st.rerun()
+                        flash(f"🎉 {m_key} GET!")
+                        st.rerun()
             if st.session_state.get('last_gacha_result'):
                 result = st.session_state.last_gacha_result
                 if len(result) == 4:  # 重複処理あり
@@ -1999,27 +4063,24 @@ def main():
 
         with col_g2:
             st.markdown("**✨ 10連召喚（お得）**")
-            st.caption("900Gで10回分！1回あたり90G")
-            if st.button("10連召喚 (900G)", key="gacha10", use_container_width=True):
-                if _int(user.get('gold')) < 900:
-                    st.error("金貨が足りません（900G必要）")
+            st.caption(f"{GACHA_PRICES['ten']}Gで10回分！1回あたり{GACHA_PRICES['ten'] // 10}G")
+            if st.button(f"10連召喚 ({GACHA_PRICES['ten']}G)", key="gacha10", use_container_width=True):
+                if _int(user.get('gold')) < GACHA_PRICES['ten']:
+                    st.error(f"金貨が足りません（{GACHA_PRICES['ten']}G必要）")
                 else:
-                    results = [gacha_draw() for _ in range(10)]
-                    df_i_check = pd.DataFrame(ws_i.get_all_records())
+                    results = gacha_draw(10)
+                    # 重複はピース変換（レベルアップなし）。新規分は最後に append_rows 1回で追加
+                    inv_index = InventoryIndex(df_i, uid)
                     total_piece_gold = 0
                     new_monsters = []
                     for m_key in results:
-                        m_data = MONSTERS[m_key]
-                        already_has = not df_i_check.empty and len(df_i_check[(df_i_check['user_id']=='u001') & (df_i_check['item_name']==m_key)]) > 0
-                        if already_has:
-                            piece_gold = {"N": 10, "R": 30, "SR": 100, "SSR": 300, "UR": 1000}.get(m_data['rarity'], 10)
-                            total_piece_gold += piece_gold
-                        else:
-                            ws_i.append_row(['u001', m_key, m_data['rarity'], 1, str(datetime.now())])
+                        outcome, _, piece_gold = inv_index.resolve(m_key, level_up=False)
+                        if outcome == "new":
                             new_monsters.append(m_key)
-                            df_i_check = pd.DataFrame(ws_i.get_all_records())  # 更新
-                    new_gold = _int(user.get('gold')) - 900 + total_piece_gold
-                    ws_u.update_cell(u_idx, 6, new_gold)
+                        total_piece_gold += piece_gold
+                    inv_index.commit(ws_i)
+                    new_gold = _int(user.get('gold')) - GACHA_PRICES['ten'] + total_piece_gold
+                    ws_u.update_field(u_idx, "gold", new_gold)
                     st.session_state.last_gacha_10 = results
                     st.session_state.last_gacha_10_info = {"new": new_monsters, "pieces": total_piece_gold}
                     st.rerun()
@@ -2047,15 +4108,14 @@ def main():
 
         st.divider()
         st.subheader("🎒 相棒編成")
-        df_i = pd.DataFrame(ws_i.get_all_records())
         if not df_i.empty:
-            my_m = df_i[df_i['user_id']=='u001']['item_name'].unique()
+            my_m = df_i['item_name'].unique()
             valid = [m for m in my_m if m in MONSTERS]
             sel = st.selectbox("装備する相棒を選んでください", ["なし"] + valid)
             if st.button("装備する"):
                 v = "" if sel == "なし" else sel
-                ws_u.update_cell(u_idx, 17, v)
-                st.success("装備しました"); time.sleep(0.5); st.rerun()
+                ws_u.update_field(u_idx, "equipped_pet", v)
+                flash("装備しました"); st.rerun()
             st.caption("相棒の効果はタスク報酬に反映されます")
             for m in valid:
                 md = MONSTERS[m]
@@ -2075,9 +4135,10 @@ def main():
                 if _int(user.get('gold')) >= 150:
                     if d_cnt < 3:
                         fake_task_id = str(uuid.uuid4())
-                        ws_t.append_row([fake_task_id, 'u001', 'スタミナポーション使用', 'item', 1, 'Completed', str(datetime.now())])
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 150)
-                        st.success("デイリー進捗+1！"); time.sleep(0.5); st.rerun()
+                        ws_t.append_row([fake_task_id, uid, 'スタミナポーション使用', 'item', 1, 'Completed', _timestamp()])
+                        bump_task_rollup(ws_r, df_r, uid, 'スタミナポーション使用', 'item', 0)
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 150)
+                        flash("デイリー進捗+1！"); st.rerun()
                     else:
                         st.warning("デイリーは既に達成済み")
                 else: st.error("金貨不足")
@@ -2087,9 +4148,9 @@ def main():
             if st.button("購入", key="item_boss_dmg"):
                 if _int(user.get('gold')) >= 200:
                     current_dmg = _int(user.get('weekly_boss_damage'))
-                    ws_u.update_cell(u_idx, 19, current_dmg + 500)
-                    ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 200)
-                    st.success("ボスダメージ+500！"); time.sleep(0.5); st.rerun()
+                    ws_u.update_field(u_idx, "weekly_boss_damage", current_dmg + 500)
+                    ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 200)
+                    flash("ボスダメージ+500！"); st.rerun()
                 else: st.error("金貨不足")
         with it3:
             st.markdown("**📈 階層スキップ** — 300G")
@@ -2098,9 +4159,9 @@ def main():
                 if _int(user.get('gold')) >= 300:
                     current_floor = _int(user.get('dungeon_floor'))
                     new_floor = min(MAX_FLOOR, current_floor + 5)
-                    ws_u.update_cell(u_idx, 8, new_floor)
-                    ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 300)
-                    st.success(f"階層 {current_floor} → {new_floor}！"); time.sleep(0.5); st.rerun()
+                    ws_u.update_field(u_idx, "dungeon_floor", new_floor)
+                    ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 300)
+                    flash(f"階層 {current_floor} → {new_floor}！"); st.rerun()
                 else: st.error("金貨不足")
         
         st.markdown("#### 💎 実用的アイテム（リアルでプラスになる）")
@@ -2112,9 +4173,9 @@ def main():
                 if _int(user.get('gold')) >= 250:
                     # ストリーク保護フラグを設定（列28に保存）
                     try:
-                        ws_u.update_cell(u_idx, 28, str(today))  # streak_protect_date列
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 250)
-                        st.success("ストリーク保護が有効になりました！"); time.sleep(0.5); st.rerun()
+                        ws_u.update_field(u_idx, "streak_protect_date", str(today))  # streak_protect_date列
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 250)
+                        flash("ストリーク保護が有効になりました！"); st.rerun()
                     except:
                         st.error("保存に失敗（列AB(28)にstreak_protect_date列を追加してください）")
                 else: st.error("金貨不足")
@@ -2143,9 +4204,9 @@ def main():
                 if _int(user.get('gold')) >= 400:
                     buff_data = f"gold_50_3_{datetime.now().isoformat()}"
                     try:
-                        ws_u.update_cell(u_idx, 24, buff_data)
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 400)
-                        st.success("次の3タスクで報酬+50%！"); time.sleep(0.5); st.rerun()
+                        ws_u.update_field(u_idx, "buff_data", buff_data)
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 400)
+                        flash("次の3タスクで報酬+50%！"); st.rerun()
                     except:
                         st.error("バフ保存に失敗（列X(24)にbuff_data列を追加してください）")
                 else: st.error("金貨不足")
@@ -2155,9 +4216,9 @@ def main():
                 if _int(user.get('gold')) >= 400:
                     buff_data = f"xp_50_3_{datetime.now().isoformat()}"
                     try:
-                        ws_u.update_cell(u_idx, 24, buff_data)
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 400)
-                        st.success("次の3タスクで経験値+50%！"); time.sleep(0.5); st.rerun()
+                        ws_u.update_field(u_idx, "buff_data", buff_data)
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 400)
+                        flash("次の3タスクで経験値+50%！"); st.rerun()
                     except:
                         st.error("バフ保存に失敗（列X(24)にbuff_data列を追加してください）")
                 else: st.error("金貨不足")
@@ -2167,28 +4228,19 @@ def main():
                 if _int(user.get('gold')) >= 500:
                     buff_data = f"achievement_2x_{datetime.now().isoformat()}"
                     try:
-                        ws_u.update_cell(u_idx, 24, buff_data)
-                        ws_u.update_cell(u_idx, 6, _int(user.get('gold')) - 500)
-                        st.success("実績達成が2倍速になります！"); time.sleep(0.5); st.rerun()
+                        ws_u.update_field(u_idx, "buff_data", buff_data)
+                        ws_u.update_field(u_idx, "gold", _int(user.get('gold')) - 500)
+                        flash("実績達成が2倍速になります！"); st.rerun()
                     except:
                         st.error("バフ保存に失敗（列X(24)にbuff_data列を追加してください）")
                 else: st.error("金貨不足")
 
-    with tab3:  # 実績
+    if section == "🏆 実績":
         st.subheader("🏆 実績一覧")
         achieved_list = user.get('achievements', '').split(',') if user.get('achievements') else []
         achieved_set = set([a.strip() for a in achieved_list if a.strip()])
         
-        total_tasks = len(df_t[df_t['user_id']=='u001']) if not df_t.empty else 0
-        floor = _int(user.get('dungeon_floor'))
-        rebirth = _int(user.get('rebirth_count'))
-        level = _int(user.get('level'), 1)
-        streak = calc_task_streak(df_t, user)
-        has_ur = False
-        if not df_i.empty:
-            user_items = df_i[df_i['user_id']=='u001']
-            if not user_items.empty:
-                has_ur = len(user_items[user_items['rarity']=='UR']) > 0
+        counters = achievement_tracker.counters
         
         for ach_id, ach_data in ACHIEVEMENTS.items():
             is_done = ach_id in achieved_set
@@ -2198,20 +4250,9 @@ def main():
             
             # 進捗チェック
             progress = ""
-            if ach_id == "first_task": progress = f" ({total_tasks}/1)" if total_tasks < 1 else ""
-            elif ach_id == "task_10": progress = f" ({total_tasks}/10)" if total_tasks < 10 else ""
-            elif ach_id == "task_50": progress = f" ({total_tasks}/50)" if total_tasks < 50 else ""
-            elif ach_id == "task_100": progress = f" ({total_tasks}/100)" if total_tasks < 100 else ""
-            elif ach_id == "floor_10": progress = f" ({floor}/10)" if floor < 10 else ""
-            elif ach_id == "floor_50": progress = f" ({floor}/50)" if floor < 50 else ""
-            elif ach_id == "floor_100": progress = f" ({floor}/100)" if floor < 100 else ""
-            elif ach_id == "rebirth_1": progress = f" ({rebirth}/1)" if rebirth < 1 else ""
-            elif ach_id == "rebirth_5": progress = f" ({rebirth}/5)" if rebirth < 5 else ""
-            elif ach_id == "level_10": progress = f" ({level}/10)" if level < 10 else ""
-            elif ach_id == "level_20": progress = f" ({level}/20)" if level < 20 else ""
-            elif ach_id == "gacha_ur": progress = " (未獲得)" if not has_ur else ""
-            elif ach_id == "streak_7": progress = f" ({streak}/7)" if streak < 7 else ""
-            elif ach_id == "streak_30": progress = f" ({streak}/30)" if streak < 30 else ""
+            value, threshold = counters.get(ach_data['counter'], 0), ach_data['threshold']
+            if ach_data['counter'] == "ur_owned": progress = " (未獲得)" if not value else ""
+            elif value < threshold: progress = f" ({value}/{threshold})"
             
             st.markdown(f"""
             <div style="background: {bg_color}; border: 2px solid {border_color}; border-radius: 8px; padding: 12px; margin: 8px 0;">
@@ -2225,12 +4266,9 @@ def main():
         
         st.caption(f"達成率: {len(achieved_set)}/{len(ACHIEVEMENTS)} ({len(achieved_set)*100//len(ACHIEVEMENTS)}%)")
 
-    with tab4:  # 図鑑
+    if section == "📚 図鑑":
         st.subheader("📚 モンスター図鑑")
-        if not df_i.empty:
-            owned = set(df_i[df_i['user_id']=='u001']['item_name'].unique())
-        else:
-            owned = set()
+        owned = stats["owned"]
         
         # レアリティ順に表示
         rarity_order = ["UR", "SSR", "SR", "R", "N"]
@@ -2255,24 +4293,22 @@ def main():
                     """, unsafe_allow_html=True)
         st.caption(f"コレクション進捗: {len(owned)}/{len(MONSTERS)} ({len(owned)*100//len(MONSTERS)}%)")
 
-    with tab5:  # 統計
+    if section == "📊 統計":
         st.subheader("📊 統計・分析")
         
         # 基本統計
         st.markdown("#### 📈 基本統計")
-        total_tasks = len(df_t[df_t['user_id']=='u001']) if not df_t.empty else 0
+        total_tasks = stats["total_tasks"]
         total_gold = _int(user.get('total_gold_earned', 0))
         total_xp = _int(user.get('total_xp_earned', 0))
         level = _int(user.get('level'), 1)
         floor = _int(user.get('dungeon_floor'))
         rebirth = _int(user.get('rebirth_count'))
-        streak = calc_task_streak(df_t, user)
+        streak = task_streak
         login_streak = _int(user.get('login_streak'))
         
         # 所持モンスター数
-        owned_count = 0
-        if not df_i.empty:
-            owned_count = len(df_i[df_i['user_id']=='u001']['item_name'].unique())
+        owned_count = len(stats["owned"])
         
         stat_cols = st.columns(3)
         with stat_cols[0]:
@@ -2288,20 +4324,15 @@ def main():
             st.metric("ログイン連続日数", f"{login_streak}日")
             st.metric("所持モンスター数", owned_count)
         
-        # 日別タスク数グラフ
-        if not df_t.empty:
-            st.markdown("#### 📅 日別タスク数")
-            daily = df_t.groupby(df_t['dt'].dt.date).size().reset_index(name='Actions')
-            c = alt.Chart(daily).mark_bar(color='#c9a227').encode(
-                x='dt:T',
-                y='Actions:Q'
-            ).properties(height=300)
-            st.altair_chart(c, use_container_width=True)
+        # タスク数グラフ（期間に応じて日・週・月ごと）
+        if stats["history"] is not None:
+            st.markdown("#### 📅 タスク数の推移")
+            render_task_history(stats, stats["daily_spec"], "stats_range")
         
         # タスクタイプ別統計
-        if not df_t.empty:
+        task_types = stats["task_types"]
+        if not task_types.empty:
             st.markdown("#### 🎯 タスクタイプ別")
-            task_types = df_t['task_name'].value_counts()
             type_cols = st.columns(2)
             with type_cols[0]:
                 for task_name, count in task_types.head(5).items():
@@ -2328,16 +4359,14 @@ def main():
             current_title = get_user_title(user)
             st.text_input("カスタム称号", value=current_title, key="custom_title", disabled=True, help="準備中")
 
-    with tab6:  # 記録
-        if not df_t.empty:
-            daily = df_t.groupby(df_t['dt'].dt.date).size().reset_index(name='Actions')
-            c = alt.Chart(daily).mark_bar().encode(x='dt:T', y='Actions:Q')
-            st.altair_chart(c, use_container_width=True)
+    if section == "📊 記録":
+        if stats["history"] is not None:
+            render_task_history(stats, stats["records_spec"], "records_range")
 
-    with tab7:  # 倉庫
+    if section == "🎒 倉庫":
         st.subheader("🎒 倉庫")
         if not df_i.empty:
-            user_items = df_i[df_i['user_id']=='u001']
+            user_items = df_i
             if not user_items.empty:
                 st.markdown("#### 🐾 モンスター")
                 for idx, row in user_items.iterrows():
@@ -2371,17 +4400,17 @@ def main():
         else:
             st.info("倉庫が空です")
 
-    with tab8:  # 思い出アルバム（8）
+    if section == "📜 思い出":  # 思い出アルバム（8）
         st.subheader("📜 思い出アルバム")
-        user_tasks = df_t[df_t['user_id']=='u001'] if not df_t.empty else pd.DataFrame()
-        if not user_tasks.empty and 'dt' in user_tasks.columns:
-            first_date = user_tasks['dt'].min()
+        user_tasks = df_t
+        if not day_counts.empty:
+            first_date = EPOCH_DATE + timedelta(days=int(day_counts.index.min()))
             if pd.notna(first_date):
                 first_str = first_date.strftime('%Y年%m月%d日') if hasattr(first_date, 'strftime') else str(first_date)[:10]
                 st.markdown(f"**初クエスト** — {first_str}")
-            st.markdown(f"**累計タスク数** — {len(user_tasks)} 回")
+            st.markdown(f"**累計タスク数** — {int(day_counts.sum())} 回")
             start_wk = today - timedelta(days=today.weekday())
-            week_tasks = user_tasks[user_tasks['dt'].dt.date >= start_wk] if 'dt' in user_tasks.columns else pd.DataFrame()
+            week_tasks = user_tasks[user_tasks['day_no'] >= _day_no(start_wk)] if not user_tasks.empty else pd.DataFrame()
             st.markdown(f"**今週** — {len(week_tasks)} 回")
             if not week_tasks.empty and 'task_name' in week_tasks.columns:
                 st.caption("今週やったこと:")
@@ -2395,16 +4424,16 @@ def main():
         st.markdown(f"**転生回数** — {_int(user.get('rebirth_count'))} 回")
         st.markdown(f"**タスク連続** — {task_streak} 日")
 
-    # データエクスポート（19）
-    st.markdown("---")
-    st.subheader("📤 データエクスポート")
-    try:
-        user_dict = user.to_dict() if hasattr(user, 'to_dict') else dict(user)
-        export_data = {"user": user_dict, "tasks_count": len(df_t[df_t['user_id']=='u001']) if not df_t.empty else 0, "inventory_count": len(df_i[df_i['user_id']=='u001']) if not df_i.empty else 0, "export_date": str(datetime.now())}
-        json_str = json.dumps(export_data, ensure_ascii=False, indent=2)
-        st.download_button("📥 データをJSONでエクスポート", data=json_str, file_name=f"lifequest_export_{today}.json", mime="application/json", key="export_json_btn")
-    except Exception as e:
-        st.caption(f"エクスポート: {e}")
+        # データエクスポート（19）
+        st.divider()
+        st.subheader("📤 データエクスポート")
+        try:
+            user_dict = user.to_dict() if hasattr(user, 'to_dict') else dict(user)
+            export_data = {"user": user_dict, "tasks_count": int(day_counts.sum()), "inventory_count": len(df_i) if not df_i.empty else 0, "export_date": str(datetime.now())}
+            json_str = json.dumps(export_data, ensure_ascii=False, indent=2)
+            st.download_button("📥 データをJSONでエクスポート", data=json_str, file_name=f"lifequest_export_{today}.json", mime="application/json", key="export_json_btn")
+        except Exception as e:
+            st.caption(f"エクスポート: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""
+Life Quest - tasks の古い行を tasks_archive へ移す
+created_at が --days 日より前の行を tasks_archive に移し、task_rollups（日別ロールアップ）に
+まだ数えられていない分を集計して追記する。アプリの集計（累計・連続日数・日別グラフ）はロールアップも読むので、
+移した後も数は変わらない。今月・今週・昨日の行は --days に関わらず移さない。
+--events を付けると、events（[storage] event_log）のうち users 行のスナップショット（event_seq）に畳み込み済みの行を
+events_archive へ移す（起動時に読む events を小さく保つ）。
+ストレージは app.py と同じ .streamlit/secrets.toml の [storage] / [sheets] を使う。
+
+    python archive_tasks.py --days 90
+    python archive_tasks.py --events
+"""
+import argparse
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="古いタスク履歴を tasks_archive へ移す")
+    parser.add_argument("--days", type=int, default=90, help="これより前の日のタスクを移す")
+    parser.add_argument("--events", action="store_true",
+                        help="tasks ではなく、スナップショットに畳み込み済みの events を events_archive へ移す")
+    args = parser.parse_args()
+
+    storage = app.get_storage()
+    tables = ("events_archive",) if args.events else ("tasks_archive", "task_rollups")
+    for table in tables:
+        if not storage.has_table(table):
+            raise SystemExit(f"シート「{table}」がありません（SPREADSHEET.md を参照して作成してください）")
+    if args.events:
+        moved, calls = storage.archive_events()
+        print(f"スナップショット済みの {moved} 行を events_archive へ移しました（リクエスト {calls} 回）")
+        return
+    cutoff = app.archive_cutoff(args.days)
+    moved, calls = storage.archive_tasks(cutoff)
+    print(f"{cutoff} より前の {moved} 行を tasks_archive へ移しました（リクエスト {calls} 回）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Life Quest - 召喚の排出率の監査
+アプリの召喚（GACHA_SAMPLER / SR_GUARANTEED_SAMPLER）で大量に引き、レアリティごと・モンスターごとの回数を
+設定（GACHA_WEIGHTS / SR_GUARANTEED_WEIGHTS と MONSTERS のレアリティ）から計算した確率とカイ二乗検定で比べる。
+期待値はサンプラーの表ではなく設定から直接計算するので、モンスターのいないレアリティ（別のレアリティに
+振り替わって表示どおりの確率にならない）や表の作り間違いも見つかる。1つでも NG なら終了コード 1。
+
+    python audit_gacha.py --draws 20000000
+    python audit_gacha.py --draws 1000000 --seed 1 --alpha 0.01
+"""
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+import app
+
+CHUNK = 5_000_000  # 一度に引く回数（メモリを使いすぎないように分ける）
+
+
+def chi2_sf(x, df):
+    """カイ二乗分布の上側確率（Wilson–Hilferty の正規近似。scipy を使わない）"""
+    if df <= 0:
+        return 1.0
+    z = ((x / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def chi2_test(observed, expected_p):
+    """(カイ二乗値, 自由度, p 値)。期待確率 0 の区分に1回でも出たら p 値 0"""
+    observed = np.asarray(observed, dtype=float)
+    expected = np.asarray(expected_p, dtype=float) * observed.sum()
+    if (observed[expected == 0] > 0).any():
+        return math.inf, int((expected > 0).sum()) - 1, 0.0
+    keep = expected > 0
+    stat = float(((observed[keep] - expected[keep]) ** 2 / expected[keep]).sum())
+    df = int(keep.sum()) - 1
+    return stat, df, chi2_sf(stat, df)
+
+
+def configured_odds(weights):
+    """設定どおりの確率：レアリティ {名前: 確率} と、モンスターごとの確率（MONSTERS の順）。
+    モンスターのいないレアリティの名前も返す（その確率は誰にも割り振られない）"""
+    total = sum(weights.values())
+    rarity_p = {r: w / total for r, w in weights.items()}
+    names = list(app.MONSTERS)
+    monster_p = np.zeros(len(names))
+    empty = []
+    for r, p in rarity_p.items():
+        pool = [i for i, m in enumerate(names) if app.MONSTERS[m]["rarity"] == r]
+        if pool:
+            monster_p[pool] = p / len(pool)
+        else:
+            empty.append(r)
+    return rarity_p, monster_p, empty
+
+
+def count_draws(sampler, draws, rng):
+    """draws 回引いてモンスターごとの回数（MONSTERS の順）"""
+    counts = np.zeros(len(sampler.names), dtype=np.int64)
+    done = 0
+    while done < draws:
+        k = min(CHUNK, draws - done)
+        counts += np.bincount(sampler.draw_indices(k, rng), minlength=len(counts))
+        done += k
+    return counts
+
+
+def audit(label, sampler, weights, draws, rng, alpha):
+    """1種類の召喚を監査して結果を表示し、問題がなければ True"""
+    rarity_p, monster_p, empty = configured_odds(weights)
+    started = time.perf_counter()
+    counts = count_draws(sampler, draws, rng)
+    elapsed = time.perf_counter() - started
+    print(f"== {label}（{draws:,} 回, {elapsed:.1f}s）")
+    ok = True
+    for r in empty:
+        print(f"  NG: {r} のモンスターがいない（{rarity_p[r]:.3%} が別のレアリティから出る）")
+        ok = False
+
+    rarities = list(dict.fromkeys(list(rarity_p) + [app.MONSTERS[m]["rarity"] for m in sampler.names]))
+    rarity_counts = [sum(c for m, c in zip(sampler.names, counts) if app.MONSTERS[m]["rarity"] == r)
+                     for r in rarities]
+    tests = [("レアリティ", rarities, rarity_counts, [rarity_p.get(r, 0.0) for r in rarities]),
+             ("モンスター", list(sampler.names), counts, monster_p)]
+    for title, keys, observed, expected in tests:
+        stat, df, p = chi2_test(observed, expected)
+        passed = p >= alpha
+        ok &= passed
+        print(f"  {title}: χ²={stat:.2f} 自由度={df} p={p:.4f} {'OK' if passed else 'NG'}")
+        for key, n, e in zip(keys, observed, expected):
+            if n or e:
+                print(f"    {key:<8}{e:>9.3%}{n / draws:>9.3%}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="召喚の排出率が設定どおりかカイ二乗検定で確かめる")
+    parser.add_argument("--draws", type=int, default=20_000_000, help="召喚の種類ごとに引く回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--alpha", type=float, default=0.001, help="p 値がこれ未満なら NG")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = [
+        audit(f"通常召喚（{app.gacha_odds_text(app.GACHA_WEIGHTS)}）",
+              app.GACHA_SAMPLER, app.GACHA_WEIGHTS, args.draws, rng, args.alpha),
+        audit(f"SR以上確定（{app.gacha_odds_text(app.SR_GUARANTEED_WEIGHTS)}）",
+              app.SR_GUARANTEED_SAMPLER, app.SR_GUARANTEED_WEIGHTS, args.draws, rng, args.alpha),
+    ]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
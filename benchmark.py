@@ -0,0 +1,205 @@
+"""
+Life Quest - API 呼び出し回数のベンチマーク
+フェイクのスプレッドシート（fake_sheets.py）にタスク履歴を入れ、Streamlit の AppTest でアプリを操作して
+操作ごとのリクエスト数・送受信バイト数・所要時間を表示する。ネットワーク・認証は不要。
+
+    python benchmark.py --history 0 1000 10000 --latency-ms 50
+    python benchmark.py --counters --history 1000 10000 100000
+    python benchmark.py --rewards --history 1000 100000
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import app
+import fake_sheets
+
+
+def _click(at, key):
+    buttons = [b for b in at.button if b.key == key]
+    if not buttons:
+        raise RuntimeError(f"ボタン {key} が見つかりません")
+    buttons[0].click().run()
+
+
+def _open_section(at, section):
+    at.radio(key="section").set_value(section).run()
+
+
+def _writer(at):
+    """セッションの書き込みバッファが使っている WriteBehindWriter（無効・未作成なら None）"""
+    buf = at.session_state["write_buffer"] if "write_buffer" in at.session_state else None
+    return getattr(buf, "writer", None)
+
+
+# (表示名, 操作)。上から順に同じセッションで実行する
+ACTIONS = [
+    ("初回読み込み", lambda at: at.run()),
+    ("再描画（操作なし）", lambda at: at.run()),
+    ("タスク完了", lambda at: _click(at, "task_btn_0")),
+    ("タスク完了後の再描画", lambda at: at.run()),
+    ("ショップを開く", lambda at: _open_section(at, "💎 ショップ")),
+    ("10連召喚", lambda at: _click(at, "gacha10")),
+    ("10連召喚後の再描画", lambda at: at.run()),
+]
+
+
+def seed_rows(history, seed=0):
+    """tasks に history 件（1日数件ずつ過去へさかのぼる）、所持金は10連を引ける額にした初期データ"""
+    rng = random.Random(seed)
+    user = dict(app.DEFAULT_USER, gold="100000")
+    now = datetime.now()
+    tasks = []
+    for i in range(history):
+        name = rng.choice(list(app.TASKS))
+        created = now - timedelta(hours=history - i)
+        tasks.append([str(uuid.uuid4()), "u001", name, app.TASKS[name]["type"], 1, "Completed",
+                      created.strftime(app.TIMESTAMP_FORMAT)])
+    return {"users": [[user.get(c, "") for c in app.USERS_COLUMNS]], "tasks": tasks}
+
+
+def run_session(history, latency_ms, storage_cfg):
+    """1セッション分を実行して [(操作, リクエスト数, うち書き込みスレッドの分, 送信バイト, 受信バイト, 秒)] を返す。
+    write-behind のときは操作のあとバックグラウンド送信が終わるのを待ってから数える（秒には含めない）"""
+    url = f"fake://bench-{history}-{uuid.uuid4().hex[:8]}"
+    sh = fake_sheets.open_fake(url, app.TABLE_COLUMNS, seed_rows(history), latency=latency_ms / 1000)
+    st.cache_resource.clear()  # プールとストレージをこのフェイク向けに作り直す
+    at = AppTest.from_file("app.py", default_timeout=600)
+    at.secrets["sheets"] = {"url": url, "fake_latency_ms": latency_ms, "rate_per_minute": 1e9, "burst": 1e9}
+    at.secrets["storage"] = dict(storage_cfg)
+    results = []
+    try:
+        for label, action in ACTIONS:
+            before = sh.stats()
+            writer = _writer(at)
+            before_bg = writer.api_calls if writer is not None else 0
+            started = time.perf_counter()
+            action(at)
+            elapsed = time.perf_counter() - started
+            if at.exception:
+                raise RuntimeError(f"{label}: {at.exception[0].message}")
+            writer = _writer(at)
+            if writer is not None and not writer.wait_idle(timeout=60):
+                raise RuntimeError(f"{label}: バックグラウンド送信が終わりません（{writer.last_error!r}）")
+            after = sh.stats()
+            background = writer.api_calls - before_bg if writer is not None else 0
+            results.append((label, after["calls"] - before["calls"], background, after["bytes_sent"] - before["bytes_sent"],
+                            after["bytes_received"] - before["bytes_received"], elapsed))
+    finally:
+        fake_sheets.discard_fake(url)
+    return results
+
+
+def _counters_by_filter(df_t, today):
+    """比較用：日ごとに df_t を絞り込む数え方（連続日数は1日につき全行を走査する）"""
+    def count(d):
+        return len(df_t[df_t['dt'].dt.date == d])
+    streak, d = 0, today
+    while count(d) >= 1:
+        streak += 1
+        d -= timedelta(days=1)
+    start_wk = today - timedelta(days=today.weekday())
+    return (count(today), count(today - timedelta(days=1)), len(df_t[df_t['dt'].dt.date >= start_wk]),
+            len(df_t[df_t['dt'].dt.date >= today.replace(day=1)]), streak)
+
+
+def _counters_by_index(df_t, today):
+    """app と同じ数え方：日別件数の索引を1回作って引く"""
+    day_counts = app.task_day_counts(df_t)
+    start_wk = today - timedelta(days=today.weekday())
+    return (app.count_on(day_counts, today), app.count_on(day_counts, today - timedelta(days=1)),
+            app.count_days_since(day_counts, start_wk), app.count_days_since(day_counts, today.replace(day=1)),
+            app.calc_task_streak(df_t, day_counts=day_counts))
+
+
+def bench_counters(history, max_filter_history=20000):
+    """日・週・月の件数と連続日数の計算時間（秒）。(索引, 絞り込み or None, 結果が一致したか)"""
+    df_t = app._records_frame([app.TASKS_COLUMNS] + seed_rows(history)["tasks"])
+    if df_t.empty:
+        df_t = pd.DataFrame(columns=app.TASKS_COLUMNS)
+    df_t = app._with_task_times(df_t)  # アプリと同じく取り込み時に dt / day_no を作る
+    today = date.today()
+    started = time.perf_counter()
+    by_index = _counters_by_index(df_t, today)
+    index_time = time.perf_counter() - started
+    if history > max_filter_history:
+        return index_time, None, None  # 絞り込み版は O(連続日数 × 行数) で時間がかかりすぎる
+    started = time.perf_counter()
+    by_filter = _counters_by_filter(df_t, today)
+    return index_time, time.perf_counter() - started, by_index == by_filter
+
+
+def random_reward_inputs(n, seed=0):
+    """報酬計算の入力を n 件（タスク名, ctx, 当たり, 天気）。ctx の値は n 件分の配列"""
+    rng = np.random.default_rng(seed)
+    ctx = {
+        "job_bonus": rng.choice(sorted({j['bonus'] or "" for j in app.JOBS.values()}), n),
+        "pet_skill": rng.choice(sorted({m['skill'] for m in app.MONSTERS.values()}) + [""], n),
+        "pet_level": rng.integers(1, 11, n), "day_count": rng.integers(0, 6, n), "rebirth": rng.integers(0, 6, n),
+        "event_active": rng.random(n) < 0.3, "weekday": rng.integers(0, 7, n),
+    }
+    ctx.update({title: rng.random(n) < 0.5 for title, _, _ in app.REWARD_TITLE_MULT})
+    return rng.choice(list(app.TASKS), n), ctx, rng.random(n) < 0.5, rng.choice(app.WEATHERS, n)
+
+
+def bench_rewards(n, max_loop=20000):
+    """n 件の報酬計算の時間（秒）。(まとめて, 1件ずつ or None, 結果が一致したか)"""
+    names, ctx, jackpot, weather = random_reward_inputs(n)
+    started = time.perf_counter()
+    vals, dmgs = app.task_rewards_batch(names, ctx, jackpot, weather)
+    batch_time = time.perf_counter() - started
+    if n > max_loop:
+        return batch_time, None, None  # 1件ずつは件数ぶん task_rewards_batch を呼ぶので時間がかかりすぎる
+    started = time.perf_counter()
+    one_by_one = [app.task_reward(names[i], {k: v[i].item() for k, v in ctx.items()}, bool(jackpot[i]), str(weather[i]))[:2]
+                  for i in range(n)]
+    loop_time = time.perf_counter() - started
+    return batch_time, loop_time, one_by_one == list(zip(vals.tolist(), dmgs.tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="操作ごとの Sheets API 呼び出し回数・バイト数・時間を測る")
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 1000, 10000], help="tasks の履歴件数")
+    parser.add_argument("--latency-ms", type=float, default=0, help="フェイクの1リクエストあたりの遅延")
+    parser.add_argument("--write-behind", action="store_true", help="書き込みをバックグラウンド送信にする")
+    parser.add_argument("--event-log", action="store_true", help="users の更新を events ログへの追記にする")
+    parser.add_argument("--counters", action="store_true",
+                        help="API ではなく、日・週・月の件数と連続日数の計算時間を測る（例: --history 1000 100000）")
+    parser.add_argument("--rewards", action="store_true",
+                        help="--history 件のタスク完了報酬を、1件ずつとまとめて計算したときの時間を測る")
+    args = parser.parse_args()
+
+    if args.rewards:
+        print(f"{'n':>8}{'batch(s)':>10}{'loop(s)':>9}  一致")
+        for n in args.history:
+            batch_time, loop_time, same = bench_rewards(n)
+            loop_col = f"{loop_time:>9.3f}" if loop_time is not None else f"{'-':>9}"
+            print(f"{n:>8}{batch_time:>10.3f}{loop_col}  {'-' if same is None else same}")
+        return
+
+    if args.counters:
+        print(f"{'history':>8}{'index(s)':>10}{'filter(s)':>11}  一致")
+        for history in args.history:
+            index_time, filter_time, same = bench_counters(history)
+            filter_col = f"{filter_time:>11.3f}" if filter_time is not None else f"{'-':>11}"
+            print(f"{history:>8}{index_time:>10.3f}{filter_col}  {'-' if same is None else same}")
+        return
+
+    # ディスクキャッシュは使わない（毎回フェイクから読み込む回数を測る）
+    storage_cfg = {"write_behind": args.write_behind, "event_log": args.event_log, "cache_dir": ""}
+    print(f"latency={args.latency_ms}ms write_behind={args.write_behind} event_log={args.event_log}")
+    print(f"{'history':>8}  {'操作':<16}{'calls':>6}{'bg':>4}{'sent(B)':>10}{'recv(B)':>12}{'time(s)':>9}")
+    for history in args.history:
+        for label, calls, background, sent, received, elapsed in run_session(history, args.latency_ms, storage_cfg):
+            print(f"{history:>8}  {label:<16}{calls:>6}{background:>4}{sent:>10}{received:>12}{elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
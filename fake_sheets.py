@@ -0,0 +1,199 @@
+"""
+Life Quest - メモリ上のフェイク Google スプレッドシート
+アプリが使う gspread の Spreadsheet / Worksheet の範囲（get_all_values・get_all_records・update_cell・
+update・append_row(s)・batch_update・values_batch_get・行の deleteDimension）だけを再現する。ネットワーク無しで API 呼び出し回数・
+やり取りしたバイト数を数える用（benchmark.py）。latency で1リクエストごとの遅延を入れられる。
+"""
+import json
+import threading
+import time
+
+import gspread
+
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def open_fake(url, tables, seed_rows=None, latency=0.0):
+    """url（fake://名前）ごとに1つのフェイクを返す。初回は tables {シート名: ヘッダー} で作成し seed_rows を入れる"""
+    with _REGISTRY_LOCK:
+        if url not in _REGISTRY:
+            sh = FakeSpreadsheet(latency=latency)
+            for title, header in tables.items():
+                sh.add_worksheet(title, [list(header)] + [list(r) for r in (seed_rows or {}).get(title, [])])
+            _REGISTRY[url] = sh
+        return _REGISTRY[url]
+
+
+def discard_fake(url):
+    with _REGISTRY_LOCK:
+        _REGISTRY.pop(url, None)
+
+
+def _size(obj):
+    return len(json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _cell(value):
+    """シートから読んだときの見え方（API は文字列で返す）"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return str(value)
+
+
+class FakeSpreadsheet:
+    """gspread.Spreadsheet の代わり。calls / bytes_sent / bytes_received と log（(シート, メソッド)）を記録する"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.RLock()
+        self._worksheets = {}
+        self.log = []
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _request(self, sheet, method, payload, response):
+        """1リクエスト分を記録して遅延を入れる"""
+        with self._lock:
+            self.log.append((sheet, method))
+            self.calls += 1
+            self.bytes_sent += _size(payload)
+            self.bytes_received += _size(response)
+        if self.latency:
+            time.sleep(self.latency)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "bytes_sent": self.bytes_sent, "bytes_received": self.bytes_received}
+
+    def add_worksheet(self, title, rows=None, cols=None):
+        with self._lock:
+            ws = FakeWorksheet(self, title, rows if isinstance(rows, list) else [], sheet_id=len(self._worksheets))
+            self._worksheets[title] = ws
+            return ws
+
+    def worksheets(self):
+        with self._lock:
+            result = list(self._worksheets.values())
+        self._request("", "worksheets", {}, [ws.title for ws in result])
+        return result
+
+    def worksheet(self, title):
+        self._request("", "worksheet", {"title": title}, {"title": title})
+        if title not in self._worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def batch_update(self, body):
+        """Spreadsheet.batch_update。行の deleteDimension だけ（requests の順に適用）"""
+        with self._lock:
+            by_id = {ws.id: ws for ws in self._worksheets.values()}
+            for request in body.get("requests", []):
+                rg = request["deleteDimension"]["range"]
+                if rg["dimension"] != "ROWS":
+                    raise NotImplementedError(rg["dimension"])
+                del by_id[rg["sheetId"]]._rows[rg["startIndex"]:rg["endIndex"]]
+        return self._request("", "batch_update", body, {"replies": [{} for _ in body.get("requests", [])]})
+
+    def values_batch_get(self, ranges, params=None):
+        with self._lock:
+            value_ranges = []
+            for rg in ranges:
+                title, _, a1 = rg.partition("!")
+                if title not in self._worksheets:
+                    raise gspread.exceptions.WorksheetNotFound(title)
+                value_ranges.append({"range": rg, "values": self._worksheets[title]._read(a1)})
+        return self._request("", "values_batch_get", {"ranges": list(ranges)}, {"valueRanges": value_ranges})
+
+
+class FakeWorksheet:
+    """gspread.Worksheet の代わり（値はすべてメモリ上の2次元リスト）"""
+
+    def __init__(self, spreadsheet, title, rows, sheet_id=0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self._rows = [[_cell(v) for v in r] for r in rows]
+
+    @property
+    def row_count(self):
+        return len(self._rows)
+
+    @property
+    def col_count(self):
+        return max((len(r) for r in self._rows), default=0)
+
+    def _read(self, a1=""):
+        """A1 範囲（省略時はシート全体）の値。末尾の空セル・空行は API と同じく返さない"""
+        if a1:
+            grid = gspread.utils.a1_range_to_grid_range(a1)
+            r0, r1 = grid.get("startRowIndex", 0), grid.get("endRowIndex", len(self._rows))
+            c0, c1 = grid.get("startColumnIndex", 0), grid.get("endColumnIndex", None)
+            rows = [r[c0:c1] for r in self._rows[r0:r1]]
+        else:
+            rows = [list(r) for r in self._rows]
+        rows = [list(r) for r in rows]
+        for r in rows:
+            while r and r[-1] == "":
+                r.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def _set(self, row, col, value):
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = _cell(value)
+
+    def get_all_values(self, **kwargs):
+        with self.spreadsheet._lock:
+            values = self._read()
+        return self.spreadsheet._request(self.title, "get_all_values", {}, values)
+
+    def get_all_records(self, **kwargs):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, gspread.utils.numericise_all((r + [""] * len(header))[:len(header)])))
+                for r in values[1:]]
+
+    def update_cell(self, row, col, value):
+        with self.spreadsheet._lock:
+            self._set(row, col, value)
+        return self.spreadsheet._request(self.title, "update_cell", {"row": row, "col": col, "value": value}, {})
+
+    def batch_update(self, data, **kwargs):
+        with self.spreadsheet._lock:
+            for item in data:
+                row, col = gspread.utils.a1_to_rowcol(item["range"].partition("!")[2] or item["range"])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set(row + i, col + j, value)
+        return self.spreadsheet._request(self.title, "batch_update", {"data": data}, {})
+
+    def update(self, values=None, range_name=None, **kwargs):
+        with self.spreadsheet._lock:
+            row, col = gspread.utils.a1_to_rowcol(range_name or "A1")
+            for i, cells in enumerate(values):
+                for j, value in enumerate(cells):
+                    self._set(row + i, col + j, value)
+        return self.spreadsheet._request(self.title, "update", {"range": range_name, "values": values}, {})
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        with self.spreadsheet._lock:
+            # 実際の API と同じく、表の最終行（空行を除く）の次から書く
+            end = len(self._read())
+            del self._rows[end:]
+            self._rows.extend([_cell(v) for v in r] for r in values)
+        return self.spreadsheet._request(self.title, "append_rows", {"values": values}, {})
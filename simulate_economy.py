@@ -0,0 +1,340 @@
+"""
+Life Quest - ゲーム内経済のモンテカルロシミュレーター（バランス調整用）
+架空のユーザーを大勢・何か月分も遊ばせて、ゴールド・経験値・階層・転生回数の分布、UR を引くまでの日数、
+ゴールドの入り（ソース）と出（シンク）の内訳を表示する。報酬・召喚・イベントの表は app.py のもの
+（TASKS と task_rewards_batch、GACHA_SAMPLER / SR_GUARANTEED_SAMPLER / GACHA_PRICES / PIECE_GOLD、
+FLOOR_EVENTS、RANDOM_BOX_REWARDS、LOGIN_BONUS、MISSIONS、SEASONAL_MISSIONS、ACHIEVEMENTS、WEEKLY_BOSSES）を
+そのまま使う。1日ごとに全ユーザー分を NumPy の配列でまとめて進める。ネットワーク・認証は不要。
+
+    python simulate_economy.py --users 10000 --days 365
+    python simulate_economy.py --users 100000 --days 365 --processes 4 --reserve 0 --ten-pulls 3
+
+ユーザーの動き（簡略化）:
+- 毎日、ユーザーごとの確率でアプリを開く。開いた日はログインボーナス・無料召喚を受け取り、
+  1 + ポアソン分布の数だけタスクを完了する（タスクはランダム、ジョブは最初にランダムで決めて固定）。
+- 受け取れる報酬（デイリー・ウィークリー・ミッション・季節ミッション・実績・週間ボス）はその日のうちに受け取る。
+- 相棒は金運・応援スキルの所持モンスターのうちレベルが一番高いもの。100階に着いたら翌日転生する。
+- ゴールドの使い道は召喚だけ：--reserve を残せるときに週1チケット → 月1SR確定 → 10連（1日 --ten-pulls 回まで）。
+- 週間ボスのダメージはアプリと同じく週をまたいでも減らない。
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+import app
+
+DAILY_QUEST = (3, 200)     # デイリークエスト（3回で200G）。app.py の「デイリークエスト」と同じ
+WEEKLY_QUEST = (15, 500)   # ウィークリークエスト（週15回で500G）
+RANDOM_BOX_RATE = 0.05     # タスク完了時のランダム報酬ボックス
+EVENT_GOLD_SAMPLES = 4096  # 階層イベントの金額（FLOOR_EVENTS の gold_fn）は先に引いておいた値から選ぶ
+
+MONSTER_NAMES = list(app.MONSTERS)
+MONSTER_RARITY = np.array([app.MONSTERS[m]["rarity"] for m in MONSTER_NAMES])
+PIECE_GOLD = np.array([app.PIECE_GOLD.get(r, 10) for r in MONSTER_RARITY], dtype=np.int64)
+IS_UR = MONSTER_RARITY == "UR"
+IS_BOOST_PET = np.array([app.MONSTERS[m]["skill"] in ("gold_up", "xp_up") for m in MONSTER_NAMES])
+TASK_NAMES = np.array(list(app.TASKS), dtype=object)
+
+SOURCES = ["タスク報酬", "階層イベント（宝箱）", "ランダムボックス", "ピース変換", "ログインボーナス",
+           "デイリークエスト", "ウィークリークエスト", "ミッション", "季節ミッション", "実績", "週間ボス"]
+SINKS = ["階層イベント（トラップ）", "週1チケット", "月1SR確定", "10連召喚"]
+
+
+def resolve_draws(levels, users, monsters, level_up):
+    """召喚結果を所持レベル表（ユーザー × モンスター）に反映し、ユーザーごとのピース変換ゴールドを返す。
+    users は重複しないこと（1人1体ずつ）。InventoryIndex.resolve と同じく新規→レベル1、重複→レベルアップか変換"""
+    current = levels[users, monsters]
+    new = current == 0
+    up = (current > 0) & (current < app.MONSTER_MAX_LEVEL) & level_up
+    levels[users, monsters] = np.where(new, 1, np.where(up, current + 1, current))
+    return np.where(new | up, 0, PIECE_GOLD[monsters])
+
+
+def _event_gold_table(seed):
+    """FLOOR_EVENTS の (重みの累積比率, イベントごとの金額の標本)。gold_fn は random を使うので seed で固定して引く"""
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        weights = np.array([w for _, w, _, _ in app.FLOOR_EVENTS], dtype=float)
+        samples = np.array([[fn() for _ in range(EVENT_GOLD_SAMPLES)] for _, _, _, fn in app.FLOOR_EVENTS],
+                           dtype=np.int64)
+    finally:
+        random.setstate(state)
+    return np.cumsum(weights / weights.sum()), samples
+
+
+def simulate(users, days, start, seed, active=0.7, tasks_per_day=3.0, max_tasks=8, reserve=1000, ten_pulls=1):
+    """users 人 × days 日を1回分シミュレートする。(ユーザーごとの結果 {名前: 配列}, 収支 {項目: ゴールド}) を返す"""
+    rng = np.random.default_rng(seed)
+    n = users
+    normal_sampler, sr_sampler = app.GACHA_SAMPLER, app.SR_GUARANTEED_SAMPLER
+    event_cum, event_samples = _event_gold_table(seed)
+    box_kind = np.array([kind for kind, _, _ in app.RANDOM_BOX_REWARDS])
+    box_amount = np.array([amount for _, amount, _ in app.RANDOM_BOX_REWARDS], dtype=np.int64)
+    box_gold_table = np.where(box_kind == "gold", box_amount, 0)
+    box_xp_table = np.where(box_kind == "xp", box_amount, 0)
+    box_ticket = box_kind == "gacha"
+    login_bonus = np.array([app.LOGIN_BONUS.get(i, 0) for i in range(max(app.LOGIN_BONUS) + 2)], dtype=np.int64)
+    missions = list(app.MISSIONS.values())
+    achievements = list(app.ACHIEVEMENTS.values())
+
+    # ユーザーの性質（アプリを開く確率・1日のタスク数の平均）とジョブ
+    p_active = rng.beta(4 * active, 4 * (1 - active), n) if 0 < active < 1 else np.full(n, float(active))
+    extra_tasks = rng.gamma(2.0, max(tasks_per_day - 1, 1e-9) / 2.0, n)
+    job_keys = list(app.JOBS)
+    job_bonus = np.array([app.JOBS[k]["bonus"] or "" for k in job_keys])[rng.integers(0, len(job_keys), n)]
+
+    # 状態（users 行の列にあたるもの）
+    gold = np.zeros(n, dtype=np.int64)
+    xp = np.zeros(n, dtype=np.int64)
+    xp_earned = np.zeros(n, dtype=np.int64)
+    level = np.ones(n, dtype=np.int64)
+    next_xp = np.full(n, 100, dtype=np.int64)
+    floor = np.ones(n, dtype=np.int64)
+    rebirth = np.zeros(n, dtype=np.int64)
+    login_streak = np.zeros(n, dtype=np.int64)
+    streak = np.zeros(n, dtype=np.int64)
+    total_tasks = np.zeros(n, dtype=np.int64)
+    week_tasks = np.zeros(n, dtype=np.int64)
+    month_tasks = np.zeros(n, dtype=np.int64)
+    month_key_tasks = np.zeros(n, dtype=np.int64)
+    boss_damage = np.zeros(n, dtype=np.int64)
+    titles = {title: np.zeros(n, dtype=bool) for title, _, _ in app.REWARD_TITLE_MULT}
+    mission_claimed = np.zeros((len(missions), n), dtype=bool)
+    achievement_claimed = np.zeros((len(achievements), n), dtype=bool)
+    weekly_claimed = np.zeros(n, dtype=bool)
+    boss_claimed = np.zeros(n, dtype=bool)
+    weekly_ticket = np.zeros(n, dtype=bool)
+    monthly_sr = np.zeros(n, dtype=bool)
+    seasonal_claimed = np.zeros(n, dtype=bool)
+    levels = np.zeros((n, len(MONSTER_NAMES)), dtype=np.int16)
+    ur_day = np.full(n, -1, dtype=np.int64)
+    ledger = dict.fromkeys(SOURCES + SINKS, 0)
+
+    def earn(source, u, amount):
+        gold[u] += amount
+        ledger[source] += int(np.sum(amount)) if np.ndim(amount) else int(amount) * len(u)
+
+    def spend(sink, u, price):
+        gold[u] -= price
+        ledger[sink] -= int(price) * len(u)
+
+    def gain_xp(u, amount):
+        """_apply_xp_gain と同じ（あふれた分は持ち越す）"""
+        xp[u] += amount
+        xp_earned[u] += amount
+        up = u[xp[u] >= next_xp[u]]
+        xp[up] -= next_xp[up]
+        level[up] += 1
+        next_xp[up] = (level[up] ** 1.5 * 100).astype(np.int64)
+
+    def pull(u, sampler, count, level_up):
+        for _ in range(count):
+            earn("ピース変換", u, resolve_draws(levels, u, sampler.draw_indices(len(u), rng), level_up))
+
+    for day in range(days):
+        today = start + timedelta(days=day)
+        weekday = today.weekday()
+        if day == 0 or weekday == 0:
+            week_tasks[:] = 0
+            weekly_claimed[:] = boss_claimed[:] = weekly_ticket[:] = False
+        if day == 0 or today.day == 1:
+            month_tasks[:] = month_key_tasks[:] = 0
+            monthly_sr[:] = seasonal_claimed[:] = False
+
+        # 100階に着いていたら転生
+        reborn = floor >= app.MAX_FLOOR
+        floor[reborn] = 1
+        rebirth[reborn] += 1
+
+        # ログイン（ログインボーナス）
+        opened = rng.random(n) < p_active
+        visitors = np.flatnonzero(opened)
+        login_streak[visitors] += 1
+        earn("ログインボーナス", visitors, login_bonus[np.minimum(login_streak[visitors], len(login_bonus) - 1)])
+
+        # タスク：今日の全ユーザー分（ユーザー × 何件目）の報酬を task_rewards_batch でまとめて計算
+        k = np.where(opened, np.minimum(max_tasks, 1 + rng.poisson(extra_tasks)), 0)
+        owner = np.repeat(np.arange(n), k)
+        slot = np.arange(len(owner)) - np.repeat(np.cumsum(k) - k, k)
+        task_idx = rng.integers(0, len(TASK_NAMES), len(owner))
+        pet_level = levels[:, IS_BOOST_PET].max(axis=1)[owner]
+        ctx = {
+            "job_bonus": job_bonus[owner], "pet_skill": np.where(pet_level > 0, "gold_up", ""),
+            "pet_level": np.maximum(pet_level, 1), "day_count": slot, "rebirth": rebirth[owner],
+            "event_active": weekday >= 5, "weekday": weekday,
+        }
+        ctx.update({title: flags[owner] for title, flags in titles.items()})
+        val, dmg = app.task_rewards_batch(TASK_NAMES[task_idx], ctx, rng.random(len(owner)) < 0.5,
+                                          rng.choice(app.WEATHERS, len(owner)))
+        event = np.minimum(np.searchsorted(event_cum, rng.random(len(owner)), side="right"), len(event_cum) - 1)
+        event_gold = event_samples[event, rng.integers(0, EVENT_GOLD_SAMPLES, len(owner))]
+        box = np.where(rng.random(len(owner)) < RANDOM_BOX_RATE, rng.integers(0, len(box_kind), len(owner)), -1)
+        box_gold = np.where(box >= 0, box_gold_table[box], 0)
+        box_xp = np.where(box >= 0, box_xp_table[box], 0)
+        ledger["タスク報酬"] += int(val.sum())
+        ledger["ランダムボックス"] += int(box_gold.sum())
+        floor = np.minimum(app.MAX_FLOOR, floor + k)
+        boss_damage += np.bincount(owner, dmg, minlength=n).astype(np.int64)
+        xp_earned += np.bincount(owner, val + box_xp, minlength=n).astype(np.int64)
+
+        # 所持金・経験値は1件目・2件目…の順に反映（トラップの 0G 止め・レベルアップは順番に依る）
+        by_slot = np.argsort(slot, kind="stable")
+        bounds = np.cumsum(np.bincount(slot, minlength=1))
+        for idx in np.split(by_slot, bounds[:-1]):
+            u = owner[idx]
+            before = gold[u] + val[idx]
+            after = np.maximum(0, before + event_gold[idx])
+            applied = after - before
+            ledger["階層イベント（宝箱）"] += int(applied[applied > 0].sum())
+            ledger["階層イベント（トラップ）"] += int(applied[applied < 0].sum())
+            gold[u] = after + box_gold[idx]
+            gained = xp[u] + val[idx]
+            up = gained >= next_xp[u]
+            level[u[up]] += 1
+            next_xp[u[up]] = (level[u[up]] ** 1.5 * 100).astype(np.int64)
+            xp[u] = np.where(up, 0, gained) + box_xp[idx]
+        # ガチャチケットはすぐ使う（同じ人が2枚引いたら1枚ずつ）
+        tickets = owner[box_ticket[np.maximum(box, 0)] & (box >= 0)]
+        while len(tickets):
+            once, first = np.unique(tickets, return_index=True)
+            pull(once, normal_sampler, 1, False)
+            tickets = np.delete(tickets, first)
+
+        # 集計（連続日数・称号・今週/今月の件数）
+        total_tasks += k
+        week_tasks += k
+        month_tasks += k
+        seasonal = app.SEASONAL_MISSIONS.get(today.month)
+        if seasonal:
+            is_key = np.array([seasonal["task_key"] in name for name in TASK_NAMES])
+            month_key_tasks += np.bincount(owner[is_key[task_idx]], minlength=n)
+        streak = np.where(k > 0, streak + 1, 0)
+        titles["streak_7"] |= streak >= 7
+        titles["streak_30"] |= streak >= 30
+        titles["monthly_50"] |= month_tasks >= 50
+
+        # その日に受け取れる報酬
+        earn("デイリークエスト", np.flatnonzero(k >= DAILY_QUEST[0]), DAILY_QUEST[1])
+        weekly = np.flatnonzero((week_tasks >= WEEKLY_QUEST[0]) & ~weekly_claimed)
+        weekly_claimed[weekly] = True
+        earn("ウィークリークエスト", weekly, WEEKLY_QUEST[1])
+        for i, mission in enumerate(missions):
+            progress = k if mission["type"] == "daily" else week_tasks
+            done = np.flatnonzero((progress >= mission["target"]) & ~mission_claimed[i])
+            mission_claimed[i, done] = True
+            earn("ミッション", done, mission["reward"])
+        if seasonal:
+            done = np.flatnonzero((month_key_tasks >= seasonal["target"]) & ~seasonal_claimed)
+            seasonal_claimed[done] = True
+            earn("季節ミッション", done, seasonal["reward"])
+        boss = app.WEEKLY_BOSSES[today.isocalendar()[1] % len(app.WEEKLY_BOSSES)]
+        defeated = np.flatnonzero(opened & (boss_damage >= boss["hp"]) & ~boss_claimed)
+        boss_claimed[defeated] = True
+        earn("週間ボス", defeated, boss.get("reward", 1000))
+        gain_xp(defeated, boss.get("reward_xp", 500))
+        counters = {"total_tasks": total_tasks, "floor": floor, "rebirth": rebirth, "level": level,
+                    "ur_owned": (levels[:, IS_UR] > 0).any(axis=1), "streak": streak}
+        for i, ach in enumerate(achievements):
+            done = np.flatnonzero((counters[ach["counter"]] >= ach["threshold"]) & ~achievement_claimed[i])
+            achievement_claimed[i, done] = True
+            earn("実績", done, ach["reward"])
+
+        # 召喚（無料1回 → 週1チケット → 月1SR確定 → 10連）
+        pull(visitors, normal_sampler, 1, True)
+        prices = app.GACHA_PRICES
+        buyers = np.flatnonzero(opened & ~weekly_ticket & (gold >= prices["weekly_ten"] + reserve))
+        weekly_ticket[buyers] = True
+        spend("週1チケット", buyers, prices["weekly_ten"])
+        pull(buyers, normal_sampler, 10, True)
+        buyers = np.flatnonzero(opened & ~monthly_sr & (gold >= prices["monthly_sr"] + reserve))
+        monthly_sr[buyers] = True
+        spend("月1SR確定", buyers, prices["monthly_sr"])
+        pull(buyers, sr_sampler, 1, True)
+        for _ in range(ten_pulls):
+            buyers = np.flatnonzero(opened & (gold >= prices["ten"] + reserve))
+            spend("10連召喚", buyers, prices["ten"])
+            pull(buyers, normal_sampler, 10, False)
+        ur_day = np.where((ur_day < 0) & (levels[:, IS_UR] > 0).any(axis=1), day, ur_day)
+
+    results = {"gold": gold, "level": level, "xp_earned": xp_earned, "floor": floor, "rebirth": rebirth,
+               "tasks": total_tasks, "ur_day": ur_day}
+    return results, ledger
+
+
+def _run_chunk(job):
+    users, days, start, seed, options = job
+    return simulate(users, days, start, seed, **options)
+
+
+def run(users, days, start, seed, processes=1, **options):
+    """users 人を processes 個のプロセスに分けて simulate し、結果をつなげる（プロセスごとに乱数の系列を分ける）"""
+    processes = max(1, min(processes, users))
+    sizes = [users // processes + (1 if i < users % processes else 0) for i in range(processes)]
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(processes)]
+    jobs = [(size, days, start, s, options) for size, s in zip(sizes, seeds)]
+    if processes == 1:
+        parts = [_run_chunk(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_run_chunk, jobs))
+    results = {key: np.concatenate([r[key] for r, _ in parts]) for key in parts[0][0]}
+    ledger = {key: sum(l[key] for _, l in parts) for key in parts[0][1]}
+    return results, ledger
+
+
+def report(results, ledger, users, days):
+    labels = {"gold": "所持ゴールド", "level": "レベル", "xp_earned": "獲得経験値", "floor": "階層",
+              "rebirth": "転生回数", "tasks": "完了タスク数"}
+    print(f"{'':<14}{'p10':>10}{'p50':>10}{'p90':>10}{'平均':>10}")
+    for key, label in labels.items():
+        p10, p50, p90 = np.percentile(results[key], [10, 50, 90])
+        print(f"{label:<14}{p10:>10.0f}{p50:>10.0f}{p90:>10.0f}{results[key].mean():>10.1f}")
+
+    ur_day = results["ur_day"]
+    reached = ur_day[ur_day >= 0]
+    line = f"\nUR 獲得: {len(reached) / users:.1%} のユーザー"
+    if len(reached):
+        p10, p50, p90 = np.percentile(reached + 1, [10, 50, 90])
+        line += f"（獲得までの日数 p10 {p10:.0f} / p50 {p50:.0f} / p90 {p90:.0f}）"
+    print(line)
+
+    per_day = users * days
+    print(f"\n{'ゴールド収支':<16}{'合計':>16}{'1人1日あたり':>14}")
+    for key in SOURCES + SINKS:
+        print(f"{key:<16}{ledger[key]:>16,}{ledger[key] / per_day:>14.2f}")
+    source, sink = sum(ledger[k] for k in SOURCES), -sum(ledger[k] for k in SINKS)
+    print(f"{'入り（ソース）':<16}{source:>16,}{source / per_day:>14.2f}")
+    print(f"{'出（シンク）':<16}{sink:>16,}{sink / per_day:>14.2f}")
+    print(f"シンク / ソース = {sink / source:.1%}" if source else "ソースなし")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ゲーム内経済（ゴールド・経験値・階層・召喚）のモンテカルロシミュレーション")
+    parser.add_argument("--users", type=int, default=10000, help="ユーザー数")
+    parser.add_argument("--days", type=int, default=365, help="日数")
+    parser.add_argument("--start", type=date.fromisoformat, default=date.today(), help="開始日（曜日・週・月の判定に使う）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=1, help="ユーザーを分けて並列に動かすプロセス数")
+    parser.add_argument("--active", type=float, default=0.7, help="アプリを開く日の割合（ユーザー平均）")
+    parser.add_argument("--tasks-per-day", type=float, default=3.0, help="開いた日のタスク数（ユーザー平均）")
+    parser.add_argument("--max-tasks", type=int, default=8, help="1日のタスク数の上限")
+    parser.add_argument("--reserve", type=int, default=1000, help="有料の召喚をしても残しておくゴールド")
+    parser.add_argument("--ten-pulls", type=int, default=1, help="1日に10連召喚する回数の上限")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results, ledger = run(args.users, args.days, args.start, args.seed, args.processes, active=args.active,
+                          tasks_per_day=args.tasks_per_day, max_tasks=args.max_tasks, reserve=args.reserve,
+                          ten_pulls=args.ten_pulls)
+    elapsed = time.perf_counter() - started
+    print(f"users={args.users} days={args.days} start={args.start} processes={args.processes} ({elapsed:.1f}s)\n")
+    report(results, ledger, args.users, args.days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""フェイクのスプレッドシートに対する Sheets API 呼び出し回数（benchmark.py と同じ数え方）"""
+import os
+import uuid
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import app
+import benchmark
+import fake_sheets
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+@pytest.fixture
+def fake_url():
+    url = f"fake://test-{uuid.uuid4().hex[:8]}"
+    yield url
+    fake_sheets.discard_fake(url)
+
+
+def _calls(sh, action):
+    """action の間に発行されたリクエスト [(シート, メソッド)]"""
+    start = len(sh.log)
+    action()
+    return sh.log[start:]
+
+
+def test_buffer_batches_writes_per_table(fake_url):
+    sh = fake_sheets.open_fake(fake_url, app.TABLE_COLUMNS, {"users": [app.DEFAULT_USER_ROW]})
+    quota = app.SheetsQuota(rate_per_minute=1e9, burst=1e9)
+    pool = app.SheetPool({}, fake_url, quota)
+    buf = app.SheetWriteBuffer(app.SheetsBackend(pool))
+    assert _calls(sh, lambda: pool.worksheet("users")) == [("", "worksheets")]  # 一覧の取得は初回だけ
+
+    users, tasks = buf.table("users"), buf.table("tasks")
+    users.update_field(2, "gold", 10)
+    users.update_field(2, "current_xp", 5)
+    users.update_field(2, "gold", 20)
+    tasks.append_row(["t1", "u001", "読書", "daily", 1, "Completed", "2026-01-01 00:00:00"])
+    tasks.append_row(["t2", "u001", "読書", "daily", 1, "Completed", "2026-01-01 00:01:00"])
+    assert buf.pending() == (2, 2)
+
+    log = _calls(sh, buf.flush)
+    assert sorted(log) == [("tasks", "append_rows"), ("users", "batch_update")]
+    assert buf.api_calls == 2
+    assert sh.worksheet("users").get_all_records()[0]["gold"] == 20
+
+    # 何も積んでいなければ送らない
+    assert _calls(sh, buf.flush) == []
+    assert buf.api_calls == 2
+
+
+def test_task_completion_and_clean_rerun(fake_url):
+    sh = fake_sheets.open_fake(fake_url, app.TABLE_COLUMNS, benchmark.seed_rows(20))
+    st.cache_resource.clear()
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.secrets["sheets"] = {"url": fake_url, "rate_per_minute": 1e9, "burst": 1e9}
+    at.secrets["storage"] = {"write_behind": False, "event_log": False, "cache_dir": ""}
+
+    assert len(_calls(sh, at.run)) == 2  # ワークシート一覧 + 全シートの一括読み込み
+    assert not at.exception
+    assert _calls(sh, at.run) == []
+
+    log = _calls(sh, lambda: benchmark._click(at, "task_btn_0"))
+    assert not at.exception
+    assert sorted(log) == [("task_rollups", "append_rows"), ("tasks", "append_rows"), ("users", "batch_update")]
+
+    assert _calls(sh, at.run) == [("", "values_batch_get")]  # 書き込んだ分を読み直す
+    assert _calls(sh, at.run) == []
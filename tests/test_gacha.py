@@ -0,0 +1,41 @@
+"""召喚のエイリアス表：MONSTERS との対応と、audit_gacha の排出率監査（回数を減らして固定シードで）"""
+import numpy as np
+import pytest
+
+import app
+import audit_gacha
+
+SAMPLERS = [("通常召喚", app.GACHA_SAMPLER, app.GACHA_WEIGHTS),
+            ("SR以上確定", app.SR_GUARANTEED_SAMPLER, app.SR_GUARANTEED_WEIGHTS)]
+
+
+@pytest.mark.parametrize("label,sampler,weights", SAMPLERS)
+def test_alias_table_covers_monsters(label, sampler, weights):
+    assert list(sampler.names) == list(app.MONSTERS)
+    assert len(sampler.prob) == len(sampler.alias) == len(app.MONSTERS)
+    assert ((sampler.prob >= 0) & (sampler.prob <= 1)).all()
+    assert ((sampler.alias >= 0) & (sampler.alias < len(app.MONSTERS))).all()
+    # 表から戻した確率が設定どおり（モンスターのいないレアリティも無い）
+    _, monster_p, empty = audit_gacha.configured_odds(weights)
+    assert empty == []
+    n = len(sampler.prob)
+    table_p = sampler.prob / n
+    np.add.at(table_p, sampler.alias, (1 - sampler.prob) / n)
+    np.testing.assert_allclose(table_p, monster_p, atol=1e-12)
+
+
+def test_every_monster_can_be_summoned():
+    """MONSTERS に増やしたモンスターのレアリティが通常召喚の重みにあること"""
+    assert {m["rarity"] for m in app.MONSTERS.values()} <= set(app.GACHA_WEIGHTS)
+    assert (app.GACHA_SAMPLER.p > 0).all()
+
+
+@pytest.mark.parametrize("label,sampler,weights", SAMPLERS)
+def test_audit_passes_with_fixed_seed(label, sampler, weights):
+    assert audit_gacha.audit(label, sampler, weights, 200_000, np.random.default_rng(0), alpha=0.001)
+
+
+def test_audit_detects_rarity_without_monsters():
+    weights = dict(app.GACHA_WEIGHTS, LR=50)
+    sampler = app.GachaSampler(weights)
+    assert not audit_gacha.audit("存在しないレアリティ", sampler, weights, 200_000, np.random.default_rng(0), alpha=0.001)
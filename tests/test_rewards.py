@@ -0,0 +1,101 @@
+"""タスク完了報酬：まとめて計算（task_rewards_batch）と1件ずつの計算（task_reward・元の if 文の計算）が一致するか"""
+import itertools
+
+import numpy as np
+import pytest
+
+import app
+import benchmark
+
+BASE_CTX = {"job_bonus": "", "pet_skill": "", "pet_level": 1, "day_count": 3, "rebirth": 0,
+            "event_active": False, "weekday": 2, "streak_7": False, "streak_30": False, "monthly_50": False}
+
+
+def reference_reward(task_name, ctx, jackpot, weather):
+    """倍率を1つずつ int() で切り捨てていく、まとめて計算にする前の書き方（比較用）"""
+    t_data = app.TASKS[task_name]
+    val = int(t_data['reward'] * app.DIFFICULTY_MULT.get(t_data.get('difficulty', 'normal'), 1.0))
+    bonus = 1.0
+    if ctx["job_bonus"] == "ALL_RANDOM":
+        bonus = 2.0 if jackpot else 0.1
+    elif ctx["job_bonus"] == t_data['type']:
+        bonus = 1.5
+    if ctx["pet_skill"] in ("gold_up", "xp_up"):
+        bonus *= 1.1 * (1.0 + (ctx["pet_level"] - 1) * 0.05)
+    val = max(1, int(val * bonus))
+    if ctx["day_count"] == 0:
+        val = max(1, int(val * 1.5))
+    val += {1: 10, 2: 20}.get(ctx["day_count"], 0)
+    if ctx["rebirth"] > 0:
+        val = max(1, int(val * (1 + 0.1 * ctx["rebirth"])))
+    for title, mult, _ in app.REWARD_TITLE_MULT:
+        if ctx[title]:
+            val = max(1, int(val * mult))
+    if ctx["event_active"]:
+        val = max(1, int(val * 1.2))
+    val = max(1, int(val * {0: 1.1, 4: 1.05}.get(ctx["weekday"], 1.0)))
+    if (weather == "rainy" and t_data['type'] in ("magic", "holy")) or (weather == "sunny" and t_data['type'] == "physical"):
+        val = max(1, int(val * 1.05))
+    is_weak = t_data['type'] == app.BOSS_WEAK_CYCLE[ctx["weekday"] % 3]
+    return val, val * 2 if is_weak else val
+
+
+def boundary_cases():
+    """境目の値を1つずつ BASE_CTX に入れたもの × 全タスク × 天気"""
+    variations = [{}]
+    variations += [{"day_count": d} for d in (0, 1, 2)]
+    variations += [{"pet_skill": s, "pet_level": lv} for s in ("gold_up", "xp_up", "chest_up") for lv in (1, 10)]
+    variations += [{"job_bonus": j} for j in (None, "physical", "magic", "ALL_RANDOM")]  # None は職業ボーナス無し
+    variations += [{"rebirth": r} for r in (1, 5)]
+    variations += [{title: True} for title, _, _ in app.REWARD_TITLE_MULT]
+    variations += [{title: True for title, _, _ in app.REWARD_TITLE_MULT}]
+    variations += [{"event_active": True}]
+    variations += [{"weekday": w} for w in range(7)]
+    # 全部乗せ（倍率が重なったときの切り捨ての順番）
+    variations += [{"job_bonus": "ALL_RANDOM", "pet_skill": "gold_up", "pet_level": 10, "day_count": 0, "rebirth": 5,
+                    "event_active": True, "weekday": 0, **{title: True for title, _, _ in app.REWARD_TITLE_MULT}}]
+    for variation, task_name, weather, jackpot in itertools.product(variations, app.TASKS, app.WEATHERS, (False, True)):
+        yield task_name, dict(BASE_CTX, **variation), jackpot, weather
+
+
+CASES = list(boundary_cases())
+
+
+def _batch(cases):
+    names = [c[0] for c in cases]
+    ctx = {key: np.array([c[1][key] for c in cases]) for key in BASE_CTX}
+    return app.task_rewards_batch(names, ctx, np.array([c[2] for c in cases]), np.array([c[3] for c in cases]))
+
+
+def test_boundary_cases_match_reference():
+    vals, dmgs = _batch(CASES)
+    expected = [reference_reward(*c) for c in CASES]
+    assert list(zip(vals.tolist(), dmgs.tolist())) == expected
+
+
+@pytest.mark.parametrize("task_name,ctx,jackpot,weather", CASES[::7])
+def test_task_reward_matches_batch_row(task_name, ctx, jackpot, weather):
+    val, dmg, _ = app.task_reward(task_name, ctx, jackpot, weather)
+    assert (val, dmg) == reference_reward(task_name, ctx, jackpot, weather)
+
+
+def test_random_inputs_match_one_by_one():
+    names, ctx, jackpot, weather = benchmark.random_reward_inputs(2000, seed=1)
+    vals, dmgs = app.task_rewards_batch(names, ctx, jackpot, weather)
+    for i in range(len(names)):
+        row = {k: v[i].item() for k, v in ctx.items()}
+        expected = reference_reward(names[i], row, bool(jackpot[i]), str(weather[i]))
+        assert app.task_reward(names[i], row, bool(jackpot[i]), str(weather[i]))[:2] == expected
+        assert (int(vals[i]), int(dmgs[i])) == expected
+
+
+def test_scalar_context_broadcasts():
+    """ctx がスカラーのとき（アプリからの呼び出し）も配列のときと同じ"""
+    ctx = dict(BASE_CTX, pet_skill="gold_up", pet_level=10, day_count=0, event_active=True, weekday=0)
+    vals, dmgs = app.task_rewards_batch(list(app.TASKS), ctx, False, "sunny")
+    assert list(zip(vals.tolist(), dmgs.tolist())) == [reference_reward(n, ctx, False, "sunny") for n in app.TASKS]
+
+
+def test_unknown_task_raises():
+    with pytest.raises(KeyError):
+        app.task_rewards_batch(["存在しないタスク"], BASE_CTX)